@@ -1,3 +1,4 @@
+import time
 import uuid
 import structlog
 from fastapi import APIRouter, Depends, HTTPException
@@ -5,7 +6,9 @@ from sqlmodel import select
 from core.database import AsyncSessionLocal
 from models.base import User, Conversation, Message
 from api.dependencies import get_current_user
-from services.retrieval import retrieve_context
+from services.retrieval import retrieve, needs_rewrite
+from services.answer_cache import answer_cache, replay_answer
+from core.embeddings import generate_query_embedding, EmbeddingError, EmbeddingFatalError
 from services.generation import stream_answer
 from pydantic import BaseModel
 
@@ -100,22 +103,43 @@ async def send_message(
         
         try:
             # 4. Retrieve Context
-            context, sources = await retrieve_context(
+            retrieved = await retrieve(
                 request.content, 
                 current_user.id, 
                 request.document_ids,
-                chat_history=chat_history
+                chat_history=chat_history,
+                conversation_id=conversation_id
             )
             
             # Yield sources instantly
-            yield f"event: sources\ndata: {json.dumps(sources)}\n\n"
+            yield f"event: sources\ndata: {json.dumps(retrieved.sources)}\n\n"
             
-            # 5. Generate and yield tokens
-            async for token in stream_answer(request.content, context, chat_history):
+            # Only self-contained questions are answered from the cache: a follow-up's answer
+            # depends on the conversation, not just on the question and the retrieved parents
+            query_vector = None
+            cached = None
+            if answer_cache.enabled and retrieved.parent_ids and not (chat_history and needs_rewrite(request.content)):
+                try:
+                    query_vector = await generate_query_embedding(request.content)
+                    cached = answer_cache.lookup(
+                        current_user.id, retrieved.generation, request.document_ids, query_vector, retrieved.parent_ids
+                    )
+                except (EmbeddingError, EmbeddingFatalError) as e:
+                    logger.warning(f"Answer cache lookup skipped: {e}")
+                    
+            # 5. Generate (or replay) and yield tokens
+            started = time.perf_counter()
+            tokens = replay_answer(cached.answer) if cached else stream_answer(request.content, retrieved.context, chat_history)
+            async for token in tokens:
                 full_answer += token
                 # Yield token event
                 yield f"event: token\ndata: {json.dumps(token)}\n\n"
                 
+            if query_vector is not None and not cached and full_answer:
+                answer_cache.store(
+                    current_user.id, retrieved.generation, request.document_ids, query_vector,
+                    retrieved.parent_ids, full_answer, time.perf_counter() - started
+                )
             yield "event: done\ndata: {}\n\n"
             
         except Exception as e:
@@ -1,25 +1,26 @@
 import os
 import uuid
+import hashlib
 import shutil
 import aiofiles
 from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, BackgroundTasks
 from sqlmodel import select
 from core.database import AsyncSessionLocal
-from core.storage import get_secure_file_path
-from models.base import User, Document, ProcessingJob
+from core.storage import get_secure_file_path, delete_file_idempotent
+from models.base import User, Document, ProcessingJob, utc_now
 from api.dependencies import get_current_user
-from services.ingestion import wipe_document_idempotent, execute_deletion_saga
+from services.ingestion import wipe_document_idempotent, execute_deletion_saga, execute_bulk_deletion_saga
 from core.worker import trigger_new_job
 from core.config import settings
+from pydantic import BaseModel
+from typing import List
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 
-@router.post("/upload")
-async def upload_document(
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
-):
-    """Securely accepts an uploaded file and schedules it for processing."""
+class BulkDeleteRequest(BaseModel):
+    document_ids: List[uuid.UUID]
+
+async def _validate_pdf_upload(file: UploadFile):
     if not file.filename:
         raise HTTPException(status_code=400, detail="Filename required")
         
@@ -30,6 +31,27 @@ async def upload_document(
     if not magic_bytes.startswith(b"%PDF"):
         raise HTTPException(status_code=400, detail="Invalid PDF format")
     await file.seek(0)
+
+async def _save_upload(file: UploadFile, dest_path: str) -> str:
+    """Streams the upload to disk and returns its SHA-256."""
+    # Hash while streaming so identical uploads can reuse existing embeddings
+    sha256 = hashlib.sha256()
+    try:
+        async with aiofiles.open(dest_path, "wb") as buffer:
+            while content := await file.read(1024 * 1024):
+                sha256.update(content)
+                await buffer.write(content)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to write file: {str(e)}")
+    return sha256.hexdigest()
+
+@router.post("/upload")
+async def upload_document(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Securely accepts an uploaded file and schedules it for processing."""
+    await _validate_pdf_upload(file)
     
     # Check for duplicates
     async with AsyncSessionLocal() as session:
@@ -47,16 +69,17 @@ async def upload_document(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
         
-    try:
-        async with aiofiles.open(dest_path, "wb") as buffer:
-            while content := await file.read(1024 * 1024):
-                await buffer.write(content)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to write file: {str(e)}")
+    content_sha256 = await _save_upload(file, dest_path)
         
     # 2. Register Document and ProcessingJob
     async with AsyncSessionLocal() as session:
-        doc = Document(id=doc_id, user_id=current_user.id, filename=file.filename, status="PENDING")
+        doc = Document(
+            id=doc_id,
+            user_id=current_user.id,
+            filename=file.filename,
+            status="PENDING",
+            content_sha256=content_sha256,
+        )
         job = ProcessingJob(document_id=doc_id, status="PENDING")
         session.add(doc)
         session.add(job)
@@ -68,6 +91,56 @@ async def upload_document(
     # 3. Return 202 Accepted. The background worker will pick up the PENDING job.
     return {"message": "Upload accepted", "document_id": str(doc_id), "status": "PENDING"}
 
+@router.put("/{document_id}")
+async def replace_document(
+    document_id: uuid.UUID,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Replaces the content of an existing document and re-ingests it. Chunks whose text is
+    unchanged keep their vectors; only new or edited chunks are embedded.
+    """
+    await _validate_pdf_upload(file)
+    
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Document).where(Document.id == document_id, Document.user_id == current_user.id)
+        )
+        doc = result.scalar_one_or_none()
+        if not doc:
+            raise HTTPException(status_code=404, detail="Document not found")
+        if doc.status not in ("COMPLETED", "FAILED"):
+            raise HTTPException(status_code=409, detail="Document is still being processed")
+        filename = doc.filename
+        
+    # The stored filename is kept; only the content changes
+    dest_path = get_secure_file_path(str(document_id), filename)
+    content_sha256 = await _save_upload(file, dest_path)
+    
+    async with AsyncSessionLocal() as session:
+        doc = await session.get(Document, document_id)
+        if not doc or doc.status not in ("COMPLETED", "FAILED"):
+            delete_file_idempotent(dest_path)
+            raise HTTPException(status_code=409, detail="Document changed while uploading")
+        doc.status = "PENDING"
+        doc.content_sha256 = content_sha256
+        # Requeue the document's existing job: the worker updates jobs by document_id, so a
+        # second row would be claimed and processed alongside the first
+        result = await session.execute(select(ProcessingJob).where(ProcessingJob.document_id == document_id))
+        job = result.scalars().first() or ProcessingJob(document_id=document_id)
+        job.status = "PENDING"
+        job.updated_at = utc_now()
+        job.checkpoint_chunk_index = None
+        job.checkpoint_page = None
+        job.checkpoint_carry = None
+        session.add(job)
+        await session.commit()
+        
+    trigger_new_job()
+    
+    return {"message": "Replacement accepted", "document_id": str(document_id), "status": "PENDING"}
+
 @router.get("")
 async def list_documents(current_user: User = Depends(get_current_user)):
     """List all documents owned by the user."""
@@ -117,3 +190,27 @@ async def delete_document(
         os.remove(dest_path)
         
     return {"message": "Deletion triggered", "document_id": str(document_id)}
+
+@router.post("/bulk-delete")
+async def bulk_delete_documents(
+    request: BulkDeleteRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """Triggers one deletion saga for all of the caller's listed documents. Unknown IDs are ignored."""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Document.id, Document.filename).where(
+                Document.id.in_(request.document_ids), Document.user_id == current_user.id
+            )
+        )
+        owned = result.all()
+        
+    background_tasks.add_task(execute_bulk_deletion_saga, [doc_id for doc_id, _ in owned])
+    
+    for doc_id, filename in owned:
+        dest_path = get_secure_file_path(str(doc_id), filename)
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+            
+    return {"message": "Deletion triggered", "document_ids": [str(doc_id) for doc_id, _ in owned]}
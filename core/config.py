@@ -23,6 +23,82 @@ class Settings(BaseSettings):
 
     # Ingestion Settings
     EMBEDDING_BATCH_SIZE: int = 100
+    EMBEDDING_MAX_IN_FLIGHT: int = 3
+    # 0 extracts in a thread; >0 runs extraction in a pool of that many processes
+    EXTRACTION_PROCESS_POOL_SIZE: int = 0
+    # >0 splits each PDF into page ranges of this size, chunked in parallel on the process pool
+    EXTRACTION_SHARD_PAGES: int = 0
+    # Persistent (model, text hash) -> vector cache consulted before every embedding call
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 1_000_000
+    # In-process LRU of query embeddings by (model, normalized query); 0 entries disables it
+    QUERY_EMBEDDING_CACHE_MAX_ENTRIES: int = 10000
+    QUERY_EMBEDDING_CACHE_MAX_MB: int = 64
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS: float = 3600.0
+    # Coalesce embedding requests from all workers and queries into shared API calls
+    EMBEDDING_COALESCING: bool = False
+    EMBEDDING_COALESCE_MAX_TEXTS: int = 100
+    EMBEDDING_COALESCE_MAX_TOKENS: int = 20000
+    EMBEDDING_COALESCE_LINGER_MS: int = 10
+    # gemini | local (offline hashed n-grams) | simulated (local vectors behind injected latency/429s)
+    EMBEDDING_PROVIDER: str = "gemini"
+    EMBEDDING_SIMULATED_LATENCY_MS: float = 150.0
+    EMBEDDING_SIMULATED_LATENCY_PER_TEXT_MS: float = 1.0
+    EMBEDDING_SIMULATED_THROTTLE_RATE: float = 0.0
+    # Matryoshka truncation (e.g. 256 or 384), L2-renormalised; None keeps the provider's full size
+    EMBEDDING_DIMENSIONS: Optional[int] = None
+    # How often each process re-reads which collection serves and which one is being re-embedded
+    EMBEDDING_INDEX_REFRESH_SECONDS: float = 15.0
+    # Documents re-embedded concurrently, and per saved cursor position, by a re-embedding job
+    REEMBEDDING_CONCURRENCY: int = 4
+    REEMBEDDING_PAGE_SIZE: int = 100
+    # Rebuilds from Postgres: parent rows fetched per server-side cursor round trip, embedding batches in flight
+    REBUILD_FETCH_SIZE: int = 2000
+    REBUILD_MAX_IN_FLIGHT: int = 8
+    # Embedding API quota: starting rate, learned between the bounds (AIMD on 429s)
+    EMBEDDING_RATE_LIMIT_RPS: float = 10.0
+    EMBEDDING_RATE_LIMIT_MIN_RPS: float = 0.5
+    EMBEDDING_RATE_LIMIT_MAX_RPS: float = 50.0
+    EMBEDDING_RATE_LIMIT_BURST: float = 5.0
+    # Qdrant storage profile for new collections: default (float32 in RAM) | scalar (int8) | binary
+    QDRANT_COLLECTION_PROFILE: str = "default"
+    # Overrides for the profile's on-disk originals and search oversampling
+    QDRANT_ON_DISK_VECTORS: Optional[bool] = None
+    QDRANT_SEARCH_OVERSAMPLING: Optional[float] = None
+    QDRANT_HNSW_M: int = 16
+    QDRANT_HNSW_EF_CONSTRUCT: int = 100
+    # Search-time HNSW beam width; None uses Qdrant's default
+    QDRANT_HNSW_EF: Optional[int] = None
+    # New collections get per-user HNSW graphs (user_id is_tenant index) instead of one global graph
+    QDRANT_TENANT_PARTITIONING: bool = True
+    # Bulk loads (rebuilds, re-embeddings): use gRPC, points buffered per upload, uploader batch size and processes
+    QDRANT_PREFER_GRPC: bool = False
+    QDRANT_GRPC_PORT: int = 6334
+    QDRANT_BULK_BUFFER_POINTS: int = 10000
+    QDRANT_UPLOAD_BATCH_SIZE: int = 256
+    QDRANT_UPLOAD_PARALLEL: int = 4
+    # LLM query rewrites cached per conversation (skipped entirely for self-contained queries)
+    QUERY_REWRITE_CACHE_MAX_ENTRIES: int = 10000
+    QUERY_REWRITE_CACHE_MAX_MB: int = 16
+    QUERY_REWRITE_CACHE_TTL_SECONDS: float = 3600.0
+    # Search with the raw query while the rewrite runs; kept if the rewrite shares this much of its wording
+    RETRIEVAL_SPECULATIVE: bool = False
+    RETRIEVAL_SPECULATIVE_MIN_OVERLAP: float = 0.8
+    # Assembled retrieval results, invalidated per user whenever their documents change
+    RETRIEVAL_CACHE_MAX_ENTRIES: int = 5000
+    RETRIEVAL_CACHE_MAX_MB: int = 128
+    RETRIEVAL_CACHE_TTL_SECONDS: float = 600.0
+    # Replay earlier answers to near-duplicate, self-contained questions that retrieve the same parents
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_SIMILARITY: float = 0.95
+    ANSWER_CACHE_MAX_SCOPES: int = 10000
+    ANSWER_CACHE_MAX_PER_SCOPE: int = 50
+    ANSWER_CACHE_MAX_MB: int = 128
+    ANSWER_CACHE_TTL_SECONDS: float = 86400.0
+    # Child hits returned per parent by grouped dense retrieval (only the best one is scored)
+    RETRIEVAL_GROUP_SIZE: int = 1
+    # Rows (or documents) removed per DELETE statement, keeping row locks short
+    DELETION_BATCH_SIZE: int = 5000
     
     @model_validator(mode='after')
     def validate_secrets(self) -> 'Settings':
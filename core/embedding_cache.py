@@ -0,0 +1,108 @@
+import hashlib
+import structlog
+from array import array
+from sqlalchemy import update, delete, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select
+from models.base import EmbeddingCacheEntry, utc_now
+from core.transactions import scoped_transaction
+
+logger = structlog.get_logger(__name__)
+
+class EmbeddingCacheStats:
+    """Process-wide counters, exposed on /metrics."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+stats = EmbeddingCacheStats()
+
+# Eviction runs on the first write after start-up and then every max_entries // 10 written rows,
+# so the table may overshoot its limit by roughly 10% between sweeps.
+_writes_until_eviction = 0
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _pack(vector: list[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+def _unpack(blob: bytes) -> list[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+async def get_many(model: str, texts: list[str]) -> dict[str, list[float]]:
+    """
+    Returns cached vectors keyed by text for the texts that hit. Hits are touched in the
+    same statement (UPDATE ... RETURNING) so eviction stays least-recently-used.
+    """
+    texts_by_hash = {text_hash(text): text for text in texts}
+    async with scoped_transaction() as session:
+        result = await session.execute(
+            update(EmbeddingCacheEntry)
+            .where(
+                EmbeddingCacheEntry.model == model,
+                EmbeddingCacheEntry.text_hash.in_(texts_by_hash),
+            )
+            .values(last_used_at=utc_now())
+            .returning(EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.vector)
+            .execution_options(synchronize_session=False)
+        )
+        found = {texts_by_hash[row.text_hash]: _unpack(row.vector) for row in result}
+    stats.hits += len(found)
+    stats.misses += len(texts_by_hash) - len(found)
+    return found
+
+async def put_many(model: str, texts: list[str], vectors: list[list[float]], max_entries: int):
+    """Stores freshly embedded texts, then evicts the least recently used rows when due."""
+    global _writes_until_eviction
+    now = utc_now()
+    rows = {}
+    for text, vector in zip(texts, vectors):
+        key = text_hash(text)
+        rows[key] = {"model": model, "text_hash": key, "vector": _pack(vector), "last_used_at": now}
+    if not rows:
+        return
+    async with scoped_transaction() as session:
+        await session.execute(
+            insert(EmbeddingCacheEntry).on_conflict_do_nothing(index_elements=["model", "text_hash"]),
+            list(rows.values()),
+        )
+    stats.writes += len(rows)
+
+    _writes_until_eviction -= len(rows)
+    if _writes_until_eviction <= 0:
+        _writes_until_eviction = max(1, max_entries // 10)
+        await evict(max_entries)
+
+async def evict(max_entries: int) -> int:
+    """Deletes everything but the `max_entries` most recently used rows."""
+    stale = (
+        select(EmbeddingCacheEntry.model, EmbeddingCacheEntry.text_hash)
+        .order_by(EmbeddingCacheEntry.last_used_at.desc())
+        .offset(max_entries)
+    )
+    async with scoped_transaction() as session:
+        result = await session.execute(
+            delete(EmbeddingCacheEntry)
+            .where(tuple_(EmbeddingCacheEntry.model, EmbeddingCacheEntry.text_hash).in_(stale))
+            .execution_options(synchronize_session=False)
+        )
+    if result.rowcount:
+        stats.evictions += result.rowcount
+        logger.info(f"Evicted {result.rowcount} embedding cache entries")
+    return result.rowcount
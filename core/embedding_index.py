@@ -0,0 +1,82 @@
+import asyncio
+import re
+import structlog
+from dataclasses import dataclass
+from sqlmodel import select
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.embeddings import EmbeddingProvider, build_provider, get_embedding_provider, set_serving_provider
+from core.qdrant import COLLECTION_NAME, alias_target
+from models.base import ReindexJob
+
+logger = structlog.get_logger(__name__)
+
+@dataclass(frozen=True)
+class EmbeddingIndex:
+    """A Qdrant collection together with the provider whose vectors it holds."""
+    collection: str
+    provider: EmbeddingProvider
+
+# Every process re-reads the reindexjob table, so API servers and workers agree on where
+# queries are served from and where ingestion has to dual-write during a re-embedding.
+# Once the COLLECTION_NAME alias points at the serving collection, queries go through the
+# alias, so moving the same vectors to another collection (tenant layout) is one atomic swap.
+_serving_collection = COLLECTION_NAME
+_building: EmbeddingIndex | None = None
+_providers: dict[tuple[str, int | None], EmbeddingProvider] = {}
+
+def versioned_collection_name(model_version: str) -> str:
+    return f"{COLLECTION_NAME}__{re.sub(r'[^a-z0-9]+', '_', model_version.lower()).strip('_')}"
+
+def _provider_for(job: ReindexJob) -> EmbeddingProvider:
+    key = (job.provider, job.dimensions)
+    if key not in _providers:
+        _providers[key] = build_provider(job.provider, job.dimensions)
+    return _providers[key]
+
+def serving_index() -> EmbeddingIndex:
+    return EmbeddingIndex(_serving_collection, get_embedding_provider())
+
+def building_index() -> EmbeddingIndex | None:
+    """The collection a running re-embedding is filling, if any."""
+    return _building
+
+def write_indexes() -> list[EmbeddingIndex]:
+    """Every collection that must see writes and deletes."""
+    return [serving_index(), _building] if _building else [serving_index()]
+
+async def refresh_embedding_indexes():
+    """Loads the serving and building indexes from the latest completed and the running job."""
+    global _serving_collection, _building
+    aliased = await alias_target()
+    async with AsyncSessionLocal() as session:
+        completed = (await session.execute(
+            select(ReindexJob)
+            .where(ReindexJob.status == "COMPLETED")
+            .order_by(ReindexJob.completed_at.desc())
+            .limit(1)
+        )).scalar_one_or_none()
+        running = (await session.execute(
+            select(ReindexJob).where(ReindexJob.status == "RUNNING").limit(1)
+        )).scalar_one_or_none()
+
+    if completed:
+        # Until the alias has moved, a model switch is served from the new collection by name
+        collection = COLLECTION_NAME if aliased == completed.collection_name else completed.collection_name
+        if _serving_collection != collection:
+            logger.info(f"Serving embeddings from {collection} ({completed.model_version})")
+        set_serving_provider(_provider_for(completed))
+        _serving_collection = collection
+    else:
+        set_serving_provider(None)
+        _serving_collection = COLLECTION_NAME
+    _building = EmbeddingIndex(running.collection_name, _provider_for(running)) if running else None
+
+async def watch_embedding_indexes():
+    """Keeps this process's view current; runs for the lifetime of the app."""
+    while True:
+        await asyncio.sleep(settings.EMBEDDING_INDEX_REFRESH_SECONDS)
+        try:
+            await refresh_embedding_indexes()
+        except Exception as e:
+            logger.warning(f"Failed to refresh embedding indexes: {e}")
@@ -1,51 +1,395 @@
 import os
+import re
+import unicodedata
+import zlib
+import random
+from array import array
+from abc import ABC, abstractmethod
+import numpy as np
 from google import genai
 import asyncio
 import structlog
+from typing import Awaitable, Callable
 from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
+from core.config import settings
+from core.quota import QuotaBroker, Priority
+from core.cache import AsyncLRUCache
 
 logger = structlog.get_logger(__name__)
 
 API_KEY = os.getenv("GEMINI_API_KEY", "dummy")
 client = genai.Client(api_key=API_KEY) if API_KEY != "dummy" else genai.Client(api_key="mock_key", http_options={"api_version": "v1alpha"})
 
+EMBEDDING_MODEL = "text-embedding-004"
+
+quota_broker = QuotaBroker(
+    rate=settings.EMBEDDING_RATE_LIMIT_RPS,
+    min_rate=settings.EMBEDDING_RATE_LIMIT_MIN_RPS,
+    max_rate=settings.EMBEDDING_RATE_LIMIT_MAX_RPS,
+    burst=settings.EMBEDDING_RATE_LIMIT_BURST,
+)
+
 class EmbeddingError(Exception):
     pass
 
+class EmbeddingRateLimitError(EmbeddingError):
+    pass
+
 class EmbeddingFatalError(Exception):
     pass
 
+class EmbeddingProvider(ABC):
+    """
+    A backend that turns texts into vectors. `model_version` is recorded on every document it
+    embeds and keys the embedding cache, so it must change whenever the vectors would.
+    `rate_limited` providers go through the shared quota broker.
+    """
+    model_version: str
+    dimensions: int
+    rate_limited: bool = False
+
+    @abstractmethod
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        """Raises EmbeddingError for retriable and EmbeddingFatalError for permanent failures."""
+
+class GeminiProvider(EmbeddingProvider):
+    model_version = EMBEDDING_MODEL
+    dimensions = 768
+    rate_limited = True
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        try:
+            response = await client.aio.models.embed_content(
+                model=EMBEDDING_MODEL,
+                contents=texts,
+            )
+            return [emb.values for emb in response.embeddings]
+        except Exception as e:
+            error_str = str(e)
+            if "400" in error_str:
+                logger.error(f"Fatal embedding error (400): {e}")
+                raise EmbeddingFatalError(f"Bad Request: {e}")
+            elif "429" in error_str:
+                logger.warning(f"Embedding rate limit hit: {e}")
+                raise EmbeddingRateLimitError(f"Rate Limited: {e}")
+            elif "500" in error_str:
+                logger.warning(f"Retriable embedding error: {e}")
+                raise EmbeddingError(f"Temporary API Failure: {e}")
+            else:
+                raise EmbeddingFatalError(f"Unexpected Error: {e}")
+
+_WORD = re.compile(r"\w+")
+
+class LocalHashingProvider(EmbeddingProvider):
+    """
+    Deterministic offline embeddings: word unigrams/bigrams and character trigrams of each word
+    are feature-hashed (CRC32, with a hashed sign) into `dimensions` buckets and L2-normalised.
+    Texts sharing vocabulary get high cosine similarity, which is enough to exercise retrieval
+    end to end without network access. Not a semantic model.
+    """
+    rate_limited = False
+
+    def __init__(self, dimensions: int = 768):
+        self.dimensions = dimensions
+        self.model_version = f"local-hashing-v1-{dimensions}"
+
+    def _features(self, text: str) -> list[str]:
+        words = _WORD.findall(text.lower())
+        features = [f"w:{word}" for word in words]
+        features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+        return features
+
+    def embed_sync(self, texts: list[str]) -> list[list[float]]:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter(
+                (zlib.crc32(feature.encode("utf-8")) for feature in self._features(text)),
+                dtype=np.uint64,
+            )
+            if hashes.size == 0:
+                continue
+            signs = np.where((hashes >> np.uint64(31)) & np.uint64(1), -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], (hashes % np.uint64(self.dimensions)).astype(np.intp), signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors.tolist()
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        # Cheap enough for test batches, but keep large ingestion batches off the event loop
+        if len(texts) > 8:
+            return await asyncio.to_thread(self.embed_sync, texts)
+        return self.embed_sync(texts)
+
+class SimulatedRemoteProvider(EmbeddingProvider):
+    """
+    Stand-in for a remote API when load testing: returns `inner`'s vectors after a simulated
+    round trip (base + per-text latency, with jitter) and rejects a fraction of calls with a
+    rate-limit error so the quota broker's adaptation can be observed.
+    """
+    rate_limited = True
+
+    def __init__(self, inner: EmbeddingProvider, latency: float, latency_per_text: float, throttle_rate: float = 0.0, seed: int = 0):
+        self.inner = inner
+        self.model_version = inner.model_version
+        self.dimensions = inner.dimensions
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        delay = (self.latency + self.latency_per_text * len(texts)) * self._random.uniform(0.8, 1.2)
+        await asyncio.sleep(delay)
+        if self._random.random() < self.throttle_rate:
+            raise EmbeddingRateLimitError("Simulated 429")
+        return await self.inner.embed(texts)
+
+class TruncatedProvider(EmbeddingProvider):
+    """
+    Keeps the first `dimensions` components of `inner`'s vectors and L2-renormalises them.
+    Matryoshka-trained models (text-embedding-004 included) front-load their information, so a
+    prefix is a usable smaller embedding. The dimension becomes part of the model version.
+    """
+
+    def __init__(self, inner: EmbeddingProvider, dimensions: int):
+        if not 0 < dimensions < inner.dimensions:
+            raise ValueError(f"EMBEDDING_DIMENSIONS must be between 1 and {inner.dimensions - 1}, got {dimensions}")
+        self.inner = inner
+        self.dimensions = dimensions
+        self.model_version = f"{inner.model_version}@{dimensions}"
+        self.rate_limited = inner.rate_limited
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        vectors = np.asarray(await self.inner.embed(texts), dtype=np.float32)[:, :self.dimensions]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors.tolist()
+
+_provider: EmbeddingProvider | None = None
+_provider_name: str | None = None
+# Set from the latest completed re-embedding job; overrides the settings below
+_serving_provider: EmbeddingProvider | None = None
+
+def _build_provider(name: str) -> EmbeddingProvider:
+    if name == "gemini":
+        return GeminiProvider()
+    if name == "local":
+        return LocalHashingProvider()
+    if name == "simulated":
+        return SimulatedRemoteProvider(
+            LocalHashingProvider(),
+            latency=settings.EMBEDDING_SIMULATED_LATENCY_MS / 1000,
+            latency_per_text=settings.EMBEDDING_SIMULATED_LATENCY_PER_TEXT_MS / 1000,
+            throttle_rate=settings.EMBEDDING_SIMULATED_THROTTLE_RATE,
+        )
+    raise ValueError(f"Unknown EMBEDDING_PROVIDER: {name}")
+
+def build_provider(name: str, dimensions: int | None = None) -> EmbeddingProvider:
+    """A provider by name, truncated to `dimensions` when that is smaller than its native size."""
+    provider = _build_provider(name)
+    if dimensions and dimensions != provider.dimensions:
+        provider = TruncatedProvider(provider, dimensions)
+    return provider
+
+def set_serving_provider(provider: EmbeddingProvider | None):
+    """Switches the process to the provider of a completed re-embedding (None: back to settings)."""
+    global _serving_provider
+    _serving_provider = provider
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """
+    The provider that serves queries and ingestion: the target of the latest completed
+    re-embedding, otherwise EMBEDDING_PROVIDER truncated to EMBEDDING_DIMENSIONS when set.
+    Built once, and rebuilt if either setting changes.
+    """
+    global _provider, _provider_name
+    if _serving_provider is not None:
+        return _serving_provider
+    name = settings.EMBEDDING_PROVIDER
+    if name == "gemini" and API_KEY == "dummy" and os.environ.get("ENV") != "testing":
+        # No key outside tests: embed locally rather than with a constant vector
+        name = "local"
+    key = f"{name}@{settings.EMBEDDING_DIMENSIONS}"
+    if _provider is None or _provider_name != key:
+        if name != settings.EMBEDDING_PROVIDER:
+            logger.warning("GEMINI_API_KEY is not set; using the local hashing embedding provider")
+        _provider = build_provider(name, settings.EMBEDDING_DIMENSIONS)
+        _provider_name = key
+    return _provider
+
+def embedding_model_version() -> str:
+    return get_embedding_provider().model_version
+
 @retry(
     wait=wait_exponential(multiplier=1, min=2, max=10),
     stop=stop_after_attempt(3),
     retry=retry_if_exception_type(EmbeddingError)
 )
-async def generate_embeddings(texts: list[str]) -> list[list[float]]:
+async def generate_embeddings(
+    texts: list[str],
+    priority: Priority = Priority.BULK,
+    provider: EmbeddingProvider | None = None,
+) -> list[list[float]]:
     """
-    Generate embeddings for a list of texts.
+    Generate embeddings for a list of texts with `provider` (default: the serving provider).
+    Every attempt against a rate-limited provider waits its turn at the quota broker.
     Callers MUST catch EmbeddingFatalError which is raised on non-retriable failures.
     """
-    if API_KEY == "dummy" and os.environ.get("ENV") != "testing":
-        return [[0.1] * 768 for _ in texts]
+    provider = provider or get_embedding_provider()
+    if not provider.rate_limited:
+        return await provider.embed(texts)
         
+    await quota_broker.acquire(priority)
     try:
-        response = await client.aio.models.embed_content(
-            model="text-embedding-004",
-            contents=texts,
-        )
-        return [emb.values for emb in response.embeddings]
-    except Exception as e:
-        error_str = str(e)
-        if "400" in error_str:
-            logger.error(f"Fatal embedding error (400): {e}")
-            raise EmbeddingFatalError(f"Bad Request: {e}")
-        elif "429" in error_str or "500" in error_str:
-            logger.warning(f"Retriable embedding error: {e}")
-            raise EmbeddingError(f"Temporary API Failure: {e}")
-        else:
-            raise EmbeddingFatalError(f"Unexpected Error: {e}")
+        vectors = await provider.embed(texts)
+    except EmbeddingRateLimitError:
+        quota_broker.on_throttle()
+        raise
+    quota_broker.on_success()
+    return vectors
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; only used to bound request size
+    return len(text) // 4 + 1
+
+class EmbeddingBatcher:
+    """
+    Coalesces embedding requests from concurrent callers (ingestion workers, queries) into
+    shared API calls. A batch is flushed once it reaches `max_texts` texts or `max_tokens`
+    estimated tokens, or `linger` seconds after its first request arrived. A request is never
+    split across batches, and each caller gets back exactly its own vectors.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[list[str], Priority], Awaitable[list[list[float]]]] | None = None,
+        max_texts: int = 100,
+        max_tokens: int = 20000,
+        linger: float = 0.01,
+    ):
+        # Resolved at call time so the module-level function can be patched
+        self._embed_fn = embed_fn or (lambda texts, priority: generate_embeddings(texts, priority=priority))
+        self.max_texts = max_texts
+        self.max_tokens = max_tokens
+        self.linger = linger
+        self._pending: list[tuple[list[str], asyncio.Future, Priority]] = []
+        self._pending_texts = 0
+        self._pending_tokens = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._dispatches: set[asyncio.Task] = set()
+        self.requests = 0
+        self.api_calls = 0
+        self.texts = 0
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "api_calls": self.api_calls,
+            "texts": self.texts,
+            "texts_per_call": round(self.texts / self.api_calls, 2) if self.api_calls else 0.0,
+        }
+
+    async def embed(self, texts: list[str], priority: Priority = Priority.BULK) -> list[list[float]]:
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        tokens = sum(_estimate_tokens(text) for text in texts)
+        if self._pending and (
+            self._pending_texts + len(texts) > self.max_texts
+            or self._pending_tokens + tokens > self.max_tokens
+        ):
+            self._flush()
+
+        future = loop.create_future()
+        self._pending.append((list(texts), future, priority))
+        self._pending_texts += len(texts)
+        self._pending_tokens += tokens
+        self.requests += 1
+        if self._pending_texts >= self.max_texts or self._pending_tokens >= self.max_tokens:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        self._pending_texts = 0
+        self._pending_tokens = 0
+        if batch:
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: list[tuple[list[str], asyncio.Future, Priority]]):
+        texts = [text for request, _, _ in batch for text in request]
+        # A batch carrying any interactive request is sent as interactive
+        priority = min(item_priority for _, _, item_priority in batch)
+        self.api_calls += 1
+        self.texts += len(texts)
+        try:
+            vectors = await self._embed_fn(texts, priority)
+        except EmbeddingFatalError as e:
+            if len(batch) > 1:
+                # One rejected request must not fail the callers it was coalesced with
+                logger.warning(f"Coalesced embedding batch rejected, retrying {len(batch)} requests separately: {e}")
+                await asyncio.gather(*(self._dispatch([item]) for item in batch))
+            else:
+                _fail_waiters(batch, e)
+            return
+        except Exception as e:
+            _fail_waiters(batch, e)
+            return
+
+        offset = 0
+        for request, future, _ in batch:
+            if not future.done():  # The caller may have been cancelled
+                future.set_result(vectors[offset:offset + len(request)])
+            offset += len(request)
+
+def _fail_waiters(batch: list[tuple[list[str], asyncio.Future, Priority]], error: Exception):
+    for _, future, _ in batch:
+        if not future.done():
+            future.set_exception(error)
+
+embedding_batcher = EmbeddingBatcher(
+    max_texts=settings.EMBEDDING_COALESCE_MAX_TEXTS,
+    max_tokens=settings.EMBEDDING_COALESCE_MAX_TOKENS,
+    linger=settings.EMBEDDING_COALESCE_LINGER_MS / 1000,
+)
+
+async def embed_texts(texts: list[str], priority: Priority = Priority.BULK) -> list[list[float]]:
+    """Embeds through the process-wide batcher when EMBEDDING_COALESCING is on, directly otherwise."""
+    if settings.EMBEDDING_COALESCING:
+        return await embedding_batcher.embed(texts, priority)
+    return await generate_embeddings(texts, priority=priority)
+
+# Query vectors by (model version, normalized query), stored as float32 arrays
+query_embedding_cache = AsyncLRUCache(
+    max_entries=settings.QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+    max_bytes=settings.QUERY_EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+    ttl=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+    sizeof=lambda key, vector: 100 + len(key[0]) + len(key[1]) + vector.itemsize * len(vector),
+)
+
+def normalize_query(text: str) -> str:
+    """Case, Unicode form and whitespace differences don't change what a query asks for."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
 
 async def generate_query_embedding(text: str) -> list[float]:
-    """Thin wrapper to embed a single query string."""
-    embeddings = await generate_embeddings([text])
-    return embeddings[0]
+    """
+    Embeds a single query string ahead of any queued ingestion batches. Repeated queries are
+    served from the in-process cache, and identical queries in flight share one API call.
+    """
+    async def embed() -> array:
+        embeddings = await embed_texts([text], Priority.INTERACTIVE)
+        return array("f", embeddings[0])
+
+    key = (embedding_model_version(), normalize_query(text))
+    vector = await query_embedding_cache.get_or_load(key, embed)
+    return vector.tolist()
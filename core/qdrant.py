@@ -1,34 +1,270 @@
+import asyncio
+import functools
+from contextlib import asynccontextmanager
 from qdrant_client import AsyncQdrantClient
-from qdrant_client.http.models import Distance, VectorParams
+from dataclasses import dataclass, replace
+from typing import Optional
+from qdrant_client.http.models import (
+    Distance,
+    VectorParams,
+    HnswConfigDiff,
+    SearchParams,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    KeywordIndexParams,
+    KeywordIndexType,
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
+    OptimizersConfigDiff,
+    PointStruct,
+)
 from core.config import settings
+from core.embeddings import get_embedding_provider
 import os
+import structlog
+
+logger = structlog.get_logger(__name__)
 
 QDRANT_URL = settings.QDRANT_URL
 QDRANT_PATH = os.getenv("QDRANT_PATH", "qdrant_data")
 
 if QDRANT_URL:
-    qdrant_client = AsyncQdrantClient(url=QDRANT_URL, api_key=settings.QDRANT_API_KEY)
+    qdrant_client = AsyncQdrantClient(
+        url=QDRANT_URL,
+        api_key=settings.QDRANT_API_KEY,
+        prefer_grpc=settings.QDRANT_PREFER_GRPC,
+        grpc_port=settings.QDRANT_GRPC_PORT,
+    )
 else:
     qdrant_client = AsyncQdrantClient(path=QDRANT_PATH)
 COLLECTION_NAME = "recallai_chunks"
 RRF_K = 60
 
-async def init_qdrant():
-    """Create collection if it doesn't exist."""
-    if not await qdrant_client.collection_exists(COLLECTION_NAME):
-        await qdrant_client.create_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(size=768, distance=Distance.COSINE) # text-embedding-004 is 768d
+@dataclass(frozen=True)
+class CollectionProfile:
+    """
+    How vectors are stored and searched. Quantized profiles keep only the compressed vectors in
+    RAM and leave the float32 originals on disk; searches fetch `oversampling` x limit candidates
+    with the quantized vectors and rescore them against the originals.
+    """
+    name: str
+    quantization: Optional[str] = None  # None | "scalar" (int8, 4x smaller) | "binary" (1 bit, 32x smaller)
+    on_disk: bool = False
+    oversampling: float = 1.0
+    rescore: bool = True
+
+COLLECTION_PROFILES = {
+    "default": CollectionProfile("default"),
+    "scalar": CollectionProfile("scalar", quantization="scalar", on_disk=True, oversampling=2.0),
+    "binary": CollectionProfile("binary", quantization="binary", on_disk=True, oversampling=3.0),
+}
+
+def get_collection_profile() -> CollectionProfile:
+    try:
+        profile = COLLECTION_PROFILES[settings.QDRANT_COLLECTION_PROFILE]
+    except KeyError:
+        raise ValueError(f"Unknown QDRANT_COLLECTION_PROFILE: {settings.QDRANT_COLLECTION_PROFILE}")
+    if settings.QDRANT_ON_DISK_VECTORS is not None:
+        profile = replace(profile, on_disk=settings.QDRANT_ON_DISK_VECTORS)
+    if settings.QDRANT_SEARCH_OVERSAMPLING is not None:
+        profile = replace(profile, oversampling=settings.QDRANT_SEARCH_OVERSAMPLING)
+    return profile
+
+def collection_config(profile: CollectionProfile, dimensions: int, tenant_partitioned: bool | None = None) -> dict:
+    """
+    Keyword arguments for create_collection under `profile`. A tenant-partitioned collection
+    builds no global HNSW graph (m=0) but one graph per user_id (payload_m), so a user's search
+    only walks their own points.
+    """
+    if tenant_partitioned is None:
+        tenant_partitioned = settings.QDRANT_TENANT_PARTITIONING
+    if tenant_partitioned:
+        hnsw = HnswConfigDiff(m=0, payload_m=settings.QDRANT_HNSW_M, ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT)
+    else:
+        hnsw = HnswConfigDiff(m=settings.QDRANT_HNSW_M, ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT)
+    config = {
+        "vectors_config": VectorParams(size=dimensions, distance=Distance.COSINE, on_disk=profile.on_disk),
+        "hnsw_config": hnsw,
+    }
+    if profile.quantization == "scalar":
+        config["quantization_config"] = ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
         )
-    
-    # Ensure indexes exist (idempotent)
+    elif profile.quantization == "binary":
+        config["quantization_config"] = BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    return config
+
+def get_search_params(profile: CollectionProfile | None = None) -> Optional[SearchParams]:
+    """
+    Search-time counterpart of the collection profile: HNSW ef and quantized rescoring.
+    None when there is nothing to override, so the default profile sends plain queries.
+    """
+    profile = profile or get_collection_profile()
+    quantization = None
+    if profile.quantization:
+        quantization = QuantizationSearchParams(rescore=profile.rescore, oversampling=profile.oversampling)
+    if quantization is None and settings.QDRANT_HNSW_EF is None:
+        return None
+    return SearchParams(hnsw_ef=settings.QDRANT_HNSW_EF, quantization=quantization)
+
+async def collection_exists(name: str) -> bool:
+    """True for a collection or an alias, so an aliased COLLECTION_NAME is not recreated."""
+    if await qdrant_client.collection_exists(name):
+        return True
+    aliases = await qdrant_client.get_aliases()
+    return any(alias.alias_name == name for alias in aliases.aliases)
+
+# Bulk loads running in this process per collection, and the indexing threshold to restore
+_bulk_loads: dict[str, int] = {}
+_restore_threshold: dict[str, int] = {}
+# Qdrant's own indexing_threshold default (KB of vectors per segment before it is indexed)
+DEFAULT_INDEXING_THRESHOLD = 20000
+
+def is_bulk_loading(collection_name: str) -> bool:
+    return _bulk_loads.get(collection_name, 0) > 0
+
+@asynccontextmanager
+async def bulk_load(collection_name: str):
+    """
+    Pauses HNSW indexing of a collection (indexing_threshold=0) for a large load, so incoming
+    points are only appended to segments instead of being indexed as they arrive. On exit the
+    previous threshold is restored and this waits until the collection is green, i.e. fully
+    indexed again. Searches keep working meanwhile, but scan the unindexed segments exhaustively.
+    Nested and concurrent loads of the same collection share one pause.
+    """
+    # Counted before the first await, so a load starting meanwhile joins this pause instead of
+    # reading the paused threshold as the one to restore
+    first = not is_bulk_loading(collection_name)
+    _bulk_loads[collection_name] = _bulk_loads.get(collection_name, 0) + 1
+    try:
+        if first:
+            info = await qdrant_client.get_collection(collection_name)
+            # 0 means a load elsewhere (e.g. another process) has indexing paused right now
+            threshold = info.config.optimizer_config.indexing_threshold
+            _restore_threshold[collection_name] = threshold or DEFAULT_INDEXING_THRESHOLD
+            await qdrant_client.update_collection(
+                collection_name=collection_name,
+                optimizers_config=OptimizersConfigDiff(indexing_threshold=0),
+            )
+            logger.info(f"Indexing of {collection_name} paused for a bulk load")
+        yield
+    finally:
+        _bulk_loads[collection_name] -= 1
+        if not _bulk_loads[collection_name]:
+            threshold = _restore_threshold.pop(collection_name, DEFAULT_INDEXING_THRESHOLD)
+            await qdrant_client.update_collection(
+                collection_name=collection_name,
+                optimizers_config=OptimizersConfigDiff(indexing_threshold=threshold),
+            )
+            await wait_until_indexed(collection_name, threshold)
+
+async def wait_until_indexed(collection_name: str, indexing_threshold: int | None = None, poll_seconds: float = 1.0, settle_polls: int = 3):
+    """
+    Waits until the optimizers have finished indexing (collection status green). A collection
+    can still report green for a moment after indexing was switched back on, so green only
+    counts once the new `indexing_threshold` is in effect and the optimizers have either been
+    seen busy or stayed idle for `settle_polls` polls (nothing left to index).
+    """
+    started = asyncio.get_running_loop().time()
+    busy, idle_polls = False, 0
+    while True:
+        info = await qdrant_client.get_collection(collection_name)
+        applied = indexing_threshold is None or info.config.optimizer_config.indexing_threshold == indexing_threshold
+        if info.status != "green":
+            busy = True
+        elif applied:
+            idle_polls += 1
+            # The embedded local mode indexes synchronously, so there is nothing to wait for
+            if busy or idle_polls >= settle_polls or not QDRANT_URL:
+                break
+        await asyncio.sleep(poll_seconds)
+    logger.info(f"{collection_name} indexed in {asyncio.get_running_loop().time() - started:.1f}s")
+
+async def upload_points_bulk(collection_name: str, points: list[PointStruct]):
+    """
+    Sends a large point list through the client's batched uploader, QDRANT_UPLOAD_PARALLEL
+    worker processes wide (over gRPC with QDRANT_PREFER_GRPC). The uploader is synchronous,
+    so it runs in a thread; the embedded local mode is written inline.
+    """
+    upload = functools.partial(
+        qdrant_client.upload_points,
+        collection_name=collection_name,
+        points=points,
+        batch_size=settings.QDRANT_UPLOAD_BATCH_SIZE,
+        parallel=settings.QDRANT_UPLOAD_PARALLEL,
+        wait=True,
+    )
+    if QDRANT_URL:
+        await asyncio.to_thread(upload)
+    else:
+        upload()
+
+async def alias_target(alias: str = COLLECTION_NAME) -> str | None:
+    """The collection `alias` points at, or None if it is not an alias."""
+    aliases = await qdrant_client.get_aliases()
+    return next((a.collection_name for a in aliases.aliases if a.alias_name == alias), None)
+
+async def point_alias_at(collection_name: str, alias: str = COLLECTION_NAME) -> str | None:
+    """
+    Points `alias` at `collection_name` and returns the collection it pointed at before.
+    Swapping an existing alias is atomic. A real collection squatting on the alias name (the
+    pre-versioning layout) is deleted first, so it must no longer be served from.
+    """
+    previous = await alias_target(alias)
+    operations = [CreateAliasOperation(create_alias=CreateAlias(collection_name=collection_name, alias_name=alias))]
+    if previous is not None:
+        operations.insert(0, DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias)))
+    elif await qdrant_client.collection_exists(alias):
+        await qdrant_client.delete_collection(alias)
+        previous = alias
+    await qdrant_client.update_collection_aliases(change_aliases_operations=operations)
+    return previous
+
+async def ensure_payload_indexes(collection_name: str, tenant_partitioned: bool | None = None):
+    """Creates the payload indexes filtered on by retrieval, ingestion and deletion (idempotent)."""
+    if tenant_partitioned is None:
+        tenant_partitioned = settings.QDRANT_TENANT_PARTITIONING
     await qdrant_client.create_payload_index(
-        collection_name=COLLECTION_NAME,
+        collection_name=collection_name,
         field_name="user_id",
-        field_schema="keyword"
+        # is_tenant co-locates each user's points on disk and keys the per-user HNSW graphs
+        field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True) if tenant_partitioned else "keyword",
     )
     await qdrant_client.create_payload_index(
-        collection_name=COLLECTION_NAME,
+        collection_name=collection_name,
         field_name="document_id",
         field_schema="keyword"
     )
+    await qdrant_client.create_payload_index(
+        collection_name=collection_name,
+        field_name="parent_chunk_id",
+        field_schema="keyword"
+    )
+
+async def init_qdrant():
+    """Create collection if it doesn't exist."""
+    dimensions = get_embedding_provider().dimensions
+    if not await collection_exists(COLLECTION_NAME):
+        # The profile only applies to new collections; changing it later needs a re-index
+        await qdrant_client.create_collection(
+            collection_name=COLLECTION_NAME,
+            **collection_config(get_collection_profile(), dimensions),
+        )
+        await ensure_payload_indexes(COLLECTION_NAME)
+        return
+
+    info = await qdrant_client.get_collection(COLLECTION_NAME)
+    if info.config.params.vectors.size != dimensions:
+        logger.error(
+            f"{COLLECTION_NAME} stores {info.config.params.vectors.size}-d vectors but the embedding "
+            f"provider produces {dimensions}-d ones; re-index before serving traffic"
+        )
+    # Keep an existing collection's layout: a global-graph collection is moved to the
+    # tenant-partitioned one with scripts/migrate_tenant_layout.py
+    await ensure_payload_indexes(COLLECTION_NAME, tenant_partitioned=info.config.hnsw_config.m == 0)
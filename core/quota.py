@@ -0,0 +1,127 @@
+import asyncio
+import time
+import structlog
+from collections import deque
+from enum import IntEnum
+
+logger = structlog.get_logger(__name__)
+
+class Priority(IntEnum):
+    """Lower values are served first."""
+    INTERACTIVE = 0 # query embeddings a user is waiting on
+    BULK = 1 # background ingestion
+
+class QuotaBroker:
+    """
+    Token bucket in front of a rate-limited API. Waiting callers are served strictly by
+    priority, so interactive requests never queue behind bulk work. The refill rate is learned
+    with AIMD: it grows by `increase` requests/s for every second of successful traffic and is
+    multiplied by `decrease` on a 429, at most once per `cooldown` seconds.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        burst: float,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        cooldown: float = 1.0,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._tokens = burst
+        self._refilled_at = time.monotonic()
+        self._last_decrease = float("-inf")
+        self._waiters: dict[Priority, deque] = {priority: deque() for priority in Priority}
+        self._dispatcher: asyncio.Task | None = None
+        self._dispatcher_loop: asyncio.AbstractEventLoop | None = None
+        self.throttles = 0
+        self._granted = {priority: 0 for priority in Priority}
+        self._wait_total = {priority: 0.0 for priority in Priority}
+        self._wait_max = {priority: 0.0 for priority in Priority}
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _has_waiters(self) -> bool:
+        return any(self._waiters.values())
+
+    async def acquire(self, priority: Priority = Priority.BULK):
+        """Waits for permission to send one request."""
+        started = time.monotonic()
+        self._refill()
+        if self._tokens >= 1 and not self._has_waiters():
+            self._tokens -= 1
+            self._record_wait(priority, 0.0)
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters[priority].append(future)
+        if self._dispatcher is None or self._dispatcher.done() or self._dispatcher_loop is not loop:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+            self._dispatcher_loop = loop
+        await future
+        self._record_wait(priority, time.monotonic() - started)
+
+    async def _dispatch(self):
+        while True:
+            for queue in self._waiters.values():
+                while queue and queue[0].done():  # Cancelled callers
+                    queue.popleft()
+            if not self._has_waiters():
+                return
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            self._tokens -= 1
+            for priority in Priority:
+                if self._waiters[priority]:
+                    self._waiters[priority].popleft().set_result(None)
+                    break
+
+    def _record_wait(self, priority: Priority, waited: float):
+        self._granted[priority] += 1
+        self._wait_total[priority] += waited
+        self._wait_max[priority] = max(self._wait_max[priority], waited)
+
+    def on_success(self):
+        """Additive increase: about +`increase` requests/s per second of successful traffic."""
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        """Multiplicative decrease on a 429; the bucket is emptied so callers back off at once."""
+        self.throttles += 1
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self._tokens = 0.0
+        self._refilled_at = now
+        logger.warning(f"Embedding API throttled, rate lowered to {self.rate:.2f} req/s")
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": round(self.rate, 3),
+            "throttles": self.throttles,
+            "queues": {
+                priority.name.lower(): {
+                    "depth": sum(1 for future in self._waiters[priority] if not future.done()),
+                    "granted": self._granted[priority],
+                    "avg_wait_ms": round(1000 * self._wait_total[priority] / self._granted[priority], 2) if self._granted[priority] else 0.0,
+                    "max_wait_ms": round(1000 * self._wait_max[priority], 2),
+                }
+                for priority in Priority
+            },
+        }
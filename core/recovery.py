@@ -4,11 +4,12 @@ from core.transactions import scoped_transaction
 
 async def recover_zombie_jobs() -> int:
     """
-    Finds jobs stuck in 'PROCESSING' state on server boot and reverts them to 'PENDING'.
+    Finds jobs stuck in 'PROCESSING' or 'EMBEDDING' state on server boot and reverts them to
+    'PENDING'. Their checkpoints are kept, so ingestion resumes where it stopped.
     Returns the number of jobs recovered.
     """
     async with scoped_transaction() as session:
-        statement = select(ProcessingJob).where(ProcessingJob.status == "PROCESSING")
+        statement = select(ProcessingJob).where(ProcessingJob.status.in_(["PROCESSING", "EMBEDDING"]))
         results = await session.execute(statement)
         jobs = results.scalars().all()
         for job in jobs:
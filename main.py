@@ -1,4 +1,4 @@
-from fastapi import FastAPI, File, UploadFile, Request
+from fastapi import FastAPI, File, UploadFile, Request, Depends
 from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 import asyncio
@@ -16,6 +16,13 @@ from slowapi.errors import RateLimitExceeded
 from api.routers.auth import limiter
 import logging
 from core.qdrant import init_qdrant
+from core.embedding_index import refresh_embedding_indexes, watch_embedding_indexes
+from core import embedding_cache
+from core.embeddings import embedding_batcher, quota_broker, query_embedding_cache
+from services.chunking import shutdown_extraction_pool
+from services.retrieval import rewrite_cache, rewrite_stats, retrieval_cache
+from services.answer_cache import answer_cache
+from api.dependencies import get_current_user
 
 from core.database import engine
 
@@ -47,24 +54,29 @@ if sentry_dsn:
     )
 
 worker_task = None
+index_watch_task = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global worker_task
+    global worker_task, index_watch_task
     # Startup Sequence
     # 1. Recover any interrupted jobs
     recovered = await recover_zombie_jobs()
     print(f"Recovered {recovered} zombie jobs.")
     
-    # 1.5 Init Qdrant
+    # 1.5 Init Qdrant, serving from the collection of the latest completed re-embedding
+    await refresh_embedding_indexes()
     await init_qdrant()
     print("Qdrant collection initialized.")
+    index_watch_task = asyncio.create_task(watch_embedding_indexes())
     
     # 2. Start the daemon worker loop
     worker_task = asyncio.create_task(worker_loop())
     yield
     
     # Shutdown Sequence
+    if index_watch_task:
+        index_watch_task.cancel()
     if worker_task:
         worker_task.cancel()
         try:
@@ -72,6 +84,7 @@ async def lifespan(app: FastAPI):
         except asyncio.CancelledError:
             pass
         print("Worker cleanly shut down.")
+    shutdown_extraction_pool()
 
 app = FastAPI(title="RecallAI", lifespan=lifespan)
 app.state.limiter = limiter
@@ -101,6 +114,18 @@ from fastapi.staticfiles import StaticFiles
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", dependencies=[Depends(get_current_user)])
+async def metrics():
+    return {
+        "embedding_cache": embedding_cache.stats.as_dict(),
+        "embedding_batcher": embedding_batcher.stats(),
+        "embedding_quota": quota_broker.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "query_rewrite": {**rewrite_stats, "cache": rewrite_cache.stats()},
+        "retrieval_cache": retrieval_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+    }
+
 @app.get("/crash")
 async def crash():
     raise ValueError("Intentional crash for testing")
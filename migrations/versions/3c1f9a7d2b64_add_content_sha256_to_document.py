@@ -0,0 +1,30 @@
+"""add content_sha256 to document
+
+Revision ID: 3c1f9a7d2b64
+Revises: d0e24fb439cd
+Create Date: 2026-10-18 09:12:41.503218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1f9a7d2b64'
+down_revision: Union[str, Sequence[str], None] = 'd0e24fb439cd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('document', sa.Column('content_sha256', sa.String(), nullable=True))
+    op.create_index(op.f('ix_document_content_sha256'), 'document', ['content_sha256'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_document_content_sha256'), table_name='document')
+    op.drop_column('document', 'content_sha256')
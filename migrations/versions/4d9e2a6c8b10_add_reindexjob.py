@@ -0,0 +1,44 @@
+"""add reindexjob
+
+Revision ID: 4d9e2a6c8b10
+Revises: b8d4e61f0c27
+Create Date: 2026-10-18 16:02:37.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d9e2a6c8b10'
+down_revision: Union[str, Sequence[str], None] = 'b8d4e61f0c27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('reindexjob',
+    sa.Column('id', sa.Uuid(), nullable=False),
+    sa.Column('provider', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('dimensions', sa.Integer(), nullable=True),
+    sa.Column('model_version', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('collection_name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('status', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('cursor', sa.Uuid(), nullable=True),
+    sa.Column('documents_done', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_reindexjob_status'), 'reindexjob', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_reindexjob_status'), table_name='reindexjob')
+    op.drop_table('reindexjob')
@@ -0,0 +1,37 @@
+"""add embedding cache
+
+Revision ID: 7e2b5c0a9f13
+Revises: 3c1f9a7d2b64
+Create Date: 2026-10-18 11:04:17.228913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e2b5c0a9f13'
+down_revision: Union[str, Sequence[str], None] = '3c1f9a7d2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('embeddingcacheentry',
+    sa.Column('model', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('text_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('vector', sa.LargeBinary(), nullable=False),
+    sa.Column('last_used_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('model', 'text_hash')
+    )
+    op.create_index(op.f('ix_embeddingcacheentry_last_used_at'), 'embeddingcacheentry', ['last_used_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_embeddingcacheentry_last_used_at'), table_name='embeddingcacheentry')
+    op.drop_table('embeddingcacheentry')
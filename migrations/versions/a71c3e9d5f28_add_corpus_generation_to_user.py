@@ -0,0 +1,28 @@
+"""add corpus_generation to user
+
+Revision ID: a71c3e9d5f28
+Revises: e5a03b7d41c9
+Create Date: 2026-10-18 19:02:37.118406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a71c3e9d5f28'
+down_revision: Union[str, Sequence[str], None] = 'e5a03b7d41c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('user', sa.Column('corpus_generation', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('user', 'corpus_generation')
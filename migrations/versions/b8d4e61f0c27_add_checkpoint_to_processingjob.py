@@ -0,0 +1,32 @@
+"""add checkpoint to processingjob
+
+Revision ID: b8d4e61f0c27
+Revises: 7e2b5c0a9f13
+Create Date: 2026-10-18 14:26:52.904117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d4e61f0c27'
+down_revision: Union[str, Sequence[str], None] = '7e2b5c0a9f13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('processingjob', sa.Column('checkpoint_chunk_index', sa.Integer(), nullable=True))
+    op.add_column('processingjob', sa.Column('checkpoint_page', sa.Integer(), nullable=True))
+    op.add_column('processingjob', sa.Column('checkpoint_carry', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('processingjob', 'checkpoint_carry')
+    op.drop_column('processingjob', 'checkpoint_page')
+    op.drop_column('processingjob', 'checkpoint_chunk_index')
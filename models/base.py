@@ -3,7 +3,7 @@ from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
 from datetime import datetime, timezone
 
-from sqlalchemy import Column, DateTime
+from sqlalchemy import Column, DateTime, LargeBinary, Text
 from sqlalchemy.dialects.postgresql import TSVECTOR
 
 def utc_now():
@@ -14,6 +14,8 @@ class User(SQLModel, table=True):
     username: str = Field(unique=True, index=True)
     hashed_password: str
     created_at: datetime = Field(default_factory=utc_now, sa_column=Column(DateTime(timezone=True)))
+    # Bumped whenever the user's searchable corpus changes; keys the retrieval cache
+    corpus_generation: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
     
     sessions: List["Session"] = Relationship(back_populates="user", cascade_delete=True)
     documents: List["Document"] = Relationship(back_populates="user", cascade_delete=True)
@@ -32,6 +34,7 @@ class Document(SQLModel, table=True):
     filename: str
     status: str = Field(default="PENDING", index=True)
     embedding_model_version: Optional[str] = Field(default=None)
+    content_sha256: Optional[str] = Field(default=None, index=True)
     created_at: datetime = Field(default_factory=utc_now, sa_column=Column(DateTime(timezone=True)))
     
     user: User = Relationship(back_populates="documents")
@@ -54,6 +57,10 @@ class ProcessingJob(SQLModel, table=True):
     document_id: uuid.UUID = Field(foreign_key="document.id", ondelete="CASCADE", index=True)
     status: str = Field(default="PENDING", index=True) # PENDING, PROCESSING, COMPLETED, FAILED
     updated_at: datetime = Field(default_factory=utc_now, sa_column=Column(DateTime(timezone=True)))
+    # Resume state of an interrupted ingestion; cleared once the job completes or fails
+    checkpoint_chunk_index: Optional[int] = Field(default=None) # last parent whose vectors are all upserted
+    checkpoint_page: Optional[int] = Field(default=None) # next page to extract, 0-based
+    checkpoint_carry: Optional[str] = Field(default=None, sa_column=Column(Text)) # splitter text not yet emitted
     
     document: Document = Relationship(back_populates="jobs")
 
@@ -80,6 +87,41 @@ class TokenBlocklist(SQLModel, table=True):
     jti: str = Field(index=True, unique=True)
     expires_at: datetime = Field(sa_column=Column(DateTime(timezone=True)))
 
+class ReindexJob(SQLModel, table=True):
+    """
+    Re-embeds every document into a new versioned Qdrant collection while the current one keeps
+    serving. The latest COMPLETED job decides which collection and model serve queries.
+    """
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    provider: str # EMBEDDING_PROVIDER name of the target model
+    dimensions: Optional[int] = Field(default=None) # Matryoshka truncation, None for native size
+    model_version: str
+    collection_name: str
+    status: str = Field(default="RUNNING", index=True) # RUNNING, COMPLETED, CANCELLED
+    cursor: Optional[uuid.UUID] = Field(default=None) # last re-embedded document, in id order
+    documents_done: int = Field(default=0)
+    started_at: datetime = Field(default_factory=utc_now, sa_column=Column(DateTime(timezone=True)))
+    updated_at: datetime = Field(default_factory=utc_now, sa_column=Column(DateTime(timezone=True)))
+    completed_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+
+class RebuildJob(SQLModel, table=True):
+    """Re-creates the vectors of one user, one document or everyone from the parent text in Postgres."""
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    user_id: Optional[uuid.UUID] = Field(default=None) # scope; None with document_id None means all
+    document_id: Optional[uuid.UUID] = Field(default=None)
+    status: str = Field(default="RUNNING", index=True) # RUNNING, COMPLETED
+    cursor: Optional[uuid.UUID] = Field(default=None) # last document whose vectors are all upserted
+    documents_done: int = Field(default=0)
+    chunks_done: int = Field(default=0) # child vectors written
+    started_at: datetime = Field(default_factory=utc_now, sa_column=Column(DateTime(timezone=True)))
+    updated_at: datetime = Field(default_factory=utc_now, sa_column=Column(DateTime(timezone=True)))
+
+class EmbeddingCacheEntry(SQLModel, table=True):
+    model: str = Field(primary_key=True)
+    text_hash: str = Field(primary_key=True) # sha256 of the embedded text
+    vector: bytes = Field(sa_column=Column(LargeBinary, nullable=False)) # packed float32
+    last_used_at: datetime = Field(default_factory=utc_now, sa_column=Column(DateTime(timezone=True), index=True))
+
 """
 # MANUAL MIGRATION REQUIRED FOR HYBRID SEARCH
 # Since Alembic / migrations are not being managed here, you must run this SQL manually on your PostgreSQL instance:
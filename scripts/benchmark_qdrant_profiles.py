@@ -0,0 +1,71 @@
+import asyncio
+import sys
+import time
+import numpy as np
+from qdrant_client.http.models import PointStruct
+from core.qdrant import qdrant_client, COLLECTION_PROFILES, collection_config, get_search_params
+
+# Quantization only takes effect on a Qdrant server (QDRANT_URL); the embedded local mode
+# stores and searches full vectors whatever the profile says.
+NUM_POINTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+NUM_QUERIES = 200
+DIMENSIONS = 768
+TOP_K = 10
+UPSERT_BATCH = 1000
+
+def make_vectors(num: int, rng: np.random.Generator, centroids: np.ndarray) -> np.ndarray:
+    """Clustered unit vectors, closer to real embeddings than uniform noise."""
+    vectors = centroids[rng.integers(len(centroids), size=num)] + 0.35 * rng.standard_normal((num, DIMENSIONS))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+async def wait_until_indexed(collection: str):
+    while (await qdrant_client.get_collection(collection)).status != "green":
+        await asyncio.sleep(0.5)
+
+async def benchmark_profile(name: str, points: np.ndarray, queries: np.ndarray, truth: np.ndarray):
+    profile = COLLECTION_PROFILES[name]
+    collection = f"bench_{name}"
+    if await qdrant_client.collection_exists(collection):
+        await qdrant_client.delete_collection(collection)
+    await qdrant_client.create_collection(collection, **collection_config(profile, DIMENSIONS))
+
+    start = time.perf_counter()
+    for offset in range(0, len(points), UPSERT_BATCH):
+        batch = points[offset:offset + UPSERT_BATCH]
+        await qdrant_client.upsert(
+            collection,
+            points=[PointStruct(id=offset + i, vector=vector.tolist()) for i, vector in enumerate(batch)],
+        )
+    await wait_until_indexed(collection)
+    load_time = time.perf_counter() - start
+
+    params = get_search_params(profile)
+    latencies = []
+    recalls = []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = await qdrant_client.query_points(collection, query=query.tolist(), limit=TOP_K, search_params=params)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len({p.id for p in result.points} & set(expected.tolist())) / TOP_K)
+
+    latencies_ms = np.array(latencies) * 1000
+    print(
+        f"  {name:<8} recall@{TOP_K} {np.mean(recalls):.3f}  p50 {np.percentile(latencies_ms, 50):6.2f} ms  "
+        f"p99 {np.percentile(latencies_ms, 99):6.2f} ms  load+index {load_time:6.1f}s"
+    )
+    await qdrant_client.delete_collection(collection)
+
+async def main():
+    print(f"Starting Qdrant Profile Benchmark ({NUM_POINTS} points, {DIMENSIONS}d, {NUM_QUERIES} queries)...")
+    rng = np.random.default_rng(42)
+    centroids = rng.standard_normal((256, DIMENSIONS))
+    points = make_vectors(NUM_POINTS, rng, centroids)
+    queries = make_vectors(NUM_QUERIES, rng, centroids)
+    # Exact top-k by brute force is the recall reference
+    truth = np.argsort(-(queries @ points.T), axis=1)[:, :TOP_K]
+
+    for name in COLLECTION_PROFILES:
+        await benchmark_profile(name, points, queries, truth)
+
+if __name__ == "__main__":
+    asyncio.run(main())
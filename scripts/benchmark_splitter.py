@@ -0,0 +1,71 @@
+import time
+import random
+import tracemalloc
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from services.chunking import (
+    _chunk_pages,
+    PARENT_CHUNK_SIZE,
+    PARENT_CHUNK_OVERLAP,
+    CHILD_CHUNK_SIZE,
+    CHILD_CHUNK_OVERLAP,
+    MAX_BUFFER_SIZE,
+    SEPARATORS,
+)
+
+def langchain_chunk_pages(page_texts):
+    """The previous streaming loop on top of langchain's splitter."""
+    parent_splitter = RecursiveCharacterTextSplitter(chunk_size=PARENT_CHUNK_SIZE, chunk_overlap=PARENT_CHUNK_OVERLAP, separators=SEPARATORS)
+    child_splitter = RecursiveCharacterTextSplitter(chunk_size=CHILD_CHUNK_SIZE, chunk_overlap=CHILD_CHUNK_OVERLAP, separators=SEPARATORS)
+    buffer = ""
+    for page_text in page_texts:
+        buffer += page_text + "\n"
+        while len(buffer) >= PARENT_CHUNK_SIZE * 2:
+            chunks = parent_splitter.split_text(buffer)
+            if len(chunks) > 1:
+                for chunk in chunks[:-1]:
+                    yield chunk, child_splitter.split_text(chunk)
+                buffer = chunks[-1]
+            else:
+                if len(buffer) > MAX_BUFFER_SIZE:
+                    yield buffer, child_splitter.split_text(buffer)
+                    buffer = ""
+                break
+    if buffer.strip():
+        for chunk in parent_splitter.split_text(buffer):
+            yield chunk, child_splitter.split_text(chunk)
+
+def make_pages(num_pages: int, chars_per_page: int) -> list[str]:
+    rng = random.Random(42)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnop") for _ in range(rng.randint(2, 10))) for _ in range(5000)]
+    pages = []
+    for _ in range(num_pages):
+        lines = []
+        length = 0
+        while length < chars_per_page:
+            line = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(5, 15)))
+            lines.append(line)
+            length += len(line) + 1
+        pages.append("\n".join(lines))
+    return pages
+
+def measure(name: str, chunker, pages: list[str]):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = list(chunker(pages))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {name:<10} {elapsed * 1000:8.1f} ms  peak {peak / 10**6:6.2f} MB  {len(chunks)} parents")
+    return chunks
+
+def main():
+    print("Starting Splitter Microbenchmark...")
+    for num_pages, chars_per_page in [(200, 3000), (200, 12000), (2000, 3000)]:
+        pages = make_pages(num_pages, chars_per_page)
+        print(f"[{num_pages} pages x ~{chars_per_page} chars]")
+        reference = measure("langchain", langchain_chunk_pages, pages)
+        incremental = measure("recallai", _chunk_pages, pages)
+        assert incremental == reference, "Splitter output diverged from langchain"
+
+if __name__ == "__main__":
+    main()
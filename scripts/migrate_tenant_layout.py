@@ -0,0 +1,133 @@
+"""
+Moves the points of COLLECTION_NAME into a new tenant-partitioned collection (no global HNSW
+graph, one graph per user_id) and then points COLLECTION_NAME at it through an alias.
+
+Stop the ingestion workers first: points written to the old collection during the copy are not
+carried over. The copy is idempotent, so an interrupted run can simply be started again.
+
+If COLLECTION_NAME is still a real collection rather than an alias, the cut-over has to delete
+it before the alias can take its name, so searches fail for the moment in between.
+
+Processes serve a re-embedded model from the collection recorded on its ReindexJob, through the
+alias once the alias points there. That job is moved to the new collection along with the alias.
+"""
+import argparse
+import asyncio
+from sqlmodel import select
+from core.database import AsyncSessionLocal
+from core.transactions import scoped_transaction
+from models.base import ReindexJob
+from core.qdrant import (
+    qdrant_client,
+    COLLECTION_NAME,
+    collection_config,
+    ensure_payload_indexes,
+    get_collection_profile,
+)
+from qdrant_client.http.models import (
+    PointStruct,
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
+)
+
+SCROLL_PAGE = 1000
+
+async def resolve_collection(name: str) -> tuple[str, bool]:
+    """Returns (collection, is_alias) for a collection or alias name."""
+    aliases = await qdrant_client.get_aliases()
+    for alias in aliases.aliases:
+        if alias.alias_name == name:
+            return alias.collection_name, True
+    return name, False
+
+async def copy_points(source: str, target: str) -> int:
+    copied = 0
+    offset = None
+    while True:
+        points, offset = await qdrant_client.scroll(
+            source,
+            limit=SCROLL_PAGE,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            await qdrant_client.upsert(
+                target,
+                points=[PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in points],
+                wait=True,
+            )
+            copied += len(points)
+            print(f"  copied {copied} points")
+        if offset is None:
+            return copied
+
+async def main(target: str, cutover: bool, drop_source: bool):
+    source, is_alias = await resolve_collection(COLLECTION_NAME)
+    if source == target:
+        print(f"{COLLECTION_NAME} already points at {target}")
+        return
+    async with AsyncSessionLocal() as session:
+        running = (await session.execute(
+            select(ReindexJob).where(ReindexJob.status == "RUNNING").limit(1)
+        )).scalar_one_or_none()
+        serving = (await session.execute(
+            select(ReindexJob)
+            .where(ReindexJob.status == "COMPLETED")
+            .order_by(ReindexJob.completed_at.desc())
+            .limit(1)
+        )).scalar_one_or_none()
+    if running:
+        raise SystemExit(f"Re-embedding {running.id} is running; finish or cancel it first")
+    if serving and serving.collection_name != source:
+        raise SystemExit(f"Queries are served from {serving.collection_name}, not {source}; finish the re-embedding cut-over first")
+
+    info = await qdrant_client.get_collection(source)
+    if not await qdrant_client.collection_exists(target):
+        await qdrant_client.create_collection(
+            target,
+            **collection_config(get_collection_profile(), info.config.params.vectors.size, tenant_partitioned=True),
+        )
+        await ensure_payload_indexes(target, tenant_partitioned=True)
+
+    print(f"Copying {source} -> {target}...")
+    copied = await copy_points(source, target)
+    source_count = (await qdrant_client.count(source, exact=True)).count
+    target_count = (await qdrant_client.count(target, exact=True)).count
+    print(f"{copied} points copied; {source} has {source_count}, {target} has {target_count}")
+    if target_count < source_count:
+        raise SystemExit("Target is missing points; not cutting over")
+    if not cutover:
+        print("Copy complete. Re-run with --cutover to switch traffic.")
+        return
+
+    if serving:
+        # Processes that refresh before the alias moves search the target by name meanwhile
+        async with scoped_transaction() as session:
+            job = await session.get(ReindexJob, serving.id)
+            job.collection_name = target
+    if is_alias:
+        # Atomic: readers see either the old or the new collection
+        await qdrant_client.update_collection_aliases(change_aliases_operations=[
+            DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=COLLECTION_NAME)),
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=COLLECTION_NAME)),
+        ])
+    else:
+        await qdrant_client.delete_collection(source)
+        await qdrant_client.update_collection_aliases(change_aliases_operations=[
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=COLLECTION_NAME)),
+        ])
+    print(f"{COLLECTION_NAME} now points at {target}")
+    if is_alias and drop_source:
+        await qdrant_client.delete_collection(source)
+        print(f"Dropped {source}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--target", default=f"{COLLECTION_NAME}_tenants")
+    parser.add_argument("--cutover", action="store_true", help="Point the alias at the new collection after copying")
+    parser.add_argument("--drop-source", action="store_true", help="Delete the old collection after an alias cut-over")
+    args = parser.parse_args()
+    asyncio.run(main(args.target, args.cutover, args.drop_source))
@@ -0,0 +1,114 @@
+import asyncio
+import fitz
+import os
+import shutil
+import uuid
+from sqlalchemy import event
+from sqlmodel import SQLModel
+from core.database import engine
+from models.base import User, ProcessingJob, Document, DocumentChunk
+from core.transactions import scoped_transaction
+from core.qdrant import init_qdrant, qdrant_client, COLLECTION_NAME
+from services.ingestion import process_document
+from core.storage import get_secure_file_path, ensure_upload_dir
+from unittest.mock import patch
+
+def create_large_pdf(filename: str, num_pages: int):
+    doc = fitz.open()
+    for _ in range(num_pages):
+        page = doc.new_page()
+        # Lots of text to simulate a dense page (~3000 chars per page)
+        text = "This is a dummy PDF file for testing database round trips. " * 60
+        page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=8)
+    doc.save(filename)
+    doc.close()
+
+async def mock_generate_embeddings(texts):
+    return [[0.1] * 768 for _ in texts]
+
+async def persist_parent_chunks_per_row(rows: list[dict]):
+    """The pre-bulk write path: one transaction and one flush per parent chunk."""
+    for row in rows:
+        async with scoped_transaction() as session:
+            session.add(DocumentChunk(**row))
+            await session.flush()
+
+class RoundTripCounter:
+    """Counts statements sent to Postgres and transactions committed."""
+    def __init__(self):
+        self.statements = 0
+        self.commits = 0
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+    def on_commit(self, conn):
+        self.commits += 1
+
+async def setup_job(pdf_name: str) -> uuid.UUID:
+    async with scoped_transaction() as session:
+        user = User(username=f"bench_{uuid.uuid4()}", hashed_password="pwd")
+        session.add(user)
+        await session.flush()
+        doc = Document(user_id=user.id, filename=pdf_name)
+        session.add(doc)
+        await session.flush()
+        job = ProcessingJob(document_id=doc.id)
+        session.add(job)
+        await session.flush()
+        doc_id = doc.id
+        job_id = job.id
+
+    dest_path = get_secure_file_path(doc_id, pdf_name)
+    shutil.copy(pdf_name, dest_path)
+    return job_id
+
+async def count_round_trips(pdf_name: str, bulk: bool) -> RoundTripCounter:
+    job_id = await setup_job(pdf_name)
+    counter = RoundTripCounter()
+    event.listen(engine.sync_engine, "before_cursor_execute", counter.on_execute)
+    event.listen(engine.sync_engine, "commit", counter.on_commit)
+    try:
+        with patch("services.ingestion.generate_embeddings", side_effect=mock_generate_embeddings):
+            if bulk:
+                await process_document(job_id)
+            else:
+                with patch("services.ingestion._persist_parent_chunks", side_effect=persist_parent_chunks_per_row):
+                    await process_document(job_id)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", counter.on_execute)
+        event.remove(engine.sync_engine, "commit", counter.on_commit)
+    return counter
+
+async def profile_round_trips(num_pages: int):
+    pdf_name = f"dummy_{num_pages}.pdf"
+    create_large_pdf(pdf_name, num_pages)
+
+    await init_qdrant()
+    ensure_upload_dir()
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+    before = await count_round_trips(pdf_name, bulk=False)
+    after = await count_round_trips(pdf_name, bulk=True)
+
+    print(
+        f"[{num_pages} pages] per-row: {before.statements / num_pages:.2f} statements/page, "
+        f"{before.commits / num_pages:.2f} commits/page | bulk: {after.statements / num_pages:.2f} "
+        f"statements/page, {after.commits / num_pages:.2f} commits/page"
+    )
+
+    # Cleanup
+    os.remove(pdf_name)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+    await qdrant_client.delete_collection(COLLECTION_NAME)
+
+async def main():
+    print("Starting DB Round Trip Profiling...")
+    for pages in [10, 100, 1000]:
+        await profile_round_trips(pages)
+
+if __name__ == "__main__":
+    asyncio.run(main())
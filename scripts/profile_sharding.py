@@ -0,0 +1,95 @@
+import asyncio
+import time
+import fitz
+import os
+import shutil
+from sqlmodel import SQLModel
+from core.database import engine, AsyncSessionLocal
+from models.base import User, ProcessingJob, Document
+from core.transactions import scoped_transaction
+from core.qdrant import init_qdrant, qdrant_client, COLLECTION_NAME
+from services.ingestion import process_document
+from services.chunking import shutdown_extraction_pool
+from core.storage import get_secure_file_path, ensure_upload_dir
+from unittest.mock import patch
+
+SHARD_PAGES = 50
+
+def create_large_pdf(filename: str, num_pages: int):
+    doc = fitz.open()
+    for _ in range(num_pages):
+        page = doc.new_page()
+        # Lots of text to simulate a dense page (~3000 chars per page)
+        text = "This is a dummy PDF file for testing sharded extraction. " * 60
+        page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=8)
+    doc.save(filename)
+    doc.close()
+
+async def mock_generate_embeddings(texts):
+    return [[0.1] * 768 for _ in texts]
+
+async def time_to_completed(pdf_name: str, shard_pages: int) -> float:
+    async with scoped_transaction() as session:
+        user = User(username=f"shard_{shard_pages}_{time.time_ns()}", hashed_password="pwd")
+        session.add(user)
+        await session.flush()
+        doc = Document(user_id=user.id, filename=pdf_name)
+        session.add(doc)
+        await session.flush()
+        job = ProcessingJob(document_id=doc.id)
+        session.add(job)
+        await session.flush()
+        doc_id = doc.id
+        job_id = job.id
+
+    dest_path = get_secure_file_path(doc_id, pdf_name)
+    shutil.copy(pdf_name, dest_path)
+
+    start = time.perf_counter()
+    # Every run embeds the same text: the embedding cache would serve all runs after the first
+    with patch("services.ingestion.generate_embeddings", side_effect=mock_generate_embeddings), \
+         patch("services.ingestion.settings.EMBEDDING_CACHE_ENABLED", False), \
+         patch("services.ingestion.settings.EXTRACTION_SHARD_PAGES", shard_pages):
+        await process_document(job_id)
+    elapsed = time.perf_counter() - start
+
+    async with AsyncSessionLocal() as session:
+        doc = await session.get(Document, doc_id)
+        assert doc.status == "COMPLETED"
+    return elapsed
+
+async def profile_sharding(num_pages: int):
+    # Setup
+    pdf_name = f"dummy_{num_pages}.pdf"
+    create_large_pdf(pdf_name, num_pages)
+
+    await init_qdrant()
+    ensure_upload_dir()
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+    sequential = await time_to_completed(pdf_name, shard_pages=0)
+    # Warm the process pool so worker start-up isn't billed to the first measurement
+    await time_to_completed(pdf_name, shard_pages=SHARD_PAGES)
+    sharded = await time_to_completed(pdf_name, shard_pages=SHARD_PAGES)
+
+    print(
+        f"[{num_pages} pages] sequential: {sequential:.2f}s, sharded ({SHARD_PAGES} pages/shard, "
+        f"{os.cpu_count()} cores): {sharded:.2f}s, speedup: {sequential / sharded:.2f}x"
+    )
+
+    # Cleanup
+    os.remove(pdf_name)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.drop_all)
+    await qdrant_client.delete_collection(COLLECTION_NAME)
+
+async def main():
+    print("Starting Sharded Extraction Profiling...")
+    for pages in [100, 1000, 5000]:
+        await profile_sharding(pages)
+    shutdown_extraction_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+"""
+Rebuilds Qdrant vectors from the parent chunks stored in Postgres, e.g. after losing Qdrant data.
+
+  python scripts/rebuild_index.py                      # every document
+  python scripts/rebuild_index.py --user <uuid>        # one user's documents
+  python scripts/rebuild_index.py --document <uuid>
+  python scripts/rebuild_index.py --resume             # continue the last interrupted rebuild
+
+Add --bulk-load for large rebuilds: indexing is paused until every vector is uploaded, which
+loads several times faster but leaves searches slower until the index is rebuilt at the end.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from sqlmodel import select
+from core.database import AsyncSessionLocal
+from core.embedding_index import refresh_embedding_indexes
+from core.qdrant import init_qdrant
+from models.base import RebuildJob
+from services.rebuild import start_rebuild, run_rebuild
+
+async def main(args):
+    await refresh_embedding_indexes()
+    await init_qdrant()
+    if args.resume:
+        async with AsyncSessionLocal() as session:
+            job = (await session.execute(
+                select(RebuildJob).where(RebuildJob.status == "RUNNING").order_by(RebuildJob.started_at.desc()).limit(1)
+            )).scalar_one_or_none()
+        if not job:
+            raise SystemExit("No interrupted rebuild")
+        job_id = job.id
+        print(f"Resuming {job_id} after {job.documents_done} documents")
+    else:
+        job_id = await start_rebuild(args.user, args.document)
+        print(f"Started rebuild {job_id}")
+        
+    start = time.perf_counter()
+    written = await run_rebuild(job_id, bulk=args.bulk_load)
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {written} vectors in {elapsed:.1f}s ({written / max(elapsed, 1e-9):.0f}/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--user", type=uuid.UUID)
+    scope.add_argument("--document", type=uuid.UUID)
+    scope.add_argument("--resume", action="store_true")
+    parser.add_argument("--bulk-load", action="store_true", help="Pause indexing and upload in parallel batches")
+    asyncio.run(main(parser.parse_args()))
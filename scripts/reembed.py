@@ -0,0 +1,59 @@
+"""
+Zero-downtime embedding model migration.
+
+  python scripts/reembed.py start --provider gemini --dimensions 256
+  python scripts/reembed.py resume      # after a crash or restart
+  python scripts/reembed.py status
+  python scripts/reembed.py cancel
+
+`start` builds a new versioned collection from the parent text in Postgres while the current
+collection keeps serving, then switches every process over and moves the recallai_chunks alias.
+"""
+import argparse
+import asyncio
+from sqlmodel import select
+from core.database import AsyncSessionLocal
+from models.base import ReindexJob
+from services.reembedding import start_reembedding, run_reembedding, cancel_reembedding
+
+async def latest_job(status: str | None = None) -> ReindexJob | None:
+    query = select(ReindexJob).order_by(ReindexJob.started_at.desc()).limit(1)
+    if status:
+        query = query.where(ReindexJob.status == status)
+    async with AsyncSessionLocal() as session:
+        return (await session.execute(query)).scalar_one_or_none()
+
+async def main(args):
+    if args.command == "start":
+        job_id = await start_reembedding(args.provider, args.dimensions)
+        print(f"Started {job_id}")
+        print(f"Re-embedded {await run_reembedding(job_id)} documents")
+    elif args.command == "resume":
+        job = await latest_job("RUNNING")
+        if not job:
+            raise SystemExit("No running re-embedding")
+        print(f"Resuming {job.id} after {job.documents_done} documents")
+        print(f"Re-embedded {await run_reembedding(job.id)} documents")
+    elif args.command == "cancel":
+        job = await latest_job("RUNNING")
+        if not job:
+            raise SystemExit("No running re-embedding")
+        await cancel_reembedding(job.id)
+        print(f"Cancelled {job.id}; dropped {job.collection_name}")
+    else:
+        job = await latest_job()
+        if not job:
+            print("No re-embedding has run")
+            return
+        print(f"{job.id} {job.status}: {job.model_version} -> {job.collection_name}, {job.documents_done} documents done")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    start = commands.add_parser("start")
+    start.add_argument("--provider", required=True, choices=["gemini", "local", "simulated"])
+    start.add_argument("--dimensions", type=int, default=None)
+    commands.add_parser("resume")
+    commands.add_parser("status")
+    commands.add_parser("cancel")
+    asyncio.run(main(parser.parse_args()))
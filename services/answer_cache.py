@@ -0,0 +1,128 @@
+import re
+import uuid
+import asyncio
+import numpy as np
+from dataclasses import dataclass
+from typing import AsyncGenerator
+from core.cache import AsyncLRUCache
+from core.config import settings
+from core.embeddings import embedding_model_version
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    vector: np.ndarray # unit-length query embedding
+    model_version: str # embedding model that produced `vector`
+    parent_ids: frozenset[uuid.UUID]
+    answer: str
+    generation_seconds: float
+
+class SemanticAnswerCache:
+    """
+    Answers to earlier questions, replayed for a new question that is at least `threshold`
+    cosine-similar to one of them and retrieves the same parents. Entries are grouped per
+    (user, corpus generation, document filter, embedding model), so any change to the user's
+    documents or a switch to another embedding model makes the old answers unreachable, and at
+    most `max_per_scope` recent answers are compared per scope.
+    """
+
+    def __init__(self, enabled: bool, threshold: float, max_scopes: int, max_per_scope: int, max_bytes: int, ttl: float):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_per_scope = max_per_scope
+        self._scopes = AsyncLRUCache(
+            max_entries=max_scopes,
+            max_bytes=max_bytes,
+            ttl=ttl,
+            sizeof=lambda key, answers: sum(
+                200 + answer.vector.nbytes + 2 * len(answer.answer) + 64 * len(answer.parent_ids) for answer in answers
+            ),
+        )
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.seconds_saved = 0.0
+        self.chars_saved = 0
+
+    @staticmethod
+    def _scope(user_id: uuid.UUID, generation: int, document_ids: list[uuid.UUID] | None, model_version: str) -> tuple:
+        return (user_id, generation, tuple(sorted(document_ids)) if document_ids else None, model_version)
+
+    @staticmethod
+    def _unit(vector: list[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def lookup(
+        self,
+        user_id: uuid.UUID,
+        generation: int,
+        document_ids: list[uuid.UUID] | None,
+        vector: list[float],
+        parent_ids: list[uuid.UUID],
+    ) -> CachedAnswer | None:
+        model_version = embedding_model_version()
+        answers = self._scopes.get(self._scope(user_id, generation, document_ids, model_version)) or ()
+        query = self._unit(vector)
+        parents = frozenset(parent_ids)
+        best, best_similarity = None, self.threshold
+        for answer in answers:
+            # Vectors of another model live in another space, and may not even be the same size
+            if answer.model_version != model_version or answer.vector.shape != query.shape:
+                continue
+            similarity = float(answer.vector @ query)
+            if similarity >= best_similarity and answer.parent_ids == parents:
+                best, best_similarity = answer, similarity
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.seconds_saved += best.generation_seconds
+        self.chars_saved += len(best.answer)
+        return best
+
+    def store(
+        self,
+        user_id: uuid.UUID,
+        generation: int,
+        document_ids: list[uuid.UUID] | None,
+        vector: list[float],
+        parent_ids: list[uuid.UUID],
+        answer: str,
+        generation_seconds: float,
+    ):
+        model_version = embedding_model_version()
+        scope = self._scope(user_id, generation, document_ids, model_version)
+        answers = self._scopes.get(scope) or ()
+        entry = CachedAnswer(self._unit(vector), model_version, frozenset(parent_ids), answer, generation_seconds)
+        self._scopes.put(scope, (*answers, entry)[-self.max_per_scope:])
+        self.stores += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        scopes = self._scopes.stats()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "generation_seconds_saved": round(self.seconds_saved, 2),
+            "answer_chars_saved": self.chars_saved,
+            "scopes": scopes["entries"],
+            "bytes": scopes["bytes"],
+        }
+
+answer_cache = SemanticAnswerCache(
+    enabled=settings.ANSWER_CACHE_ENABLED,
+    threshold=settings.ANSWER_CACHE_SIMILARITY,
+    max_scopes=settings.ANSWER_CACHE_MAX_SCOPES,
+    max_per_scope=settings.ANSWER_CACHE_MAX_PER_SCOPE,
+    max_bytes=settings.ANSWER_CACHE_MAX_MB * 1024 * 1024,
+    ttl=settings.ANSWER_CACHE_TTL_SECONDS,
+)
+
+async def replay_answer(answer: str) -> AsyncGenerator[str, None]:
+    """Streams a cached answer as word-sized tokens (whitespace kept), like a live generation."""
+    for token in re.findall(r"\s*\S+\s*", answer) or [answer]:
+        yield token
+        await asyncio.sleep(0)
@@ -2,8 +2,15 @@ import structlog
 import asyncio
 import fitz
 import os
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from typing import List, Tuple
+import pickle
+import queue as queue_module
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+from core.config import settings
 
 logger = structlog.get_logger(__name__)
 
@@ -12,80 +19,409 @@ PARENT_CHUNK_OVERLAP = 200
 CHILD_CHUNK_SIZE = 250
 CHILD_CHUNK_OVERLAP = 0
 MAX_BUFFER_SIZE = 10000
+# Items buffered between an extraction process and its forwarding thread
+PROCESS_CHANNEL_SIZE = 10
+
+SEPARATORS = ["\n\n", "\n", " ", ""]
+
+@dataclass(frozen=True)
+class ResumePoint:
+    """
+    Emitted into the chunk stream after every page. Restarting extraction at `next_page`
+    (0-based) seeded with `carry` yields exactly the parents that follow this marker.
+    """
+    next_page: int
+    carry: str
+
+StreamItem = Union[Tuple[str, List[str]], ResumePoint]
+
+class RecursiveSplitter:
+    """
+    Port of langchain's RecursiveCharacterTextSplitter for the configuration we use
+    (literal separators kept at the start of each piece, whitespace stripped, len() as
+    the length function). Output is identical; it skips regex splitting, per-call
+    logging and the O(n^2) list slicing in the merge step.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, separators: List[str] = SEPARATORS):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators
+
+    def split_text(self, text: str) -> List[str]:
+        return self._split(text, self.separators)
+
+    def _split(self, text: str, separators: List[str]) -> List[str]:
+        separator = separators[-1]
+        finer_separators: List[str] = []
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator = candidate
+                break
+            if candidate in text:
+                separator = candidate
+                finer_separators = separators[i + 1:]
+                break
+
+        if separator:
+            head, *tail = text.split(separator)
+            pieces = [head] + [separator + piece for piece in tail]
+        else:
+            pieces = list(text)
+
+        chunks: List[str] = []
+        mergeable: List[str] = []
+        for piece in pieces:
+            if not piece:
+                continue
+            if len(piece) < self.chunk_size:
+                mergeable.append(piece)
+                continue
+            if mergeable:
+                chunks.extend(self._merge(mergeable))
+                mergeable = []
+            if finer_separators:
+                chunks.extend(self._split(piece, finer_separators))
+            else:
+                chunks.append(piece)
+        if mergeable:
+            chunks.extend(self._merge(mergeable))
+        return chunks
+
+    def _merge(self, pieces: List[str]) -> List[str]:
+        """Greedily packs pieces into chunks, carrying up to chunk_overlap chars forward."""
+        chunks: List[str] = []
+        current: deque = deque()
+        total = 0
+        for piece in pieces:
+            length = len(piece)
+            if total + length > self.chunk_size and current:
+                chunk = "".join(current).strip()
+                if chunk:
+                    chunks.append(chunk)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= len(current.popleft())
+            current.append(piece)
+            total += length
+        chunk = "".join(current).strip()
+        if chunk:
+            chunks.append(chunk)
+        return chunks
 
 def _get_parent_splitter():
-    return RecursiveCharacterTextSplitter(
-        chunk_size=PARENT_CHUNK_SIZE,
-        chunk_overlap=PARENT_CHUNK_OVERLAP,
-        separators=["\n\n", "\n", " ", ""]
-    )
+    return RecursiveSplitter(chunk_size=PARENT_CHUNK_SIZE, chunk_overlap=PARENT_CHUNK_OVERLAP)
 
 def _get_child_splitter():
-    return RecursiveCharacterTextSplitter(
-        chunk_size=CHILD_CHUNK_SIZE,
-        chunk_overlap=CHILD_CHUNK_OVERLAP,
-        separators=["\n\n", "\n", " ", ""]
-    )
+    return RecursiveSplitter(chunk_size=CHILD_CHUNK_SIZE, chunk_overlap=CHILD_CHUNK_OVERLAP)
+
+def split_child_chunks(parent_text: str) -> List[str]:
+    """The child chunks ingestion derives from a parent; used to rebuild vectors from stored parents."""
+    return _get_child_splitter().split_text(parent_text)
+
+class ParentChildSplitter:
+    """
+    Incremental parent/child splitter. Text is fed page by page and every finished parent
+    is emitted exactly once together with its child chunks. Pages are collected in a list
+    and only joined once enough text has arrived to cut a parent, and only the unfinished
+    tail (at most one parent) is carried into the next split.
+    """
+
+    def __init__(self, carry: str = ""):
+        self._parent_splitter = _get_parent_splitter()
+        self._child_splitter = _get_child_splitter()
+        self._pending: List[str] = [carry] if carry else []
+        self._pending_len = len(carry)
+
+    @property
+    def pending_text(self) -> str:
+        """Text not yet emitted as a parent; seeding a new splitter with it resumes the stream."""
+        return "".join(self._pending)
+
+    def _emit(self, parent: str) -> Tuple[str, List[str]]:
+        return parent, self._child_splitter.split_text(parent)
+
+    def feed(self, page_text: str) -> Iterator[Tuple[str, List[str]]]:
+        self._pending.append(page_text)
+        self._pending.append("\n")
+        self._pending_len += len(page_text) + 1
+        if self._pending_len < PARENT_CHUNK_SIZE * 2:
+            return
+
+        buffer = "".join(self._pending)
+        if len(buffer) > MAX_BUFFER_SIZE:
+            logger.warning(f"Buffer exceeded MAX_BUFFER_SIZE ({len(buffer)} > {MAX_BUFFER_SIZE}). Forcing chunk split.")
+
+        parents = self._parent_splitter.split_text(buffer)
+        if len(parents) > 1:
+            for parent in parents[:-1]:
+                yield self._emit(parent)
+            buffer = parents[-1]
+        elif len(buffer) > MAX_BUFFER_SIZE:
+            # Not enough split boundaries found in a huge block
+            logger.warning("Forcing hard split due to massive un-splittable block.")
+            yield self._emit(buffer)
+            buffer = ""
+        self._pending = [buffer] if buffer else []
+        self._pending_len = len(buffer)
+
+    def finish(self) -> Iterator[Tuple[str, List[str]]]:
+        buffer = "".join(self._pending)
+        self._pending = []
+        self._pending_len = 0
+        if buffer.strip():
+            for parent in self._parent_splitter.split_text(buffer):
+                yield self._emit(parent)
+
+def _chunk_pages(page_texts: Iterable[str], buffer: str = "") -> Iterator[Tuple[str, List[str]]]:
+    """
+    Core streaming splitter: consumes page texts in order and yields (parent_text, child_texts)
+    pairs. `buffer` seeds the carried-over text, e.g. the overlap prefix of a shard.
+    """
+    splitter = ParentChildSplitter(carry=buffer)
+    for page_text in page_texts:
+        yield from splitter.feed(page_text)
+    yield from splitter.finish()
+
+def _chunk_pages_resumable(page_texts: Iterable[str], start_page: int = 0, carry: str = "") -> Iterator[StreamItem]:
+    """Like _chunk_pages, but follows every page with a ResumePoint for checkpointing."""
+    splitter = ParentChildSplitter(carry=carry)
+    for page_number, page_text in enumerate(page_texts, start=start_page):
+        yield from splitter.feed(page_text)
+        yield ResumePoint(page_number + 1, splitter.pending_text)
+    yield from splitter.finish()
+
+def iter_parent_child_chunks(file_path: str, start_page: int = 0, carry: str = "") -> Iterator[StreamItem]:
+    """
+    Extracts text from the PDF and yields (parent_text, child_texts) pairs in document order,
+    interleaved with ResumePoints. Extraction starts at `start_page`, seeded with `carry`.
+    Raises FileNotFoundError for a missing file and ValueError for a corrupted PDF.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found on disk: {file_path}")
+
+    try:
+        doc = fitz.open(file_path)
+        pages = (doc[i].get_text() for i in range(start_page, doc.page_count))
+        yield from _chunk_pages_resumable(pages, start_page, carry)
+    except fitz.FileDataError as e:
+        logger.error(f"PyMuPDF FileDataError on {file_path}: {e}")
+        raise ValueError("Uploaded file is corrupted or not a valid PDF.")
+    except Exception as e:
+        logger.error(f"Unexpected PyMuPDF error on {file_path}: {e}")
+        raise
+
+class ChunkStreamClosed(Exception):
+    """Raised to a producer once the consumer of its ChunkStream has gone away."""
 
-def extract_and_chunk_sync(file_path: str, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+class ChunkStream(asyncio.Queue):
+    """
+    The queue extraction engines feed. The consumer closes it when it stops reading (failure or
+    cancellation); pending and later puts then raise ChunkStreamClosed so the producer exits
+    instead of blocking forever on a full queue.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize)
+        self._closed = False
+
+    async def put(self, item):
+        if self._closed:
+            raise ChunkStreamClosed()
+        await super().put(item)
+
+    def close(self):
+        self._closed = True
+        # Make room so a producer blocked in put() wakes up; its next put() raises
+        while not self.empty():
+            self.get_nowait()
+            self.task_done()
+
+def _put_blocking(loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, item):
+    """Push to the async queue from a worker thread, blocking until it has space."""
+    future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+    future.result()
+
+def extract_and_chunk_sync(file_path: str, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, start_page: int = 0, carry: str = ""):
     """
     Synchronous generator that extracts text from PDF and feeds it into the async Queue.
     This runs in a background thread to prevent event loop blocking.
     Applies backpressure via queue limits.
     """
-    parent_splitter = _get_parent_splitter()
-    child_splitter = _get_child_splitter()
-    buffer = ""
-    
-    if not os.path.exists(file_path):
-        future = asyncio.run_coroutine_threadsafe(queue.put(FileNotFoundError(f"File not found on disk: {file_path}")), loop)
-        future.result()
+    try:
+        for item in iter_parent_child_chunks(file_path, start_page, carry):
+            _put_blocking(loop, queue, item)
+        # Send EOF marker
+        _put_blocking(loop, queue, None)
+    except ChunkStreamClosed:
         return
+    except Exception as e:
+        _put_blocking(loop, queue, e)
 
+_process_pool: ProcessPoolExecutor | None = None
+_pool_manager = None
+# Extractors start from worker threads, so two first uses may race to create the pool
+_pool_lock = threading.Lock()
+
+def _get_process_pool():
+    global _process_pool, _pool_manager
+    with _pool_lock:
+        if _process_pool is None:
+            # spawn, not fork: the parent is multi-threaded and runs an event loop
+            ctx = multiprocessing.get_context("spawn")
+            _pool_manager = ctx.Manager()
+            _process_pool = ProcessPoolExecutor(
+                max_workers=settings.EXTRACTION_PROCESS_POOL_SIZE or os.cpu_count(),
+                mp_context=ctx
+            )
+        return _process_pool, _pool_manager
+
+def shutdown_extraction_pool():
+    """Stops the extraction worker processes, if they were ever started."""
+    global _process_pool, _pool_manager
+    with _pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _pool_manager.shutdown()
+            _process_pool = None
+            _pool_manager = None
+
+def _portable_exception(e: Exception) -> Exception:
+    """Not every PyMuPDF exception survives pickling across the process boundary."""
     try:
-        doc = fitz.open(file_path)
-        for page in doc:
-            buffer += page.get_text() + "\n"
-            
-            while len(buffer) >= PARENT_CHUNK_SIZE * 2:
-                if len(buffer) > MAX_BUFFER_SIZE:
-                    logger.warning(f"Buffer exceeded MAX_BUFFER_SIZE ({len(buffer)} > {MAX_BUFFER_SIZE}). Forcing chunk split.")
-                    
-                chunks = parent_splitter.split_text(buffer)
-                if len(chunks) > 1:
-                    # Yield all but the last chunk
-                    for chunk in chunks[:-1]:
-                        child_chunks = child_splitter.split_text(chunk)
-                        # Push to async queue with backpressure
-                        future = asyncio.run_coroutine_threadsafe(queue.put((chunk, child_chunks)), loop)
-                        future.result()  # Block thread until queue has space
-                    buffer = chunks[-1]
-                else:
-                    # Not enough split boundaries found in a huge block
-                    if len(buffer) > MAX_BUFFER_SIZE:
-                        logger.warning("Forcing hard split due to massive un-splittable block.")
-                        child_chunks = child_splitter.split_text(buffer)
-                        future = asyncio.run_coroutine_threadsafe(queue.put((buffer, child_chunks)), loop)
-                        future.result()
-                        buffer = ""
-                    break
-                    
-        # End of document
-        if buffer.strip():
-            for chunk in parent_splitter.split_text(buffer):
-                child_chunks = child_splitter.split_text(chunk)
-                future = asyncio.run_coroutine_threadsafe(queue.put((chunk, child_chunks)), loop)
-                future.result()
-                
-        # Send EOF marker
-        future = asyncio.run_coroutine_threadsafe(queue.put(None), loop)
-        future.result()
+        pickle.dumps(e)
+        return e
+    except Exception:
+        return RuntimeError(f"Extraction failed: {e}")
+
+def _send(channel, stop, item) -> bool:
+    """Puts into a managed queue, giving up (returning False) once the parent sets `stop`."""
+    while not stop.is_set():
+        try:
+            channel.put(item, timeout=1.0)
+            return True
+        except queue_module.Full:
+            continue
+    return False
+
+def _extract_to_channel(file_path: str, channel, stop, start_page: int = 0, carry: str = ""):
+    """Runs inside a pool worker: streams chunks back to the parent over a managed queue."""
+    try:
+        for item in iter_parent_child_chunks(file_path, start_page, carry):
+            if not _send(channel, stop, item):
+                return
+        _send(channel, stop, None)
+    except Exception as e:
+        _send(channel, stop, _portable_exception(e))
 
+def extract_and_chunk_in_pool(file_path: str, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, start_page: int = 0, carry: str = ""):
+    """
+    Same contract as extract_and_chunk_sync, but extraction and splitting run in a
+    worker process so they don't compete with the event loop for the GIL. This thread
+    only forwards items from the process to the async Queue, keeping backpressure intact.
+    """
+    stop = None
+    try:
+        pool, manager = _get_process_pool()
+        channel = manager.Queue(maxsize=PROCESS_CHANNEL_SIZE)
+        stop = manager.Event()
+        future = pool.submit(_extract_to_channel, file_path, channel, stop, start_page, carry)
+        while True:
+            try:
+                item = channel.get(timeout=1.0)
+            except queue_module.Empty:
+                if not future.done():
+                    continue
+                # The worker may have sent its last items between the timeout and this check
+                while True:
+                    try:
+                        item = channel.get_nowait()
+                    except queue_module.Empty:
+                        # The worker died without sending EOF (e.g. BrokenProcessPool)
+                        raise future.exception() or RuntimeError("Extraction worker exited without EOF")
+                    _put_blocking(loop, queue, item)
+                    if item is None or isinstance(item, Exception):
+                        return
+            _put_blocking(loop, queue, item)
+            if item is None or isinstance(item, Exception):
+                return
+    except ChunkStreamClosed:
+        return
+    except Exception as e:
+        logger.error(f"Process pool extraction failed for {file_path}: {e}")
+        _put_blocking(loop, queue, e)
+    finally:
+        if stop is not None:
+            stop.set()
+
+def _extract_page_range(file_path: str, start: int, stop: int, carry: Optional[str] = None) -> List[StreamItem]:
+    """
+    Runs inside a pool worker: chunks pages [start, stop) of the PDF. Shards after the
+    first are seeded with the tail of the preceding page, so the first parent of a shard
+    overlaps the last parent of the previous one just like neighbours inside a shard do.
+    A resumed extraction passes its checkpointed `carry` instead.
+    """
+    try:
+        doc = fitz.open(file_path)
+        prefix = carry or ""
+        if carry is None and start > 0:
+            tail = (doc[start - 1].get_text() + "\n")[-PARENT_CHUNK_OVERLAP:]
+            # Start the overlap on a word boundary. Only the leading side is stripped: the
+            # page-ending newline separates the tail's last word from the shard's first one
+            cut = tail.find(" ")
+            prefix = (tail[cut + 1:] if cut != -1 else tail).lstrip()
+        return list(_chunk_pages_resumable((doc[i].get_text() for i in range(start, stop)), start, prefix))
     except fitz.FileDataError as e:
-        logger.error(f"PyMuPDF FileDataError on {file_path}: {e}")
-        future = asyncio.run_coroutine_threadsafe(queue.put(ValueError("Uploaded file is corrupted or not a valid PDF.")), loop)
-        future.result()
+        logger.error(f"PyMuPDF FileDataError on {file_path} pages {start}-{stop}: {e}")
+        raise ValueError("Uploaded file is corrupted or not a valid PDF.")
     except Exception as e:
-        logger.error(f"Unexpected PyMuPDF error on {file_path}: {e}")
-        future = asyncio.run_coroutine_threadsafe(queue.put(e), loop)
-        future.result()
+        logger.error(f"Unexpected PyMuPDF error on {file_path} pages {start}-{stop}: {e}")
+        raise _portable_exception(e)
+
+def extract_and_chunk_sharded(file_path: str, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, start_page: int = 0, carry: str = ""):
+    """
+    Same contract as extract_and_chunk_sync, but the document is split into page ranges of
+    EXTRACTION_SHARD_PAGES that are extracted and chunked in parallel worker processes.
+    Shard results are forwarded strictly in page order; only a bounded window of shards
+    is submitted ahead of the one being forwarded so memory stays flat for huge documents.
+    """
+    pending = deque()
+    try:
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found on disk: {file_path}")
+        try:
+            with fitz.open(file_path) as doc:
+                page_count = doc.page_count
+        except fitz.FileDataError as e:
+            logger.error(f"PyMuPDF FileDataError on {file_path}: {e}")
+            raise ValueError("Uploaded file is corrupted or not a valid PDF.")
+
+        pool, _ = _get_process_pool()
+        shard_pages = max(1, settings.EXTRACTION_SHARD_PAGES)
+        ranges = iter([(start, min(start + shard_pages, page_count)) for start in range(start_page, page_count, shard_pages)])
+        if start_page >= page_count:
+            # Resumed after the last page: only the checkpointed carry is left to flush
+            for item in _chunk_pages_resumable((), start_page, carry):
+                _put_blocking(loop, queue, item)
+        window = 2 * (settings.EXTRACTION_PROCESS_POOL_SIZE or os.cpu_count())
+
+        for start, stop in ranges:
+            # Only the first shard of a resumed extraction continues from the checkpointed carry
+            shard_carry = carry if start == start_page and start_page > 0 else None
+            pending.append(pool.submit(_extract_page_range, file_path, start, stop, shard_carry))
+            if len(pending) >= window:
+                break
+        while pending:
+            items = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range:
+                pending.append(pool.submit(_extract_page_range, file_path, *next_range))
+            for item in items:
+                _put_blocking(loop, queue, item)
+        _put_blocking(loop, queue, None)
+    except ChunkStreamClosed:
+        return
+    except Exception as e:
+        _put_blocking(loop, queue, e)
+    finally:
+        for future in pending:
+            future.cancel()
@@ -2,56 +2,148 @@ import structlog
 import asyncio
 import uuid
 import os
-from qdrant_client.http.models import PointStruct, Filter, FieldCondition, MatchValue
+import hashlib
+from qdrant_client.http.models import PointStruct, Filter, FieldCondition, MatchValue, MatchAny
+from typing import Any, Awaitable, Callable, Iterable, NamedTuple
+from sqlalchemy import insert, delete, update, func, or_
 from sqlmodel import select
-from models.base import Document, DocumentChunk, ProcessingJob
+from models.base import User, Document, DocumentChunk, ProcessingJob
 from core.database import AsyncSessionLocal
 from core.transactions import scoped_transaction
-from core.qdrant import qdrant_client, COLLECTION_NAME
-from core.embeddings import generate_embeddings
+from core.qdrant import qdrant_client, upload_points_bulk
+from core.embeddings import generate_embeddings, embedding_batcher, embedding_model_version, get_embedding_provider, EmbeddingProvider
+from core.embedding_index import EmbeddingIndex, serving_index, building_index, write_indexes
+from core import embedding_cache
 from core.storage import get_secure_file_path, delete_file_idempotent
-from services.chunking import extract_and_chunk_sync
+from services.chunking import extract_and_chunk_sync, extract_and_chunk_in_pool, extract_and_chunk_sharded, ResumePoint, ChunkStream, split_child_chunks
 from core.config import settings
 
 logger = structlog.get_logger(__name__)
 
 async def wipe_document_idempotent(document_id: uuid.UUID):
+    await wipe_documents_idempotent([document_id])
+
+async def wipe_documents_idempotent(document_ids: list[uuid.UUID]):
+    """
+    Removes every vector and chunk row of the given documents with set-based deletes.
+    Rows go in batches of DELETION_BATCH_SIZE, each in its own short transaction.
+    """
+    if not document_ids:
+        return
+        
     # 1. Wipe Qdrant
-    try:
-        await qdrant_client.delete(
-            collection_name=COLLECTION_NAME,
-            points_selector=Filter(
-                must=[FieldCondition(key="document_id", match=MatchValue(value=str(document_id)))]
-            )
-        )
-    except Exception as e:
-        logger.warning(f"Failed to wipe document {document_id} from Qdrant: {e}")
-        # Ignore 404s or other errors during idempotency wipe
+    for index in write_indexes():
+        for i in range(0, len(document_ids), settings.DELETION_BATCH_SIZE):
+            id_batch = [str(doc_id) for doc_id in document_ids[i:i + settings.DELETION_BATCH_SIZE]]
+            try:
+                await qdrant_client.delete(
+                    collection_name=index.collection,
+                    points_selector=Filter(
+                        must=[FieldCondition(key="document_id", match=MatchAny(any=id_batch))]
+                    )
+                )
+            except Exception as e:
+                logger.warning(f"Failed to wipe {len(id_batch)} documents from {index.collection}: {e}")
+                # Ignore 404s or other errors during idempotency wipe
         
     # 2. Wipe Database Chunks
-    async with scoped_transaction() as session:
-        chunks = await session.execute(select(DocumentChunk).where(DocumentChunk.document_id == document_id))
-        for chunk in chunks.scalars().all():
-            await session.delete(chunk)
+    while True:
+        batch = (
+            select(DocumentChunk.id)
+            .where(DocumentChunk.document_id.in_(document_ids))
+            .limit(settings.DELETION_BATCH_SIZE)
+        )
+        async with scoped_transaction() as session:
+            result = await session.execute(delete(DocumentChunk).where(DocumentChunk.id.in_(batch)))
+        if result.rowcount < settings.DELETION_BATCH_SIZE:
+            break
 
 async def execute_deletion_saga(document_id: uuid.UUID):
+    await execute_bulk_deletion_saga([document_id])
+
+async def execute_bulk_deletion_saga(document_ids: list[uuid.UUID]):
+    """Deletes many documents with a constant number of statements per batch, however many chunks they hold."""
+    if not document_ids:
+        return
+        
     async with scoped_transaction() as session:
-        doc = await session.get(Document, document_id)
-        if doc:
-            doc.status = "DELETING"
+        result = await session.execute(
+            update(Document).where(Document.id.in_(document_ids)).values(status="DELETING").returning(Document.user_id)
+        )
+        user_ids = set(result.scalars().all())
             
-    await wipe_document_idempotent(document_id)
+    await wipe_documents_idempotent(document_ids)
     
+    # Jobs go with their documents through ON DELETE CASCADE
+    for i in range(0, len(document_ids), settings.DELETION_BATCH_SIZE):
+        async with scoped_transaction() as session:
+            await session.execute(
+                delete(Document).where(Document.id.in_(document_ids[i:i + settings.DELETION_BATCH_SIZE]))
+            )
+    await bump_corpus_generation(user_ids)
+
+async def bump_corpus_generation(user_ids: Iterable[uuid.UUID]):
+    """Invalidates cached retrievals of these users: their searchable chunks changed."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
     async with scoped_transaction() as session:
-        doc = await session.get(Document, document_id)
-        if doc:
-            await session.delete(doc)
+        await session.execute(
+            update(User).where(User.id.in_(user_ids)).values(corpus_generation=User.corpus_generation + 1)
+        )
+
+async def reembed_document(doc_id: uuid.UUID, user_id: uuid.UUID, index: EmbeddingIndex) -> int:
+    """
+    Rebuilds a document's vectors in `index` from the parent text stored in Postgres, replacing
+    whatever it held there. Children are re-derived with the ingestion splitter, so no PDF is
+    needed. Returns the number of points written.
+    """
+    await qdrant_client.delete(
+        collection_name=index.collection,
+        points_selector=Filter(must=[FieldCondition(key="document_id", match=MatchValue(value=str(doc_id)))])
+    )
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(DocumentChunk.id, DocumentChunk.content, DocumentChunk.page_number)
+            .where(DocumentChunk.document_id == doc_id)
+            .order_by(DocumentChunk.chunk_index)
+        )
+        parents = result.all()
+        
+    texts = []
+    payloads = []
+    written = 0
+    for parent in parents:
+        for child_text in split_child_chunks(parent.content):
+            texts.append(child_text)
+            payloads.append({
+                "user_id": str(user_id),
+                "document_id": str(doc_id),
+                "parent_chunk_id": str(parent.id),
+                "page_number": parent.page_number
+            })
+        if len(texts) >= settings.EMBEDDING_BATCH_SIZE:
+            await _upsert_batch(await _embed_batch(texts, index.provider), payloads, index.collection)
+            written += len(texts)
+            texts, payloads = [], []
+    if texts:
+        await _upsert_batch(await _embed_batch(texts, index.provider), payloads, index.collection)
+        written += len(texts)
+    return written
+
+def _select_extractor():
+    """Picks the extraction engine; all engines feed the same (parent, children) stream."""
+    if settings.EXTRACTION_SHARD_PAGES > 0:
+        return extract_and_chunk_sharded
+    if settings.EXTRACTION_PROCESS_POOL_SIZE > 0:
+        return extract_and_chunk_in_pool
+    return extract_and_chunk_sync
 
 async def process_document(job_id: uuid.UUID):
     """The state machine for ingestion with streaming generator."""
     file_path = None
     doc_id = None
-    producer_task = None
+    keep_file = False
     
     async with scoped_transaction() as session:
         job = await session.get(ProcessingJob, job_id)
@@ -63,10 +155,24 @@ async def process_document(job_id: uuid.UUID):
         doc_id = doc.id
         doc_filename = doc.filename
         doc_user_id = doc.user_id
+        doc_sha256 = doc.content_sha256
+        # Chunks left by a completed run with the current model are diffed against instead of
+        # rebuilt. The version is cleared until this run completes, so a crashed or failed run
+        # is never diffed against.
+        incremental = doc.embedding_model_version == embedding_model_version()
+        doc.embedding_model_version = None
+        # An interrupted run left a checkpoint: keep everything up to it and continue from there
+        resume = None
+        if job.checkpoint_page is not None and not incremental:
+            resume = _Checkpoint(job.checkpoint_chunk_index, ResumePoint(job.checkpoint_page, job.checkpoint_carry or ""))
         
     try:
-        # Idempotency wipe
-        await wipe_document_idempotent(doc_id)
+        if resume:
+            logger.info(f"Resuming ingestion of {doc_id} at page {resume.point.next_page}")
+            await _discard_beyond_checkpoint(doc_id, resume.chunk_index)
+        elif not incremental:
+            # Idempotency wipe
+            await wipe_document_idempotent(doc_id)
         
         # 1. Resolve absolute file path
         file_path = get_secure_file_path(doc_id, doc_filename)
@@ -75,18 +181,115 @@ async def process_document(job_id: uuid.UUID):
             job = await session.get(ProcessingJob, job_id)
             job.status = "EMBEDDING"
         
-        # 2. Setup Streaming Queue
-        queue = asyncio.Queue(maxsize=10)
-        loop = asyncio.get_running_loop()
-        
-        # Launch producer thread
-        producer_task = asyncio.create_task(
-            asyncio.to_thread(extract_and_chunk_sync, file_path, loop, queue)
-        )
+        # 2. Identical bytes already embedded with this model are cloned, not re-embedded
+        source_doc_id = await _find_ingested_duplicate(doc_id, doc_sha256)
+        cloned = False
+        if source_doc_id:
+            if incremental or resume:
+                await wipe_document_idempotent(doc_id)
+                incremental, resume = False, None
+            try:
+                await _clone_document_chunks(source_doc_id, doc_id, doc_user_id)
+                cloned = True
+                logger.info(f"Cloned chunks for {doc_id} from identical document {source_doc_id}")
+            except Exception as e:
+                # e.g. the source was deleted mid-copy; fall back to a full ingestion
+                logger.warning(f"Cloning {source_doc_id} into {doc_id} failed, re-ingesting: {e}")
+                await wipe_document_idempotent(doc_id)
         
-        batch_child_chunks = []
-        batch_child_payloads = []
+        dual_written = None
+        if not cloned:
+            dual_written = await _stream_and_embed(file_path, doc_id, doc_user_id, job_id, incremental, resume)
         
+        # A re-embedding is filling a new collection: unless every vector of this run was also
+        # written there, rebuild the document in it from the stored parents
+        building = building_index()
+        if building and building != dual_written:
+            await reembed_document(doc_id, doc_user_id, building)
+            
+        # 6. Final Commit
+        async with scoped_transaction() as session:
+            job = await session.get(ProcessingJob, job_id)
+            job.status = "COMPLETED"
+            _clear_checkpoint(job)
+            doc = await session.get(Document, doc_id)
+            doc.status = "COMPLETED"
+            doc.embedding_model_version = embedding_model_version()
+        await bump_corpus_generation([doc_user_id])
+            
+    except asyncio.CancelledError:
+        logger.warning(f"Ingestion cancelled for {doc_id}")
+        # The retry resumes from the checkpoint and needs the file
+        keep_file = True
+        raise
+    except Exception as e:
+        logger.error(f"Ingestion failed for {doc_id}: {e}")
+        async with scoped_transaction() as session:
+            job = await session.get(ProcessingJob, job_id)
+            if job:
+                job.status = "FAILED"
+                _clear_checkpoint(job)
+            doc = await session.get(Document, doc_id)
+            if doc:
+                doc.status = "FAILED"
+        # Rollback partial chunks on failure to avoid orphans
+        if doc_id:
+            await wipe_document_idempotent(doc_id)
+            await bump_corpus_generation([doc_user_id])
+        raise
+    finally:
+        # Remediation A: Guaranteed File Cleanup
+        if file_path and not keep_file:
+            delete_file_idempotent(file_path)
+
+async def _stream_and_embed(
+    file_path: str,
+    doc_id: uuid.UUID,
+    doc_user_id: uuid.UUID,
+    job_id: uuid.UUID,
+    incremental: bool = False,
+    resume: "_Checkpoint | None" = None,
+) -> EmbeddingIndex | None:
+    """
+    Extracts, chunks and embeds the file. In-flight batches are stopped before any error propagates.
+    In incremental mode, parents whose text is already stored keep their rows and vectors, only new
+    parents are embedded, and parents that vanished from the file are deleted at the end.
+    Otherwise a checkpoint is saved on the job after each upserted batch, and `resume` continues
+    a run from its last checkpoint.
+    Returns the building index when every vector of the document was dual-written into it.
+    """
+    stored_parents = await _load_parent_fingerprints(doc_id) if incremental else {}
+    start = resume.point if resume else ResumePoint(0, "")
+    chunk_index = resume.chunk_index + 1 if resume and resume.chunk_index is not None else 0
+    
+    # Setup Streaming Queue
+    queue = ChunkStream(maxsize=10)
+    loop = asyncio.get_running_loop()
+    
+    # Launch producer thread
+    producer_task = asyncio.create_task(
+        asyncio.to_thread(_select_extractor(), file_path, loop, queue, start.next_page, start.carry)
+    )
+    
+    async def save_checkpoint(checkpoint: _Checkpoint):
+        async with scoped_transaction() as session:
+            await session.execute(
+                update(ProcessingJob).where(ProcessingJob.id == job_id).values(
+                    checkpoint_chunk_index=checkpoint.chunk_index,
+                    checkpoint_page=checkpoint.point.next_page,
+                    checkpoint_carry=checkpoint.point.carry,
+                )
+            )
+    
+    # Incremental runs keep parents out of order, so they are not checkpointed
+    pipeline = _EmbeddingPipeline(settings.EMBEDDING_MAX_IN_FLIGHT, None if incremental else save_checkpoint)
+    latest_checkpoint = None
+    reindexed_parents = []
+    batch_parents = []
+    batch_child_chunks = []
+    batch_child_payloads = []
+    
+    try:
         while True:
             item = await queue.get()
             
@@ -98,14 +301,36 @@ async def process_document(job_id: uuid.UUID):
                 queue.task_done()
                 raise item # Exception from PyMuPDF
                 
+            if isinstance(item, ResumePoint):
+                # Every parent before this marker is in the current or an earlier batch
+                latest_checkpoint = _Checkpoint(chunk_index - 1 if chunk_index else None, item)
+                queue.task_done()
+                continue
+                
             parent_text, child_texts = item
             
-            # Save parent to SQLite
-            async with scoped_transaction() as session:
-                chunk = DocumentChunk(document_id=doc_id, content=parent_text, page_number=1)
-                session.add(chunk)
-                await session.flush()
-                parent_id = chunk.id
+            # Children are derived deterministically from the parent, so an unchanged parent
+            # implies unchanged children and vectors.
+            stored = stored_parents.get(_parent_fingerprint(parent_text))
+            if stored:
+                stored_id, stored_index = stored.pop()
+                if stored_index != chunk_index:
+                    reindexed_parents.append({"id": stored_id, "chunk_index": chunk_index})
+                chunk_index += 1
+                queue.task_done()
+                continue
+            
+            # Parent IDs are generated client-side so child payloads can reference
+            # them before the row exists; rows are written together with the batch.
+            parent_id = uuid.uuid4()
+            batch_parents.append({
+                "id": parent_id,
+                "document_id": doc_id,
+                "content": parent_text,
+                "page_number": 1,
+                "chunk_index": chunk_index
+            })
+            chunk_index += 1
                 
             for child_text in child_texts:
                 batch_child_chunks.append(child_text)
@@ -118,56 +343,323 @@ async def process_document(job_id: uuid.UUID):
                 
             # Check Batch Limits
             if len(batch_child_chunks) >= settings.EMBEDDING_BATCH_SIZE:
-                await _flush_embedding_batch(batch_child_chunks, batch_child_payloads)
+                await _persist_parent_chunks(batch_parents)
+                await pipeline.submit(batch_child_chunks, batch_child_payloads, latest_checkpoint)
+                batch_parents.clear()
                 batch_child_chunks.clear()
                 batch_child_payloads.clear()
                 
             queue.task_done()
             
         # Flush remaining chunks
+        if batch_parents:
+            await _persist_parent_chunks(batch_parents)
         if batch_child_chunks:
-            await _flush_embedding_batch(batch_child_chunks, batch_child_payloads)
+            await pipeline.submit(batch_child_chunks, batch_child_payloads, latest_checkpoint)
+        await pipeline.close()
             
         await producer_task
-            
-        # 6. Final Commit
-        async with scoped_transaction() as session:
-            job = await session.get(ProcessingJob, job_id)
-            job.status = "COMPLETED"
-            doc = await session.get(Document, doc_id)
-            doc.status = "COMPLETED"
-            doc.embedding_model_version = "text-embedding-004"
-            
-    except asyncio.CancelledError:
-        logger.warning(f"Ingestion cancelled for {doc_id}")
-        raise
-    except Exception as e:
-        logger.error(f"Ingestion failed for {doc_id}: {e}")
-        async with scoped_transaction() as session:
-            job = await session.get(ProcessingJob, job_id)
-            if job:
-                job.status = "FAILED"
-            doc = await session.get(Document, doc_id)
-            if doc:
-                doc.status = "FAILED"
-        # Rollback partial chunks on failure to avoid orphans
-        if doc_id:
-            await wipe_document_idempotent(doc_id)
-        raise
+        
+        vanished_ids = [parent_id for stored in stored_parents.values() for parent_id, _ in stored]
+        if vanished_ids:
+            await _delete_parent_chunks(doc_id, vanished_ids)
+        if reindexed_parents:
+            async with scoped_transaction() as session:
+                await session.execute(update(DocumentChunk), reindexed_parents)
+        return pipeline.building if not (incremental or resume) else None
     finally:
-        # Remediation A: Guaranteed File Cleanup
-        if file_path:
-            delete_file_idempotent(file_path)
+        # Stop in-flight batches so nothing is upserted after the caller's failure wipe
+        await pipeline.abort()
+        # Release the extraction thread if it is still producing
+        queue.close()
+        await asyncio.gather(producer_task, return_exceptions=True)
 
-async def _flush_embedding_batch(chunks: list[str], payloads: list[dict]):
-    """Helper to process a single batch of embeddings and insert to Qdrant."""
-    embeddings = await generate_embeddings(chunks)
-    points = []
-    for i, emb in enumerate(embeddings):
-        points.append(PointStruct(
-            id=str(uuid.uuid4()),
-            vector=emb,
-            payload=payloads[i]
-        ))
+class _Checkpoint(NamedTuple):
+    chunk_index: int | None # last parent whose vectors are all upserted; None before the first
+    point: ResumePoint
+
+def _clear_checkpoint(job: ProcessingJob):
+    job.checkpoint_chunk_index = None
+    job.checkpoint_page = None
+    job.checkpoint_carry = None
+
+async def _discard_beyond_checkpoint(doc_id: uuid.UUID, chunk_index: int | None):
+    """Deletes parents written after the checkpoint, whose vectors may be partially upserted."""
+    query = select(DocumentChunk.id).where(DocumentChunk.document_id == doc_id)
+    if chunk_index is not None:
+        query = query.where(or_(DocumentChunk.chunk_index > chunk_index, DocumentChunk.chunk_index.is_(None)))
+    async with AsyncSessionLocal() as session:
+        parent_ids = (await session.execute(query)).scalars().all()
+    if parent_ids:
+        await _delete_parent_chunks(doc_id, parent_ids)
+
+def _parent_fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+async def _load_parent_fingerprints(doc_id: uuid.UUID) -> dict[str, list[tuple[uuid.UUID, int | None]]]:
+    """
+    Maps the fingerprint of each stored parent to its (row ID, chunk_index) pairs.
+    Hashed in Postgres to avoid shipping the text.
+    """
+    fingerprint = func.encode(func.sha256(func.convert_to(DocumentChunk.content, "UTF8")), "hex")
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(DocumentChunk.id, DocumentChunk.chunk_index, fingerprint)
+            .where(DocumentChunk.document_id == doc_id)
+            .order_by(DocumentChunk.chunk_index.desc())
+        )
+        stored = {}
+        for parent_id, index, digest in result.all():
+            # Descending, so pop() hands out duplicates in document order
+            stored.setdefault(digest, []).append((parent_id, index))
+        return stored
+
+async def _delete_parent_chunks(doc_id: uuid.UUID, parent_ids: list[uuid.UUID]):
+    """Removes parents and their child vectors. Vectors go first so no point outlives its parent."""
+    for index in write_indexes():
+        await qdrant_client.delete(
+            collection_name=index.collection,
+            points_selector=Filter(
+                must=[
+                    FieldCondition(key="document_id", match=MatchValue(value=str(doc_id))),
+                    FieldCondition(key="parent_chunk_id", match=MatchAny(any=[str(i) for i in parent_ids])),
+                ]
+            )
+        )
+    async with scoped_transaction() as session:
+        await session.execute(delete(DocumentChunk).where(DocumentChunk.id.in_(parent_ids)))
+
+async def _find_ingested_duplicate(doc_id: uuid.UUID, content_sha256: str | None) -> uuid.UUID | None:
+    """Returns a completed document with identical bytes embedded by the current model, if any."""
+    if not content_sha256:
+        return None
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Document.id).where(
+                Document.content_sha256 == content_sha256,
+                Document.status == "COMPLETED",
+                Document.embedding_model_version == embedding_model_version(),
+                Document.id != doc_id,
+            ).limit(1)
+        )
+        return result.scalar_one_or_none()
+
+async def _clone_document_chunks(source_doc_id: uuid.UUID, doc_id: uuid.UUID, doc_user_id: uuid.UUID):
+    """
+    Copies parent chunks and their vectors from an identical document, re-keyed to the
+    new document and owner. Parents are written first so every cloned point's parent exists.
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(DocumentChunk.id, DocumentChunk.content, DocumentChunk.page_number, DocumentChunk.chunk_index)
+            .where(DocumentChunk.document_id == source_doc_id)
+        )
+        source_parents = result.all()
+        
+    parent_id_map = {}
+    rows = []
+    for parent in source_parents:
+        parent_id_map[str(parent.id)] = str(new_id := uuid.uuid4())
+        rows.append({
+            "id": new_id,
+            "document_id": doc_id,
+            "content": parent.content,
+            "page_number": parent.page_number,
+            "chunk_index": parent.chunk_index
+        })
+    await _persist_parent_chunks(rows)
+    
+    offset = None
+    while True:
+        points, offset = await qdrant_client.scroll(
+            collection_name=serving_index().collection,
+            scroll_filter=Filter(
+                must=[FieldCondition(key="document_id", match=MatchValue(value=str(source_doc_id)))]
+            ),
+            limit=settings.EMBEDDING_BATCH_SIZE,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        embeddings = []
+        payloads = []
+        for point in points:
+            embeddings.append(point.vector)
+            payloads.append({
+                **point.payload,
+                "user_id": str(doc_user_id),
+                "document_id": str(doc_id),
+                "parent_chunk_id": parent_id_map[point.payload["parent_chunk_id"]],
+            })
+        await _upsert_batch(embeddings, payloads)
+        if offset is None:
+            break
+
+async def _persist_parent_chunks(rows: list[dict]):
+    """
+    Writes a batch of parent chunks with a single multi-row INSERT in one transaction.
+    Must run before the batch's vectors are upserted so every point's parent exists.
+    """
+    if not rows:
+        return
+    async with scoped_transaction() as session:
+        await session.execute(insert(DocumentChunk), rows)
+
+async def _embed_uncached(texts: list[str], provider: EmbeddingProvider | None = None) -> list[list[float]]:
+    if provider is not None:
+        # A re-embedding target; the batcher only serves the serving provider
+        return await generate_embeddings(texts, provider=provider)
+    if settings.EMBEDDING_COALESCING:
+        # Shares API calls with other ingestions and with queries
+        return await embedding_batcher.embed(texts)
+    return await generate_embeddings(texts)
+
+async def _embed_batch(texts: list[str], provider: EmbeddingProvider | None = None) -> list[list[float]]:
+    """
+    Embeds a batch through the persistent cache: only texts never embedded by the model
+    (the serving one unless `provider` is given) reach the API. Cache failures degrade to
+    embedding everything.
+    """
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return await _embed_uncached(texts, provider)
+        
+    model_version = (provider or get_embedding_provider()).model_version
+    try:
+        vectors = await embedding_cache.get_many(model_version, texts)
+    except Exception as e:
+        logger.warning(f"Embedding cache lookup failed: {e}")
+        return await _embed_uncached(texts, provider)
+        
+    misses = [text for text in dict.fromkeys(texts) if text not in vectors]
+    if misses:
+        fresh = await _embed_uncached(misses, provider)
+        vectors.update(zip(misses, fresh))
+        try:
+            await embedding_cache.put_many(model_version, misses, fresh, settings.EMBEDDING_CACHE_MAX_ENTRIES)
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+    return [vectors[text] for text in texts]
+
+async def _upsert_batch(embeddings: list[list[float]], payloads: list[dict], collection_name: str | None = None):
+    """Writes one embedded batch to Qdrant (the serving collection unless `collection_name` is given)."""
+    points = _make_points(embeddings, payloads)
     if points:
-        await qdrant_client.upsert(collection_name=COLLECTION_NAME, points=points)
+        await qdrant_client.upsert(collection_name=collection_name or serving_index().collection, points=points)
+
+def _make_points(embeddings: list[list[float]], payloads: list[dict]) -> list[PointStruct]:
+    return [
+        PointStruct(id=str(uuid.uuid4()), vector=emb, payload=payloads[i])
+        for i, emb in enumerate(embeddings)
+    ]
+
+class _EmbeddingPipeline:
+    """
+    Overlaps embedding calls with extraction. Up to `max_in_flight` batches are
+    embedded concurrently while a single upsert stage writes them to Qdrant in
+    submission order. The first failure is re-raised by the next submit() or by close().
+    While a re-embedding is running, every batch is also embedded with its target model and
+    written to its collection before the checkpoint advances.
+
+    With `bulk`, points are collected until QDRANT_BULK_BUFFER_POINTS are waiting and then sent
+    through the parallel batched uploader; checkpoints only advance when a buffer is flushed.
+    """
+
+    def __init__(self, max_in_flight: int, on_upserted: Callable[[Any], Awaitable[None]] | None = None, bulk: bool = False):
+        self.building = building_index()
+        self.bulk = bulk
+        self._buffers: dict[str, list[PointStruct]] = {}
+        self._buffered_checkpoint = None
+        self._slots = asyncio.Semaphore(max(1, max_in_flight))
+        self._on_upserted = on_upserted
+        self._pending: asyncio.Queue = asyncio.Queue()
+        self._tasks: set[asyncio.Task] = set()
+        self._error: Exception | None = None
+        self._upserter = asyncio.create_task(self._upsert_stage())
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    async def submit(self, chunks: list[str], payloads: list[dict], checkpoint=None):
+        """
+        Starts embedding a batch, waiting for a free slot when the pipeline is full.
+        `checkpoint` is handed to `on_upserted` once this batch and all earlier ones are in Qdrant.
+        """
+        self._raise_if_failed()
+        await self._slots.acquire()
+        if self._error is not None:
+            self._slots.release()
+            raise self._error
+        task = asyncio.create_task(_embed_batch(list(chunks)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        building_task = None
+        if self.building:
+            building_task = asyncio.create_task(_embed_batch(list(chunks), self.building.provider))
+            self._tasks.add(building_task)
+            building_task.add_done_callback(self._tasks.discard)
+        self._pending.put_nowait((task, building_task, list(payloads), checkpoint))
+
+    async def _upsert_stage(self):
+        while True:
+            item = await self._pending.get()
+            if item is None:
+                if self.bulk and self._error is None:
+                    try:
+                        await self._flush()
+                    except Exception as e:
+                        self._error = e
+                return
+            task, building_task, payloads, checkpoint = item
+            try:
+                if self._error is None and self.bulk:
+                    self._buffer(serving_index().collection, await task, payloads)
+                    if building_task:
+                        self._buffer(self.building.collection, await building_task, payloads)
+                    if checkpoint is not None:
+                        self._buffered_checkpoint = checkpoint
+                    if sum(len(points) for points in self._buffers.values()) >= settings.QDRANT_BULK_BUFFER_POINTS:
+                        await self._flush()
+                elif self._error is None:
+                    await _upsert_batch(await task, payloads)
+                    if building_task:
+                        await _upsert_batch(await building_task, payloads, self.building.collection)
+                    if checkpoint is not None and self._on_upserted:
+                        await self._on_upserted(checkpoint)
+                else:
+                    _discard(task)
+                    if building_task:
+                        _discard(building_task)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._slots.release()
+
+    def _buffer(self, collection_name: str, embeddings: list[list[float]], payloads: list[dict]):
+        self._buffers.setdefault(collection_name, []).extend(_make_points(embeddings, payloads))
+
+    async def _flush(self):
+        buffers, self._buffers = self._buffers, {}
+        for collection_name, points in buffers.items():
+            await upload_points_bulk(collection_name, points)
+        checkpoint, self._buffered_checkpoint = self._buffered_checkpoint, None
+        if checkpoint is not None and self._on_upserted:
+            await self._on_upserted(checkpoint)
+
+    async def close(self):
+        """Waits until every submitted batch is upserted."""
+        self._pending.put_nowait(None)
+        await self._upserter
+        self._raise_if_failed()
+
+    async def abort(self):
+        """Cancels outstanding batches and waits for them to stop. Safe to call twice."""
+        tasks = [self._upserter, *self._tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def _discard(task: asyncio.Task):
+    task.cancel()
+    if task.done() and not task.cancelled():
+        task.exception()  # Mark as retrieved
@@ -0,0 +1,165 @@
+import uuid
+import structlog
+from contextlib import AsyncExitStack
+from typing import NamedTuple
+from sqlalchemy import update
+from sqlmodel import select
+from qdrant_client.http.models import Filter, FieldCondition, MatchAny
+from models.base import Document, DocumentChunk, RebuildJob, utc_now
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.transactions import scoped_transaction
+from core.qdrant import qdrant_client, bulk_load
+from core.embedding_index import write_indexes
+from services.chunking import split_child_chunks
+from services.ingestion import _EmbeddingPipeline
+
+logger = structlog.get_logger(__name__)
+
+class _Progress(NamedTuple):
+    cursor: uuid.UUID | None # last document whose vectors are all upserted
+    documents_done: int
+    chunks_done: int
+
+async def start_rebuild(user_id: uuid.UUID | None = None, document_id: uuid.UUID | None = None) -> uuid.UUID:
+    """Registers a rebuild of one document, one user's documents, or (neither given) everything."""
+    async with scoped_transaction() as session:
+        job = RebuildJob(user_id=user_id, document_id=document_id)
+        session.add(job)
+        await session.flush()
+        return job.id
+
+async def run_rebuild(job_id: uuid.UUID, bulk: bool = False) -> int:
+    """
+    Re-creates the vectors of every completed document in the job's scope from the parent text in
+    Postgres; the uploaded PDFs are not needed. Parents are streamed through a server-side cursor
+    as plain rows, children are re-derived with the ingestion splitter and go through the same
+    cached, pipelined embedding path as ingestion. A document's old points are deleted before its
+    first batch, and the cursor only passes a document once all of its points are upserted, so
+    an interrupted rebuild resumes without losing or duplicating vectors. Before it does, the
+    document's parents are looked up again and the points of any deleted or replaced since they
+    were streamed are dropped, so a concurrent deletion or re-ingestion leaves no orphans.
+
+    With `bulk`, indexing of the target collections is paused for the whole load and points go
+    through the parallel batched uploader; the call returns once they are indexed again. Searches
+    keep working during a bulk load but are slower, so use it for backfills and full rebuilds
+    rather than single documents.
+    Returns the number of child vectors written by this run.
+    """
+    async with AsyncSessionLocal() as session:
+        job = await session.get(RebuildJob, job_id)
+    if not job or job.status != "RUNNING":
+        raise ValueError(f"Rebuild {job_id} is not running")
+        
+    query = (
+        select(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.content, DocumentChunk.page_number, Document.user_id)
+        .join(Document, DocumentChunk.document_id == Document.id)
+        .where(Document.status == "COMPLETED")
+        .order_by(DocumentChunk.document_id, DocumentChunk.chunk_index)
+        .execution_options(yield_per=settings.REBUILD_FETCH_SIZE)
+    )
+    if job.user_id:
+        query = query.where(Document.user_id == job.user_id)
+    if job.document_id:
+        query = query.where(Document.id == job.document_id)
+    if job.cursor:
+        query = query.where(DocumentChunk.document_id > job.cursor)
+        
+    # Parents streamed per document, in cursor order, until the document's points are upserted
+    streamed: dict[uuid.UUID, list[uuid.UUID]] = {}
+        
+    async def save_progress(progress: _Progress):
+        upserted = []
+        while streamed and progress.cursor is not None and next(iter(streamed)) <= progress.cursor:
+            upserted.extend(streamed.pop(next(iter(streamed))))
+        await _drop_vanished_parents(upserted)
+        async with scoped_transaction() as session:
+            await session.execute(
+                update(RebuildJob).where(RebuildJob.id == job_id).values(
+                    cursor=progress.cursor,
+                    documents_done=progress.documents_done,
+                    chunks_done=progress.chunks_done,
+                    updated_at=utc_now(),
+                )
+            )
+            
+    progress = _Progress(job.cursor, job.documents_done, job.chunks_done)
+    current_doc = None
+    current_doc_chunks = 0
+    texts = []
+    payloads = []
+    async with AsyncExitStack() as bulk_loads:
+        if bulk:
+            for index in write_indexes():
+                await bulk_loads.enter_async_context(bulk_load(index.collection))
+        pipeline = _EmbeddingPipeline(settings.REBUILD_MAX_IN_FLIGHT, save_progress, bulk=bulk)
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.stream(query)
+                async for rows in result.partitions():
+                    new_docs = list(dict.fromkeys(row.document_id for row in rows if row.document_id != current_doc))
+                    if new_docs:
+                        await _delete_points(new_docs)
+                    
+                    for row in rows:
+                        if row.document_id != current_doc:
+                            if current_doc is not None:
+                                # Every child of the previous document is in `texts` or already submitted
+                                progress = _Progress(current_doc, progress.documents_done + 1, progress.chunks_done + current_doc_chunks)
+                            current_doc = row.document_id
+                            current_doc_chunks = 0
+                            streamed[current_doc] = []
+                        streamed[current_doc].append(row.id)
+                        for child_text in split_child_chunks(row.content):
+                            current_doc_chunks += 1
+                            texts.append(child_text)
+                            payloads.append({
+                                "user_id": str(row.user_id),
+                                "document_id": str(row.document_id),
+                                "parent_chunk_id": str(row.id),
+                                "page_number": row.page_number
+                            })
+                        if len(texts) >= settings.EMBEDDING_BATCH_SIZE:
+                            await pipeline.submit(texts, payloads, progress)
+                            texts, payloads = [], []
+                        
+            if current_doc is not None:
+                progress = _Progress(current_doc, progress.documents_done + 1, progress.chunks_done + current_doc_chunks)
+            if texts:
+                await pipeline.submit(texts, payloads)
+            await pipeline.close()
+        finally:
+            await pipeline.abort()
+        
+    await save_progress(progress)
+    async with scoped_transaction() as session:
+        await session.execute(update(RebuildJob).where(RebuildJob.id == job_id).values(status="COMPLETED"))
+    logger.info(f"Rebuild {job_id} complete: {progress.documents_done} documents, {progress.chunks_done} vectors")
+    return progress.chunks_done - job.chunks_done
+
+async def _drop_vanished_parents(parent_ids: list[uuid.UUID]):
+    """Deletes the points of parents whose rows are gone, i.e. deleted or replaced after being streamed."""
+    for i in range(0, len(parent_ids), settings.DELETION_BATCH_SIZE):
+        batch = parent_ids[i:i + settings.DELETION_BATCH_SIZE]
+        async with AsyncSessionLocal() as session:
+            stored = set((await session.execute(select(DocumentChunk.id).where(DocumentChunk.id.in_(batch)))).scalars())
+        vanished = [str(parent_id) for parent_id in batch if parent_id not in stored]
+        if not vanished:
+            continue
+        logger.info(f"Dropping vectors of {len(vanished)} parents deleted during the rebuild")
+        for index in write_indexes():
+            await qdrant_client.delete(
+                collection_name=index.collection,
+                points_selector=Filter(
+                    must=[FieldCondition(key="parent_chunk_id", match=MatchAny(any=vanished))]
+                )
+            )
+
+async def _delete_points(document_ids: list[uuid.UUID]):
+    for index in write_indexes():
+        await qdrant_client.delete(
+            collection_name=index.collection,
+            points_selector=Filter(
+                must=[FieldCondition(key="document_id", match=MatchAny(any=[str(i) for i in document_ids]))]
+            )
+        )
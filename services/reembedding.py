@@ -0,0 +1,175 @@
+import asyncio
+import uuid
+import structlog
+from sqlalchemy import update
+from sqlmodel import select
+from models.base import Document, ReindexJob, utc_now
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.transactions import scoped_transaction
+from core.embeddings import build_provider, embedding_model_version
+from core.embedding_index import EmbeddingIndex, building_index, refresh_embedding_indexes, versioned_collection_name
+from core.qdrant import (
+    qdrant_client,
+    COLLECTION_NAME,
+    collection_config,
+    collection_exists,
+    ensure_payload_indexes,
+    get_collection_profile,
+    point_alias_at,
+    bulk_load,
+)
+from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+from services.ingestion import reembed_document
+
+logger = structlog.get_logger(__name__)
+
+async def start_reembedding(provider: str, dimensions: int | None = None) -> uuid.UUID:
+    """
+    Creates the versioned collection for the target model and registers a RUNNING job for it.
+    Queries keep being served from the current collection; once the other processes have
+    refreshed (EMBEDDING_INDEX_REFRESH_SECONDS) their ingestions also write to the new one.
+    """
+    await refresh_embedding_indexes()
+    target = build_provider(provider, dimensions)
+    if target.model_version == embedding_model_version():
+        raise ValueError(f"{target.model_version} is already serving")
+    collection_name = versioned_collection_name(target.model_version)
+    
+    async with AsyncSessionLocal() as session:
+        running = (await session.execute(
+            select(ReindexJob).where(ReindexJob.status == "RUNNING").limit(1)
+        )).scalar_one_or_none()
+    if running:
+        raise ValueError(f"Re-embedding {running.id} into {running.collection_name} is still running")
+        
+    # The collection has to exist before any process can dual-write into it
+    if not await collection_exists(collection_name):
+        await qdrant_client.create_collection(
+            collection_name=collection_name,
+            **collection_config(get_collection_profile(), target.dimensions),
+        )
+        await ensure_payload_indexes(collection_name)
+        
+    async with scoped_transaction() as session:
+        job = ReindexJob(
+            provider=provider,
+            dimensions=dimensions,
+            model_version=target.model_version,
+            collection_name=collection_name,
+        )
+        session.add(job)
+        await session.flush()
+        job_id = job.id
+    await refresh_embedding_indexes()
+    logger.info(f"Started re-embedding {job_id} into {collection_name}")
+    return job_id
+
+async def run_reembedding(job_id: uuid.UUID) -> int:
+    """
+    Re-embeds every completed document into the job's collection from the parent text in
+    Postgres, then makes it the serving collection. Documents are walked in id order and the
+    cursor is saved after each page, so a restarted run continues where the last one stopped.
+    Embedding calls go through the quota broker at bulk priority, behind user queries.
+    Indexing of the new collection is paused while it fills, and the switch waits until it is
+    fully indexed, so queries never hit a half-built graph.
+    Returns the number of documents re-embedded by this run.
+    """
+    await refresh_embedding_indexes()
+    async with AsyncSessionLocal() as session:
+        job = await session.get(ReindexJob, job_id)
+    if not job or job.status != "RUNNING":
+        raise ValueError(f"Re-embedding {job_id} is not running")
+    index = building_index()
+    # Documents ingested by processes that haven't seen the job yet are written to the serving
+    # collection only, so walk the documents once every process is dual-writing
+    settle_until = job.started_at.timestamp() + 2 * settings.EMBEDDING_INDEX_REFRESH_SECONDS
+    await asyncio.sleep(max(0.0, settle_until - utc_now().timestamp()))
+    
+    slots = asyncio.Semaphore(max(1, settings.REEMBEDDING_CONCURRENCY))
+    async def reembed(doc_id: uuid.UUID, user_id: uuid.UUID):
+        async with slots:
+            await reembed_document(doc_id, user_id, index)
+            
+    async with bulk_load(index.collection):
+        cursor = job.cursor
+        done = 0
+        while True:
+            query = (
+                select(Document.id, Document.user_id)
+                .where(Document.status == "COMPLETED")
+                .order_by(Document.id)
+                .limit(settings.REEMBEDDING_PAGE_SIZE)
+            )
+            if cursor is not None:
+                query = query.where(Document.id > cursor)
+            async with AsyncSessionLocal() as session:
+                page = (await session.execute(query)).all()
+            if not page:
+                break
+            
+            await asyncio.gather(*(reembed(doc.id, doc.user_id) for doc in page))
+            await _drop_deleted(index, [doc.id for doc in page])
+            cursor = page[-1].id
+            done += len(page)
+            async with scoped_transaction() as session:
+                await session.execute(
+                    update(ReindexJob).where(ReindexJob.id == job_id).values(
+                        cursor=cursor,
+                        documents_done=ReindexJob.documents_done + len(page),
+                        updated_at=utc_now(),
+                    )
+                )
+            logger.info(f"Re-embedding {job_id}: {done} documents this run")
+            
+    await _complete(job_id, index)
+    return done
+
+async def _drop_deleted(index: EmbeddingIndex, doc_ids: list[uuid.UUID]):
+    """Removes vectors of documents deleted while they were being re-embedded."""
+    async with AsyncSessionLocal() as session:
+        remaining = set((await session.execute(select(Document.id).where(Document.id.in_(doc_ids)))).scalars().all())
+    for doc_id in doc_ids:
+        if doc_id not in remaining:
+            await qdrant_client.delete(
+                collection_name=index.collection,
+                points_selector=Filter(must=[FieldCondition(key="document_id", match=MatchValue(value=str(doc_id)))])
+            )
+
+async def _complete(job_id: uuid.UUID, index: EmbeddingIndex):
+    serving_version = embedding_model_version()
+    async with scoped_transaction() as session:
+        job = await session.get(ReindexJob, job_id)
+        job.status = "COMPLETED"
+        job.completed_at = job.updated_at = utc_now()
+        # Documents now have vectors from the new model, so incremental re-ingestion and
+        # duplicate cloning keep working for them after the switch
+        await session.execute(
+            update(Document)
+            .where(Document.embedding_model_version == serving_version)
+            .values(embedding_model_version=index.provider.model_version)
+        )
+    await refresh_embedding_indexes()
+    
+    # Every process switches its queries over on its next refresh; only then may the alias move
+    # and the old collection disappear (it is deleted outright if it still squats on the alias name)
+    await asyncio.sleep(2 * settings.EMBEDDING_INDEX_REFRESH_SECONDS)
+    previous = await point_alias_at(index.collection)
+    await refresh_embedding_indexes()
+    if previous not in (None, COLLECTION_NAME, index.collection):
+        await qdrant_client.delete_collection(previous)
+    logger.info(f"Re-embedding {job_id} complete; {index.collection} is serving (dropped {previous})")
+
+async def cancel_reembedding(job_id: uuid.UUID):
+    """Stops dual-writes into the job's collection and drops it."""
+    async with scoped_transaction() as session:
+        job = await session.get(ReindexJob, job_id)
+        if not job or job.status != "RUNNING":
+            raise ValueError(f"Re-embedding {job_id} is not running")
+        job.status = "CANCELLED"
+        job.updated_at = utc_now()
+        collection_name = job.collection_name
+    await refresh_embedding_indexes()
+    # Let in-flight dual-writes from other processes finish before the collection goes
+    await asyncio.sleep(2 * settings.EMBEDDING_INDEX_REFRESH_SECONDS)
+    await qdrant_client.delete_collection(collection_name)
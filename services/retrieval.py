@@ -1,19 +1,48 @@
+import re
 import uuid
+import hashlib
 import structlog
 import asyncio
+from dataclasses import dataclass, field, replace
 from typing import List, Dict, Any, Tuple
 from qdrant_client.http.models import Filter, FieldCondition, MatchValue, MatchAny
 from sqlalchemy import select, func, text
 from core.database import AsyncSessionLocal
-from core.qdrant import qdrant_client, COLLECTION_NAME, RRF_K
-from core.embeddings import generate_query_embedding, EmbeddingFatalError, EmbeddingError
-from models.base import DocumentChunk, Document
+from core.qdrant import qdrant_client, RRF_K, get_search_params
+from core.embedding_index import serving_index
+from core.embeddings import generate_query_embedding, normalize_query, EmbeddingFatalError, EmbeddingError
+from core.cache import AsyncLRUCache
+from core.config import settings
+from models.base import DocumentChunk, Document, User
 from services.generation import groq_client
 
 logger = structlog.get_logger(__name__)
 
 MAX_CONTEXT_CHARS = 12000
 
+@dataclass(frozen=True)
+class RetrievalResult:
+    context: str
+    sources: list[dict]
+    # Fused ranking, best first
+    parent_ids: list[uuid.UUID] = field(default_factory=list)
+    # The user's corpus generation the result was retrieved from
+    generation: int = 0
+
+EMPTY_RESULT = RetrievalResult("", [])
+
+# Assembled results by (user, corpus generation, document filter, normalized query, top_k, threshold).
+# The generation changes whenever the user's corpus does, so stale entries are never hit again
+# and simply age out.
+retrieval_cache = AsyncLRUCache(
+    max_entries=settings.RETRIEVAL_CACHE_MAX_ENTRIES,
+    max_bytes=settings.RETRIEVAL_CACHE_MAX_MB * 1024 * 1024,
+    ttl=settings.RETRIEVAL_CACHE_TTL_SECONDS,
+    sizeof=lambda key, result: (
+        500 + len(key[3]) + 2 * len(result.context) + 200 * len(result.sources) + 64 * len(result.parent_ids)
+    ),
+)
+
 def reciprocal_rank_fusion(rankings: list[list[uuid.UUID]], k: int = 60) -> dict[uuid.UUID, float]:
     scores: dict[uuid.UUID, float] = {}
     for ranking in rankings:
@@ -21,13 +50,59 @@ def reciprocal_rank_fusion(rankings: list[list[uuid.UUID]], k: int = 60) -> dict
             scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
     return scores
 
-async def rewrite_query_standalone(query: str, chat_history: list[dict]) -> str:
+# Words that only make sense with the conversation so far: pronouns, deictic words, and
+# openers that continue an earlier question ("what about ...", "and the ...")
+_CONTEXT_DEPENDENT = re.compile(
+    r"\b(it|its|itself|they|them|their|theirs|he|him|his|she|her|hers|this|that|these|those|"
+    r"one|ones|here|there|above|below|former|latter|previous|earlier|aforementioned|same|such|"
+    r"else|other|others|again)\b"
+    r"|^\s*(and|or|but|also|so|then|what about|how about|why not|more|what else)\b"
+    r"|\.\.\.|…",
+    re.IGNORECASE,
+)
+
+def needs_rewrite(query: str) -> bool:
+    """
+    Cheap check for references that only the chat history can resolve. Very short queries are
+    usually follow-ups ("and in 2023?"), so they are rewritten too. False positives only cost
+    the LLM call that would have been made anyway.
+    """
+    return len(query.split()) <= 3 or bool(_CONTEXT_DEPENDENT.search(query))
+
+# Rewrites by (conversation, last assistant reply, normalized query): a retried or repeated
+# follow-up resolves against the same answer and gets the same rewrite
+rewrite_cache = AsyncLRUCache(
+    max_entries=settings.QUERY_REWRITE_CACHE_MAX_ENTRIES,
+    max_bytes=settings.QUERY_REWRITE_CACHE_MAX_MB * 1024 * 1024,
+    ttl=settings.QUERY_REWRITE_CACHE_TTL_SECONDS,
+    sizeof=lambda key, rewritten: 200 + len(key[2]) + len(rewritten),
+)
+rewrite_stats = {"skipped": 0, "llm_calls": 0, "speculation_used": 0, "speculation_discarded": 0}
+
+async def rewrite_query_standalone(query: str, chat_history: list[dict], conversation_id: uuid.UUID | None = None) -> str:
     """Resolve pronouns/references in `query` using recent chat_history so retrieval
     isn't blind to conversational context. Falls back to the original query on any failure."""
     if not groq_client or not chat_history:
         return query
+    if not needs_rewrite(query):
+        rewrite_stats["skipped"] += 1
+        return query
+        
+    async def rewrite() -> str:
+        rewrite_stats["llm_calls"] += 1
+        return await _rewrite_with_llm(query, chat_history[-4:])
         
-    recent_history = chat_history[-4:]
+    try:
+        if conversation_id is None:
+            return await rewrite()
+        last_reply = next((msg["content"] for msg in reversed(chat_history) if msg["role"] != "user"), "")
+        key = (conversation_id, hashlib.sha256(last_reply.encode("utf-8")).hexdigest(), normalize_query(query))
+        return await rewrite_cache.get_or_load(key, rewrite)
+    except Exception as e:
+        logger.warning(f"Query rewrite failed: {e}")
+        return query
+
+async def _rewrite_with_llm(query: str, recent_history: list[dict]) -> str:
     prompt = (
         "Given the following conversation history, rewrite the user's latest query to be a "
         "standalone search query that contains all necessary context (e.g. resolving pronouns "
@@ -37,37 +112,28 @@ async def rewrite_query_standalone(query: str, chat_history: list[dict]) -> str:
         prompt += f"{msg['role'].upper()}: {msg['content']}\n"
     prompt += f"LATEST QUERY: {query}\nREWRITTEN QUERY:"
     
-    try:
-        response = await groq_client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0,
-            max_tokens=64
-        )
-        rewritten = response.choices[0].message.content.strip()
-        return rewritten if rewritten else query
-    except Exception as e:
-        logger.warning(f"Query rewrite failed: {e}")
-        return query
+    response = await groq_client.chat.completions.create(
+        model="llama-3.1-8b-instant",
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.0,
+        max_tokens=64
+    )
+    rewritten = response.choices[0].message.content.strip()
+    return rewritten if rewritten else query
 
-async def retrieve_context(
-    query: str,
+async def _rank_parents(
+    search_query: str,
     user_id: uuid.UUID,
-    document_ids: List[uuid.UUID] = None,
-    chat_history: List[Dict[str, Any]] = None,
-    top_k: int = 20,
-    score_threshold: float = 0.5,
-) -> Tuple[str, List[Dict[str, Any]]]:
-    if chat_history is None:
-        chat_history = []
-        
-    rewritten_query = await rewrite_query_standalone(query, chat_history)
-    
+    document_ids: List[uuid.UUID] | None,
+    top_k: int,
+    score_threshold: float,
+) -> dict[uuid.UUID, float] | None:
+    """Dense and lexical search for `search_query`, fused by RRF. None if the query can't be embedded."""
     try:
-        query_vector = await generate_query_embedding(rewritten_query)
+        query_vector = await generate_query_embedding(search_query)
     except (EmbeddingFatalError, EmbeddingError) as e:
         logger.error(f"Embedding failed during retrieval: {e}")
-        return "", []
+        return None
 
     must_conditions = [FieldCondition(key="user_id", match=MatchValue(value=str(user_id)))]
     if document_ids:
@@ -76,12 +142,18 @@ async def retrieve_context(
         )
 
     async def dense_search():
-        return await qdrant_client.query_points(
-            collection_name=COLLECTION_NAME,
+        # Grouped by parent, so top_k hits are top_k distinct parents even when
+        # several children of one parent match
+        return await qdrant_client.query_points_groups(
+            collection_name=serving_index().collection,
+            group_by="parent_chunk_id",
             query=query_vector,
             limit=top_k,
+            group_size=settings.RETRIEVAL_GROUP_SIZE,
             query_filter=Filter(must=must_conditions),
-            score_threshold=score_threshold
+            search_params=get_search_params(),
+            score_threshold=score_threshold,
+            with_payload=False
         )
 
     async def lexical_search():
@@ -91,10 +163,10 @@ async def retrieve_context(
             
         async with AsyncSessionLocal() as session:
             stmt = (
-                select(DocumentChunk.id, func.ts_rank(DocumentChunk.content_tsv, func.plainto_tsquery(rewritten_query)).label("lexical_score"))
+                select(DocumentChunk.id, func.ts_rank(DocumentChunk.content_tsv, func.plainto_tsquery(search_query)).label("lexical_score"))
                 .join(Document, DocumentChunk.document_id == Document.id)
                 .where(Document.user_id == user_id)
-                .where(DocumentChunk.content_tsv.op("@@")(func.plainto_tsquery(rewritten_query)))
+                .where(DocumentChunk.content_tsv.op("@@")(func.plainto_tsquery(search_query)))
             )
             if document_ids:
                 stmt = stmt.where(Document.id.in_(document_ids))
@@ -104,24 +176,119 @@ async def retrieve_context(
 
     dense_res, lexical_res = await asyncio.gather(dense_search(), lexical_search())
 
-    dense_ranking: list[uuid.UUID] = []
-    best_score_by_parent: dict[uuid.UUID, float] = {}
-    seen = set()
-    for hit in dense_res.points:
-        pid = uuid.UUID(hit.payload["parent_chunk_id"])
-        if pid not in seen:
-            seen.add(pid)
-            dense_ranking.append(pid)
-        best_score_by_parent[pid] = max(best_score_by_parent.get(pid, 0.0), hit.score)
+    # Groups come back best-first, each with its best child hit first
+    dense_ranking = [uuid.UUID(group.id) for group in dense_res.groups]
         
     lexical_ranking = [row.id for row in lexical_res]
     
-    fused_scores = reciprocal_rank_fusion([dense_ranking, lexical_ranking], k=RRF_K)
-    
+    return reciprocal_rank_fusion([dense_ranking, lexical_ranking], k=RRF_K)
+
+def _close_enough(query: str, rewritten: str) -> bool:
+    """Word-set overlap between the raw and the rewritten query (Jaccard)."""
+    raw, new = set(normalize_query(query).split()), set(normalize_query(rewritten).split())
+    if not raw or not new:
+        return raw == new
+    return len(raw & new) / len(raw | new) >= settings.RETRIEVAL_SPECULATIVE_MIN_OVERLAP
+
+async def _speculative_search(
+    query: str,
+    chat_history: list[dict],
+    conversation_id: uuid.UUID | None,
+    user_id: uuid.UUID,
+    generation: int,
+    document_ids: List[uuid.UUID] | None,
+    top_k: int,
+    score_threshold: float,
+) -> RetrievalResult | None:
+    """
+    Searches with the raw query while the rewrite is still running. When the rewrite comes back
+    (nearly) unchanged the speculative results are used, so the rewrite costs no extra latency;
+    otherwise they are cancelled and the rewritten query is searched.
+    """
+    speculative = asyncio.create_task(_search(query, user_id, generation, document_ids, top_k, score_threshold))
+    # A discarded speculation's failure is of no interest
+    speculative.add_done_callback(lambda task: task.cancelled() or task.exception())
+    try:
+        rewritten_query = await rewrite_query_standalone(query, chat_history, conversation_id)
+        if _close_enough(query, rewritten_query):
+            rewrite_stats["speculation_used"] += 1
+            return await speculative
+        rewrite_stats["speculation_discarded"] += 1
+        speculative.cancel()
+        return await _search(rewritten_query, user_id, generation, document_ids, top_k, score_threshold)
+    finally:
+        if not speculative.done():
+            speculative.cancel()
+
+async def _corpus_generation(user_id: uuid.UUID) -> int:
+    async with AsyncSessionLocal() as session:
+        generation = (await session.execute(select(User.corpus_generation).where(User.id == user_id))).scalar()
+    return generation or 0
+
+async def _search(
+    search_query: str,
+    user_id: uuid.UUID,
+    generation: int,
+    document_ids: List[uuid.UUID] | None,
+    top_k: int,
+    score_threshold: float,
+) -> RetrievalResult | None:
+    """Ranked and assembled context for `search_query`, from the cache when the corpus is unchanged."""
+    key = (
+        user_id,
+        generation,
+        tuple(sorted(document_ids)) if document_ids else None,
+        normalize_query(search_query),
+        top_k,
+        score_threshold,
+    )
+    cached = retrieval_cache.lookup(key)
+    if cached is not None:
+        return cached
+    fused_scores = await _rank_parents(search_query, user_id, document_ids, top_k, score_threshold)
+    if fused_scores is None:
+        return None
+    result = replace(await _assemble_context(fused_scores, user_id), generation=generation)
+    retrieval_cache.put(key, result)
+    return result
+
+async def retrieve(
+    query: str,
+    user_id: uuid.UUID,
+    document_ids: List[uuid.UUID] = None,
+    chat_history: List[Dict[str, Any]] = None,
+    top_k: int = 20,
+    score_threshold: float = 0.5,
+    conversation_id: uuid.UUID | None = None,
+) -> RetrievalResult:
+    if chat_history is None:
+        chat_history = []
+    generation = await _corpus_generation(user_id)
+        
+    if settings.RETRIEVAL_SPECULATIVE and groq_client and chat_history and needs_rewrite(query):
+        result = await _speculative_search(query, chat_history, conversation_id, user_id, generation, document_ids, top_k, score_threshold)
+    else:
+        rewritten_query = await rewrite_query_standalone(query, chat_history, conversation_id)
+        result = await _search(rewritten_query, user_id, generation, document_ids, top_k, score_threshold)
+    return result or EMPTY_RESULT
+
+async def retrieve_context(
+    query: str,
+    user_id: uuid.UUID,
+    document_ids: List[uuid.UUID] = None,
+    chat_history: List[Dict[str, Any]] = None,
+    top_k: int = 20,
+    score_threshold: float = 0.5,
+    conversation_id: uuid.UUID | None = None,
+) -> Tuple[str, List[Dict[str, Any]]]:
+    result = await retrieve(query, user_id, document_ids, chat_history, top_k, score_threshold, conversation_id)
+    return result.context, result.sources
+
+async def _assemble_context(fused_scores: dict[uuid.UUID, float], user_id: uuid.UUID) -> RetrievalResult:
     if not fused_scores:
-        return "", []
+        return EMPTY_RESULT
         
-    merged_parent_ids = list(fused_scores.keys())
+    merged_parent_ids = sorted(fused_scores, key=fused_scores.get, reverse=True)
     
     async with AsyncSessionLocal() as session:
         statement = (
@@ -166,4 +333,4 @@ async def retrieve_context(
                 "excerpt": chunk.content[:150] + "..." if len(chunk.content) > 150 else chunk.content
             })
             
-    return "\n".join(context_blocks), sources
+    return RetrievalResult("\n".join(context_blocks), sources, merged_parent_ids)
@@ -208,3 +208,12 @@ async def test_logout_revokes_token(async_client, mock_user_id):
     # Try the protected route again, should fail
     res2 = await async_client.post("/conversations", headers={"Authorization": f"Bearer {mock_user_id['token']}"})
     assert res2.status_code == 401
+
+@pytest.mark.asyncio
+async def test_metrics_require_authentication(async_client, mock_user_id):
+    res = await async_client.get("/metrics")
+    assert res.status_code == 401
+    
+    res = await async_client.get("/metrics", headers={"Authorization": f"Bearer {mock_user_id['token']}"})
+    assert res.status_code == 200
+    assert "embedding_cache" in res.json()
@@ -0,0 +1,147 @@
+import pytest
+import asyncio
+from unittest.mock import patch, AsyncMock
+from core.embeddings import EmbeddingFatalError, EmbeddingError
+
+@pytest.mark.asyncio
+async def test_embedding_batcher_coalesces_concurrent_requests():
+    from core.embeddings import EmbeddingBatcher
+    calls = []
+    async def fake_embed(texts, priority):
+        calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(fake_embed, max_texts=8, max_tokens=10_000, linger=0.05)
+    requests = [["a"], ["bb", "ccc"], ["dddd"]]
+    results = await asyncio.gather(*(batcher.embed(r) for r in requests))
+
+    # Linger window: one API call, each caller gets its own slice back
+    assert calls == [["a", "bb", "ccc", "dddd"]]
+    assert results == [[[1.0]], [[2.0], [3.0]], [[4.0]]]
+
+    # Size limit: a full batch goes out without waiting, and requests are never split
+    calls.clear()
+    results = await asyncio.gather(*(batcher.embed([f"t{i}"] * 3) for i in range(3)))
+    assert [len(c) for c in calls] == [6, 3]
+    assert all(len(r) == 3 for r in results)
+    assert batcher.stats()["api_calls"] == 3
+
+
+@pytest.mark.asyncio
+async def test_embedding_batcher_isolates_rejected_requests():
+    from core.embeddings import EmbeddingBatcher
+    async def picky_embed(texts, priority):
+        if "bad" in texts:
+            raise EmbeddingFatalError("400")
+        return [[1.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(picky_embed, max_texts=100, linger=0.05)
+    good, bad = await asyncio.gather(batcher.embed(["ok", "fine"]), batcher.embed(["bad"]), return_exceptions=True)
+    assert good == [[1.0], [1.0]]
+    assert isinstance(bad, EmbeddingFatalError)
+
+@pytest.mark.asyncio
+async def test_quota_broker_serves_interactive_first():
+    from core.quota import QuotaBroker, Priority
+    broker = QuotaBroker(rate=50, min_rate=1, max_rate=100, burst=1)
+    await broker.acquire(Priority.BULK)  # Drain the bucket so everyone below has to queue
+
+    granted = []
+    async def request(name, priority):
+        await broker.acquire(priority)
+        granted.append(name)
+
+    bulk = [asyncio.create_task(request(f"bulk-{i}", Priority.BULK)) for i in range(3)]
+    await asyncio.sleep(0)
+    query = asyncio.create_task(request("query", Priority.INTERACTIVE))
+    await asyncio.sleep(0)
+    assert broker.stats()["queues"]["bulk"]["depth"] == 3
+    await asyncio.gather(*bulk, query)
+
+    assert granted == ["query", "bulk-0", "bulk-1", "bulk-2"]
+    stats = broker.stats()["queues"]
+    assert stats["interactive"]["granted"] == 1 and stats["bulk"]["granted"] == 4
+    assert stats["bulk"]["max_wait_ms"] > 0
+
+
+def test_quota_broker_aimd():
+    from core.quota import QuotaBroker
+    broker = QuotaBroker(rate=10, min_rate=2, max_rate=12, burst=5, cooldown=60)
+    broker.on_throttle()
+    assert broker.rate == 5
+    broker.on_throttle()  # Same burst of 429s: within the cooldown, no second cut
+    assert broker.rate == 5
+    for _ in range(100):
+        broker.on_success()
+    assert broker.rate == 12
+    for _ in range(5):
+        broker._last_decrease = float("-inf")
+        broker.on_throttle()
+    assert broker.rate == 2
+    assert broker.throttles == 7
+
+@pytest.mark.asyncio
+async def test_local_embedding_provider_similarity():
+    import numpy as np
+    from core.embeddings import LocalHashingProvider
+    provider = LocalHashingProvider()
+    texts = ["The invoice total is due in thirty days", "Invoice totals are due within thirty days", "Photosynthesis converts light into energy"]
+    vectors = np.array(await provider.embed(texts))
+    assert vectors.shape == (3, 768)
+    assert np.linalg.norm(vectors, axis=1) == pytest.approx([1.0] * 3, abs=1e-5)
+    similarity = vectors @ vectors.T
+    assert similarity[0, 1] > 0.5 > similarity[0, 2]
+    assert (await LocalHashingProvider().embed(texts[:1]))[0] == vectors[0].tolist()  # Deterministic across instances
+
+@pytest.mark.asyncio
+async def test_truncated_embedding_dimensions():
+    import numpy as np
+    from core import embeddings
+    with patch.object(embeddings.settings, "EMBEDDING_PROVIDER", "local"), \
+         patch.object(embeddings.settings, "EMBEDDING_DIMENSIONS", 256):
+        provider = embeddings.get_embedding_provider()
+        assert provider.dimensions == 256
+        assert provider.model_version == "local-hashing-v1-768@256"
+        full = np.array(await provider.inner.embed(["matryoshka prefix"]))[0]
+        vector = np.array(await embeddings.generate_embeddings(["matryoshka prefix"]))[0]
+    assert vector.shape == (256,)
+    assert np.linalg.norm(vector) == pytest.approx(1.0, abs=1e-5)
+    assert vector == pytest.approx(full[:256] / np.linalg.norm(full[:256]), abs=1e-6)
+    assert embeddings.get_embedding_provider().dimensions == 768
+
+@pytest.mark.asyncio
+async def test_query_embedding_cache():
+    from core import embeddings
+    from core.cache import AsyncLRUCache
+    calls = []
+    async def slow_embed(texts, priority=None):
+        calls.append(texts)
+        await asyncio.sleep(0.05)
+        return [[float(len(calls))] * 768 for _ in texts]
+
+    embeddings.query_embedding_cache.clear()
+    with patch("core.embeddings.generate_embeddings", side_effect=slow_embed):
+        # Concurrent misses for the same normalized query share one call
+        first, second = await asyncio.gather(
+            embeddings.generate_query_embedding("What is  the refund policy?"),
+            embeddings.generate_query_embedding("what is the refund policy? "),
+        )
+        again = await embeddings.generate_query_embedding("WHAT IS THE REFUND POLICY?")
+        other = await embeddings.generate_query_embedding("Who signed the contract?")
+    assert len(calls) == 2
+    assert first == second == again == [1.0] * 768 and other == [2.0] * 768
+    stats = embeddings.query_embedding_cache.stats()
+    assert stats["entries"] == 2 and stats["bytes"] > 2 * 768 * 4
+    assert stats["hit_ratio"] > 0
+
+    cache = AsyncLRUCache(max_entries=2, max_bytes=1000, ttl=60, sizeof=lambda key, value: 100)
+    for key in "abc":
+        cache.put(key, key)
+    assert cache.get("a") is None and cache.get("c") == "c"
+    assert cache.stats()["evictions"] == 1
+    with pytest.raises(EmbeddingError):
+        await cache.get_or_load("d", AsyncMock(side_effect=EmbeddingError("429")))
+    assert cache.get("d") is None  # Failures are not cached
+    expiring = AsyncLRUCache(max_entries=2, max_bytes=1000, ttl=0, sizeof=lambda key, value: 100)
+    expiring.put("a", 1)
+    assert expiring.get("a") is None and expiring.stats()["expirations"] == 1
@@ -11,8 +11,9 @@ from core.transactions import scoped_transaction
 from core.qdrant import init_qdrant, qdrant_client, COLLECTION_NAME
 from services.ingestion import process_document, execute_deletion_saga
 from core.storage import get_secure_file_path, UPLOAD_DIR, ensure_upload_dir
-from unittest.mock import patch
+from unittest.mock import patch, AsyncMock
 from core.embeddings import EmbeddingFatalError, EmbeddingError
+from services.chunking import ResumePoint
 
 async def mock_generate_embeddings(texts):
     return [[0.1] * 768 for _ in texts]
@@ -107,6 +108,36 @@ async def test_deletion_saga():
         chunks = await session.execute(select(DocumentChunk).where(DocumentChunk.document_id == doc_id))
         assert len(chunks.scalars().all()) == 0
 
+@pytest.mark.asyncio
+async def test_bulk_deletion_saga():
+    from services.ingestion import execute_bulk_deletion_saga
+    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+    doc_ids = []
+    for i in range(4):
+        job_id, doc_id = await setup_job(f"bulk_{i}.pdf")
+        await process_document(job_id)
+        doc_ids.append(doc_id)
+    doomed, survivor = doc_ids[:3], doc_ids[3]
+
+    # A tiny batch size forces several DELETE rounds per statement kind
+    with patch("services.ingestion.settings.DELETION_BATCH_SIZE", 2):
+        await execute_bulk_deletion_saga(doomed)
+
+    async with AsyncSessionLocal() as session:
+        docs = (await session.execute(select(Document))).scalars().all()
+        assert [d.id for d in docs] == [survivor]
+        chunks = (await session.execute(select(DocumentChunk))).scalars().all()
+        assert chunks and all(c.document_id == survivor for c in chunks)
+        jobs = (await session.execute(select(ProcessingJob))).scalars().all()
+        assert [j.document_id for j in jobs] == [survivor]
+
+    for doc_id in doc_ids:
+        count = await qdrant_client.count(
+            COLLECTION_NAME,
+            count_filter=Filter(must=[FieldCondition(key="document_id", match=MatchValue(value=str(doc_id)))]),
+        )
+        assert (count.count > 0) == (doc_id == survivor)
+
 @pytest.mark.asyncio
 async def test_concurrent_ingestion():
     jobs = []
@@ -173,3 +204,853 @@ async def test_embedding_batch_limits():
     # Batch size is 100. 250 chunks means 3 calls (100, 100, 50).
     assert call_count == 3, f"Expected 3 batch calls, got {call_count}"
 
+
+@pytest.mark.asyncio
+async def test_parent_chunks_written_per_batch():
+    job_id, doc_id = await setup_job("bulk_parents.pdf")
+    
+    def mock_extract(*args):
+        loop = args[1]
+        queue = args[2]
+        for i in range(250):
+            asyncio.run_coroutine_threadsafe(queue.put((f"Parent {i}", [f"Child {i}"])), loop).result()
+        asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+        
+    persisted_batches = []
+    from services.ingestion import _persist_parent_chunks
+    async def counted_persist(rows):
+        persisted_batches.append(len(rows))
+        await _persist_parent_chunks(rows)
+        
+    with patch("services.ingestion.extract_and_chunk_sync", side_effect=mock_extract):
+        with patch("services.ingestion._persist_parent_chunks", side_effect=counted_persist):
+            await process_document(job_id)
+            
+    # One multi-row write per embedding batch, not one transaction per parent
+    assert persisted_batches == [100, 100, 50]
+    
+    async with AsyncSessionLocal() as session:
+        chunks = await session.execute(select(DocumentChunk.id).where(DocumentChunk.document_id == doc_id))
+        parent_ids = {str(cid) for cid in chunks.scalars().all()}
+    assert len(parent_ids) == 250
+    
+    points, _ = await qdrant_client.scroll(collection_name=COLLECTION_NAME, limit=1000)
+    doc_points = [p for p in points if p.payload["document_id"] == str(doc_id)]
+    assert len(doc_points) == 250
+    assert all(p.payload["parent_chunk_id"] in parent_ids for p in doc_points)
+
+@pytest.mark.asyncio
+async def test_pipelined_embedding_preserves_upsert_order():
+    job_id, doc_id = await setup_job("pipelined.pdf")
+    
+    def mock_extract(*args):
+        loop = args[1]
+        queue = args[2]
+        for i in range(500):
+            asyncio.run_coroutine_threadsafe(queue.put((f"Parent {i}", [f"Child {i}"])), loop).result()
+        asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+        
+    in_flight = 0
+    max_in_flight = 0
+    async def slow_then_fast_embed(chunks):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        # Earlier batches finish last, so out-of-order upserts would be visible
+        await asyncio.sleep(0.05 if chunks[0] == "Child 0" else 0.01)
+        in_flight -= 1
+        return [[0.1]*768 for _ in chunks]
+        
+    upserted_batches = []
+    from services.ingestion import _upsert_batch
+    async def recording_upsert(embeddings, payloads):
+        upserted_batches.append(payloads[0]["parent_chunk_id"])
+        await _upsert_batch(embeddings, payloads)
+        
+    with patch("services.ingestion.extract_and_chunk_sync", side_effect=mock_extract), \
+         patch("services.ingestion.generate_embeddings", side_effect=slow_then_fast_embed), \
+         patch("services.ingestion._upsert_batch", side_effect=recording_upsert), \
+         patch("services.ingestion.settings.EMBEDDING_MAX_IN_FLIGHT", 3):
+        await process_document(job_id)
+        
+    assert 1 < max_in_flight <= 3
+    
+    async with AsyncSessionLocal() as session:
+        doc = await session.get(Document, doc_id)
+        assert doc.status == "COMPLETED"
+        
+    # Batches are upserted in the order their parents were extracted
+    points, _ = await qdrant_client.scroll(collection_name=COLLECTION_NAME, limit=1000)
+    parent_ids = {p.payload["parent_chunk_id"] for p in points if p.payload["document_id"] == str(doc_id)}
+    assert len(parent_ids) == 500
+    assert len(upserted_batches) == 5
+    async with AsyncSessionLocal() as session:
+        rows = await session.execute(select(DocumentChunk.id, DocumentChunk.content).where(DocumentChunk.document_id == doc_id))
+        content_by_id = {str(r.id): r.content for r in rows.all()}
+    assert [content_by_id[pid] for pid in upserted_batches] == [f"Parent {i}" for i in range(0, 500, 100)]
+
+@pytest.mark.asyncio
+async def test_coalesced_ingestion():
+    job_ids = []
+    for i in range(3):
+        job_id, _ = await setup_job(f"coalesced_{i}.pdf")
+        job_ids.append(job_id)
+
+    calls = []
+    async def counted_embed(texts, priority):
+        calls.append(len(texts))
+        return [[0.1] * 768 for _ in texts]
+
+    with patch("core.embeddings.generate_embeddings", side_effect=counted_embed), \
+         patch("services.ingestion.generate_embeddings", side_effect=AssertionError("must go through the batcher")), \
+         patch("services.ingestion.settings.EMBEDDING_COALESCING", True), \
+         patch("services.ingestion.settings.EMBEDDING_CACHE_ENABLED", False), \
+         patch("services.ingestion.embedding_batcher.linger", 0.2):
+        await asyncio.gather(*(process_document(j) for j in job_ids))
+
+    # The three small documents share API calls
+    assert 0 < len(calls) < 3
+    async with AsyncSessionLocal() as session:
+        docs = (await session.execute(select(Document))).scalars().all()
+        assert {d.status for d in docs} == {"COMPLETED"}
+
+@pytest.mark.asyncio
+async def test_ingestion_records_provider_model_version():
+    from core import embeddings
+    job_id, doc_id = await setup_job("local_provider.pdf")
+    with patch.object(embeddings.settings, "EMBEDDING_PROVIDER", "local"), \
+         patch("services.ingestion.generate_embeddings", side_effect=embeddings.generate_embeddings):
+        await process_document(job_id)
+        version = embeddings.embedding_model_version()
+
+    assert version == "local-hashing-v1-768"
+    async with AsyncSessionLocal() as session:
+        doc = await session.get(Document, doc_id)
+        assert doc.status == "COMPLETED"
+        assert doc.embedding_model_version == version
+
+@pytest.mark.asyncio
+async def test_reembedding_migrates_to_new_collection():
+    from core import embeddings, embedding_index
+    from core.qdrant import collection_exists
+    from models.base import ReindexJob
+    from services.reembedding import start_reembedding, run_reembedding
+
+    async def embed(texts, priority=None, provider=None):
+        if provider is not None:
+            return await embeddings.generate_embeddings(texts, provider=provider)
+        return await mock_generate_embeddings(texts)
+
+    before_id, before_doc = await setup_job("before.pdf")
+    during_id, during_doc = await setup_job("during.pdf")
+    previous = target = None
+    with patch("services.ingestion.generate_embeddings", side_effect=embed), \
+         patch.object(embeddings.settings, "EMBEDDING_INDEX_REFRESH_SECONDS", 0):
+        try:
+            await process_document(before_id)
+            job_id = await start_reembedding("local", 256)
+            target = embedding_index.building_index().collection
+            # Still served from the old collection, while new ingestions are dual-written
+            assert embedding_index.serving_index().collection == COLLECTION_NAME
+            await process_document(during_id)
+            during_points = (await qdrant_client.count(target)).count
+            assert during_points > 0
+
+            await run_reembedding(job_id)
+
+            # Served through the alias, which now points at the new collection
+            serving = embedding_index.serving_index()
+            assert serving.collection == COLLECTION_NAME
+            assert embeddings.embedding_model_version() == "local-hashing-v1-768@256"
+            assert embedding_index.building_index() is None
+            assert (await qdrant_client.count(target)).count == 2 * during_points
+            points, _ = await qdrant_client.scroll(target, limit=1, with_vectors=True)
+            assert len(points[0].vector) == 256
+            aliases = (await qdrant_client.get_aliases()).aliases
+            assert [(a.alias_name, a.collection_name) for a in aliases] == [(COLLECTION_NAME, target)]
+            async with AsyncSessionLocal() as session:
+                job = await session.get(ReindexJob, job_id)
+                assert job.status == "COMPLETED" and job.documents_done == 2
+                for doc_id in (before_doc, during_doc):
+                    doc = await session.get(Document, doc_id)
+                    assert doc.embedding_model_version == "local-hashing-v1-768@256"
+
+            # A second migration swaps the alias again and drops the collection it replaces
+            previous, target = target, None
+            job_id = await start_reembedding("local", 128)
+            target = embedding_index.building_index().collection
+            await run_reembedding(job_id)
+            aliases = (await qdrant_client.get_aliases()).aliases
+            assert [(a.alias_name, a.collection_name) for a in aliases] == [(COLLECTION_NAME, target)]
+            assert not await qdrant_client.collection_exists(previous)
+            assert (await qdrant_client.count(COLLECTION_NAME)).count == 2 * during_points
+        finally:
+            async with scoped_transaction() as session:
+                for job in (await session.execute(select(ReindexJob))).scalars().all():
+                    await session.delete(job)
+            await embedding_index.refresh_embedding_indexes()
+            for collection in (previous, target):
+                if collection and await collection_exists(collection):
+                    await qdrant_client.delete_collection(collection)
+            await init_qdrant()
+
+@pytest.mark.asyncio
+async def test_rebuild_from_postgres_is_scoped_and_resumable():
+    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+    from models.base import RebuildJob
+    from services.rebuild import start_rebuild, run_rebuild
+
+    async def count_points(doc_id):
+        return (await qdrant_client.count(COLLECTION_NAME, count_filter=Filter(
+            must=[FieldCondition(key="document_id", match=MatchValue(value=str(doc_id)))]
+        ))).count
+
+    docs = []
+    for i in range(3):
+        job_id, doc_id = await setup_job(f"rebuild_{i}.pdf")
+        await process_document(job_id)
+        docs.append(doc_id)
+    original = {doc_id: await count_points(doc_id) for doc_id in docs}
+    assert all(original.values())
+
+    # Qdrant loses everything; the PDFs are long gone
+    await qdrant_client.delete_collection(COLLECTION_NAME)
+    await init_qdrant()
+
+    job_id = await start_rebuild(document_id=docs[1])
+    assert await run_rebuild(job_id) == original[docs[1]]
+    assert [await count_points(doc_id) for doc_id in docs] == [0, original[docs[1]], 0]
+
+    # A full rebuild dies after two batches, then resumes from its cursor
+    calls = 0
+    async def flaky_embed(texts):
+        nonlocal calls
+        calls += 1
+        if calls == 3:
+            raise EmbeddingFatalError("quota exhausted")
+        return [[0.1] * 768 for _ in texts]
+    job_id = await start_rebuild()
+    with patch("services.ingestion.generate_embeddings", side_effect=flaky_embed), \
+         patch("services.rebuild.settings.EMBEDDING_BATCH_SIZE", 1), \
+         patch("services.rebuild.settings.REBUILD_MAX_IN_FLIGHT", 1), \
+         patch("services.rebuild.settings.REBUILD_FETCH_SIZE", 3), \
+         patch("services.ingestion.settings.EMBEDDING_CACHE_ENABLED", False):
+        with pytest.raises(EmbeddingFatalError):
+            await run_rebuild(job_id)
+        async with AsyncSessionLocal() as session:
+            job = await session.get(RebuildJob, job_id)
+            assert job.status == "RUNNING"
+        await run_rebuild(job_id)
+
+    assert {doc_id: await count_points(doc_id) for doc_id in docs} == original
+    async with AsyncSessionLocal() as session:
+        job = await session.get(RebuildJob, job_id)
+        assert job.status == "COMPLETED"
+        assert job.documents_done == 3 and job.chunks_done == sum(original.values())
+
+@pytest.mark.asyncio
+async def test_rebuild_drops_vectors_of_documents_deleted_mid_rebuild():
+    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+    from services.rebuild import start_rebuild, run_rebuild
+
+    async def count_points(doc_id):
+        return (await qdrant_client.count(COLLECTION_NAME, count_filter=Filter(
+            must=[FieldCondition(key="document_id", match=MatchValue(value=str(doc_id)))]
+        ))).count
+
+    docs = []
+    for i in range(2):
+        job_id, doc_id = await setup_job(f"rebuild_race_{i}.pdf")
+        await process_document(job_id)
+        docs.append(doc_id)
+    # The rebuild streams documents in id order: the first is deleted while its first batch embeds
+    first, second = sorted(docs)
+    kept = await count_points(second)
+
+    deleted = False
+    async def deleting_embed(texts):
+        nonlocal deleted
+        if not deleted:
+            deleted = True
+            await execute_deletion_saga(first)
+        return [[0.1] * 768 for _ in texts]
+    job_id = await start_rebuild()
+    with patch("services.ingestion.generate_embeddings", side_effect=deleting_embed), \
+         patch("services.ingestion.settings.EMBEDDING_CACHE_ENABLED", False):
+        await run_rebuild(job_id)
+
+    assert deleted
+    assert await count_points(first) == 0
+    assert await count_points(second) == kept
+
+@pytest.mark.asyncio
+async def test_bulk_load_rebuild_pauses_indexing():
+    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+    from core.qdrant import is_bulk_loading, upload_points_bulk
+    from services.rebuild import start_rebuild, run_rebuild
+
+    docs = []
+    for i in range(2):
+        job_id, doc_id = await setup_job(f"bulk_{i}.pdf")
+        await process_document(job_id)
+        docs.append(doc_id)
+    original = (await qdrant_client.count(COLLECTION_NAME)).count
+    await qdrant_client.delete_collection(COLLECTION_NAME)
+    await init_qdrant()
+
+    job_id = await start_rebuild()
+    with patch.object(qdrant_client, "update_collection", AsyncMock(return_value=True)) as update_collection, \
+         patch("services.rebuild.settings.EMBEDDING_BATCH_SIZE", 1), \
+         patch("services.ingestion.settings.QDRANT_BULK_BUFFER_POINTS", 1), \
+         patch("services.ingestion.upload_points_bulk", wraps=upload_points_bulk) as upload:
+        assert await run_rebuild(job_id, bulk=True) == original
+
+    # Indexing was switched off for the load and the previous threshold put back afterwards
+    thresholds = [call.kwargs["optimizers_config"].indexing_threshold for call in update_collection.call_args_list]
+    assert thresholds[0] == 0 and thresholds[-1] not in (0, None)
+    assert not is_bulk_loading(COLLECTION_NAME)
+    assert upload.call_count == original
+    assert (await qdrant_client.count(COLLECTION_NAME)).count == original
+    for doc_id in docs:
+        assert (await qdrant_client.count(COLLECTION_NAME, count_filter=Filter(
+            must=[FieldCondition(key="document_id", match=MatchValue(value=str(doc_id)))]
+        ))).count
+
+@pytest.mark.asyncio
+async def test_wait_until_indexed_waits_for_the_optimizer():
+    from unittest.mock import MagicMock
+    from core.qdrant import wait_until_indexed
+    def info(status, threshold):
+        collection = MagicMock(status=status)
+        collection.config.optimizer_config.indexing_threshold = threshold
+        return collection
+    # Still green from before the restore, then the optimizer picks the new threshold up
+    states = [info("green", 0), info("green", 20000), info("yellow", 20000), info("yellow", 20000), info("green", 20000)]
+    with patch.object(qdrant_client, "get_collection", AsyncMock(side_effect=states)) as get_collection:
+        await wait_until_indexed(COLLECTION_NAME, 20000, poll_seconds=0)
+    assert get_collection.call_count == len(states)
+
+@pytest.mark.asyncio
+async def test_concurrent_bulk_loads_share_one_pause():
+    from unittest.mock import MagicMock
+    from core.qdrant import bulk_load, is_bulk_loading, DEFAULT_INDEXING_THRESHOLD
+    thresholds = []
+    current = {"threshold": 10000}
+    async def slow_get_collection(name):
+        await asyncio.sleep(0.05)
+        info = MagicMock(status="green")
+        info.config.optimizer_config.indexing_threshold = current["threshold"]
+        return info
+    async def update_collection(collection_name, optimizers_config):
+        thresholds.append(optimizers_config.indexing_threshold)
+        current["threshold"] = optimizers_config.indexing_threshold
+        return True
+    async def load():
+        async with bulk_load(COLLECTION_NAME):
+            await asyncio.sleep(0.01)
+
+    with patch.object(qdrant_client, "get_collection", side_effect=slow_get_collection), \
+         patch.object(qdrant_client, "update_collection", side_effect=update_collection), \
+         patch("core.qdrant.wait_until_indexed", AsyncMock()):
+        # The second load starts while the first is still reading the threshold to restore
+        await asyncio.gather(load(), load())
+        assert thresholds == [0, 10000]
+        assert not is_bulk_loading(COLLECTION_NAME)
+
+        # Indexing left paused by a load elsewhere is never "restored" to 0
+        thresholds.clear()
+        current["threshold"] = 0
+        await load()
+        assert thresholds == [0, DEFAULT_INDEXING_THRESHOLD]
+
+def test_collection_profiles():
+    from core.qdrant import COLLECTION_PROFILES, collection_config, get_search_params
+    default = collection_config(COLLECTION_PROFILES["default"], 768)
+    assert "quantization_config" not in default and not default["vectors_config"].on_disk
+    assert get_search_params(COLLECTION_PROFILES["default"]) is None
+
+    scalar = collection_config(COLLECTION_PROFILES["scalar"], 768)
+    assert scalar["vectors_config"].on_disk
+    assert scalar["quantization_config"].scalar.always_ram
+    params = get_search_params(COLLECTION_PROFILES["binary"])
+    assert params.quantization.rescore and params.quantization.oversampling == 3.0
+
+@pytest.mark.asyncio
+async def test_tenant_partitioned_layout_and_alias():
+    from core.qdrant import collection_config, collection_exists, COLLECTION_PROFILES
+    from qdrant_client.http.models import CreateAlias, CreateAliasOperation
+    hnsw = collection_config(COLLECTION_PROFILES["default"], 768, tenant_partitioned=True)["hnsw_config"]
+    assert hnsw.m == 0 and hnsw.payload_m == 16
+
+    # After a layout migration COLLECTION_NAME is an alias; init_qdrant must not recreate it
+    await qdrant_client.create_collection("migrated_chunks", **collection_config(COLLECTION_PROFILES["default"], 768))
+    await qdrant_client.update_collection_aliases(change_aliases_operations=[
+        CreateAliasOperation(create_alias=CreateAlias(collection_name="migrated_chunks", alias_name="migrated_alias"))
+    ])
+    try:
+        assert await collection_exists("migrated_alias")
+        assert not await collection_exists("no_such_collection")
+    finally:
+        await qdrant_client.delete_collection("migrated_chunks")
+
+def _make_pdf(path, num_pages: int):
+    import fitz
+    doc = fitz.open()
+    for i in range(num_pages):
+        page = doc.new_page()
+        page.insert_textbox(page.rect + (36, 36, -36, -36), f"Page {i} body text for chunking. " * 80, fontsize=8)
+    doc.save(str(path))
+    doc.close()
+
+async def _drain_extractor(extractor, file_path):
+    queue = asyncio.Queue(maxsize=10)
+    loop = asyncio.get_running_loop()
+    producer = asyncio.create_task(asyncio.to_thread(extractor, file_path, loop, queue))
+    items = []
+    while True:
+        item = await queue.get()
+        if item is None or isinstance(item, Exception):
+            break
+        if not isinstance(item, ResumePoint):
+            items.append(item)
+    await producer
+    return items, item
+
+@pytest.mark.asyncio
+async def test_process_pool_extraction_matches_thread(tmp_path):
+    from services.chunking import extract_and_chunk_sync, extract_and_chunk_in_pool
+    pdf_path = tmp_path / "pool.pdf"
+    _make_pdf(pdf_path, 5)
+    
+    thread_items, thread_eof = await _drain_extractor(extract_and_chunk_sync, str(pdf_path))
+    pool_items, pool_eof = await _drain_extractor(extract_and_chunk_in_pool, str(pdf_path))
+    
+    assert thread_eof is None and pool_eof is None
+    assert len(thread_items) > 1
+    assert [(p, list(c)) for p, c in pool_items] == [(p, list(c)) for p, c in thread_items]
+    
+    # Errors cross the process boundary as regular stream items
+    _, missing = await _drain_extractor(extract_and_chunk_in_pool, str(tmp_path / "missing.pdf"))
+    assert isinstance(missing, FileNotFoundError)
+
+@pytest.mark.asyncio
+async def test_process_pool_extraction_drains_items_sent_before_exit():
+    import queue
+    import threading
+    from concurrent.futures import Future
+    from unittest.mock import MagicMock
+    from services.chunking import extract_and_chunk_in_pool
+
+    class LateChannel(queue.Queue):
+        # Every blocking get times out, as if the worker flushed its last items just after
+        def get(self, block=True, timeout=None):
+            if block:
+                raise queue.Empty
+            return super().get(block=False)
+
+    def extraction(items):
+        channel = LateChannel()
+        for item in items:
+            channel.put(item)
+        manager = MagicMock()
+        manager.Queue.return_value = channel
+        manager.Event.return_value = threading.Event()
+        finished = Future()
+        finished.set_result(None)
+        pool = MagicMock()
+        pool.submit.return_value = finished
+        return patch("services.chunking._get_process_pool", return_value=(pool, manager))
+
+    with extraction([("parent", ["child"]), None]):
+        items, eof = await _drain_extractor(extract_and_chunk_in_pool, "late.pdf")
+    assert items == [("parent", ["child"])] and eof is None
+
+    # Without an EOF the stream still ends with an error
+    with extraction([("parent", ["child"])]):
+        items, eof = await _drain_extractor(extract_and_chunk_in_pool, "late.pdf")
+    assert items == [("parent", ["child"])] and isinstance(eof, RuntimeError)
+
+@pytest.mark.asyncio
+async def test_process_pool_ingestion():
+    job_id, doc_id = await setup_job("pool_doc.pdf")
+    with patch("services.ingestion.settings.EXTRACTION_PROCESS_POOL_SIZE", 1):
+        await process_document(job_id)
+    
+    async with AsyncSessionLocal() as session:
+        doc = await session.get(Document, doc_id)
+        assert doc.status == "COMPLETED"
+        chunks = await session.execute(select(DocumentChunk).where(DocumentChunk.document_id == doc_id))
+        assert len(chunks.scalars().all()) > 0
+
+def test_process_pool_created_once_under_concurrent_first_use():
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from unittest.mock import MagicMock
+    from services import chunking
+    
+    def slow_manager():
+        time.sleep(0.05)
+        return MagicMock()
+    
+    ctx = MagicMock()
+    ctx.Manager.side_effect = slow_manager
+    barrier = threading.Barrier(8)
+    def first_use():
+        barrier.wait()
+        return chunking._get_process_pool()
+    
+    with patch.object(chunking, "_process_pool", None), patch.object(chunking, "_pool_manager", None), \
+         patch("services.chunking.multiprocessing.get_context", return_value=ctx), \
+         patch("services.chunking.ProcessPoolExecutor") as executor:
+        with ThreadPoolExecutor(max_workers=8) as threads:
+            pools = list(threads.map(lambda _: first_use(), range(8)))
+    
+    # Every caller gets the same pool; no extra pools or manager processes are leaked
+    assert ctx.Manager.call_count == 1 and executor.call_count == 1
+    assert len({(id(pool), id(manager)) for pool, manager in pools}) == 1
+
+@pytest.mark.asyncio
+async def test_identical_upload_clones_existing_chunks():
+    source_job_id, source_doc_id = await setup_job("original.pdf")
+    clone_job_id, clone_doc_id = await setup_job("renamed_copy.pdf")
+    async with scoped_transaction() as session:
+        for doc_id in (source_doc_id, clone_doc_id):
+            doc = await session.get(Document, doc_id)
+            doc.content_sha256 = "ab" * 32
+
+    await process_document(source_job_id)
+
+    # The second document must be served entirely from the first one's chunks
+    with patch("services.ingestion.generate_embeddings", side_effect=EmbeddingFatalError("should not embed")), \
+         patch("services.ingestion.extract_and_chunk_sync", side_effect=AssertionError("should not extract")):
+        await process_document(clone_job_id)
+
+    async with AsyncSessionLocal() as session:
+        clone_doc = await session.get(Document, clone_doc_id)
+        assert clone_doc.status == "COMPLETED"
+        assert clone_doc.embedding_model_version == "text-embedding-004"
+        source_parents = (await session.execute(select(DocumentChunk).where(DocumentChunk.document_id == source_doc_id))).scalars().all()
+        clone_parents = (await session.execute(select(DocumentChunk).where(DocumentChunk.document_id == clone_doc_id))).scalars().all()
+        clone_owner = clone_doc.user_id
+    assert sorted(p.content for p in clone_parents) == sorted(p.content for p in source_parents)
+
+    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+    def points_for(doc_id):
+        return Filter(must=[FieldCondition(key="document_id", match=MatchValue(value=str(doc_id)))])
+    source_points, _ = await qdrant_client.scroll(COLLECTION_NAME, scroll_filter=points_for(source_doc_id), limit=10000)
+    clone_points, _ = await qdrant_client.scroll(COLLECTION_NAME, scroll_filter=points_for(clone_doc_id), limit=10000)
+    assert len(clone_points) == len(source_points) > 0
+    clone_parent_ids = {str(p.id) for p in clone_parents}
+    for point in clone_points:
+        assert point.payload["user_id"] == str(clone_owner)
+        assert point.payload["parent_chunk_id"] in clone_parent_ids
+
+    # Deleting the clone must leave the original intact
+    await execute_deletion_saga(clone_doc_id)
+    source_points_after, _ = await qdrant_client.scroll(COLLECTION_NAME, scroll_filter=points_for(source_doc_id), limit=10000)
+    assert len(source_points_after) == len(source_points)
+
+@pytest.mark.asyncio
+async def test_reprocessing_unchanged_text_hits_embedding_cache():
+    job_id, doc_id = await setup_job("cached.pdf")
+    await process_document(job_id)
+
+    # Reprocess the same bytes: the idempotency wipe clears the vectors, the cache must refill them
+    async with scoped_transaction() as session:
+        job = await session.get(ProcessingJob, job_id)
+        job.status = "PENDING"
+    shutil.copy("tests/fixtures/dummy.pdf", get_secure_file_path(doc_id, "cached.pdf"))
+    with patch("services.ingestion.generate_embeddings", side_effect=EmbeddingFatalError("should be cached")) as mock_embed:
+        await process_document(job_id)
+    assert mock_embed.call_count == 0
+
+    async with AsyncSessionLocal() as session:
+        doc = await session.get(Document, doc_id)
+        assert doc.status == "COMPLETED"
+    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+    points, _ = await qdrant_client.scroll(
+        COLLECTION_NAME,
+        scroll_filter=Filter(must=[FieldCondition(key="document_id", match=MatchValue(value=str(doc_id)))]),
+        limit=10000,
+        with_vectors=True,
+    )
+    assert len(points) > 0
+    # Cosine collections store the unit-normalised [0.1] * 768 mock vector
+    assert points[0].vector == pytest.approx([768 ** -0.5] * 768)
+
+@pytest.mark.asyncio
+async def test_embedding_cache_evicts_least_recently_used():
+    from core import embedding_cache
+    from models.base import EmbeddingCacheEntry
+
+    await embedding_cache.put_many("m", ["a", "b", "c"], [[1.0], [2.0], [3.0]], max_entries=100)
+    await embedding_cache.get_many("m", ["a"])  # "a" becomes the most recently used
+    await embedding_cache.put_many("m", ["d"], [[4.0]], max_entries=100)
+    assert await embedding_cache.evict(2) == 2
+
+    assert await embedding_cache.get_many("m", ["a", "b", "c", "d"]) == {"a": [1.0], "d": [4.0]}
+    # Same text under another model is a different entry
+    assert await embedding_cache.get_many("other-model", ["a"]) == {}
+    async with AsyncSessionLocal() as session:
+        remaining = (await session.execute(select(EmbeddingCacheEntry))).scalars().all()
+        assert len(remaining) == 2
+
+@pytest.mark.asyncio
+async def test_incremental_reingestion_only_embeds_changed_parents():
+    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+    job_id, doc_id = await setup_job("manual.pdf")
+
+    def extractor_for(parents):
+        def mock_extract(*args):
+            loop, queue = args[1], args[2]
+            for parent in parents:
+                asyncio.run_coroutine_threadsafe(queue.put((parent, [f"{parent} / child a", f"{parent} / child b"])), loop).result()
+            asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+        return mock_extract
+
+    embedded = []
+    async def recording_embed(texts):
+        embedded.extend(texts)
+        return [[0.1] * 768 for _ in texts]
+
+    async def stored_points():
+        points, _ = await qdrant_client.scroll(
+            COLLECTION_NAME,
+            scroll_filter=Filter(must=[FieldCondition(key="document_id", match=MatchValue(value=str(doc_id)))]),
+            limit=10000,
+        )
+        return points
+
+    original = [f"Section {i}" for i in range(10)]
+    edited = original[:4] + ["Section 4 (revised)"] + original[5:9] + ["Appendix"]
+
+    with patch("services.ingestion.settings.EMBEDDING_CACHE_ENABLED", False), \
+         patch("services.ingestion.generate_embeddings", side_effect=recording_embed):
+        with patch("services.ingestion.extract_and_chunk_sync", side_effect=extractor_for(original)):
+            await process_document(job_id)
+        points_before = {p.payload["parent_chunk_id"]: p.id for p in await stored_points()}
+        async with AsyncSessionLocal() as session:
+            parents_before = {c.content: str(c.id) for c in (await session.execute(select(DocumentChunk).where(DocumentChunk.document_id == doc_id))).scalars()}
+
+        embedded.clear()
+        async with scoped_transaction() as session:
+            job = await session.get(ProcessingJob, job_id)
+            job.status = "PENDING"
+        with patch("services.ingestion.extract_and_chunk_sync", side_effect=extractor_for(edited)):
+            await process_document(job_id)
+
+    # Only the two new parents were embedded
+    assert sorted(embedded) == sorted(f"{p} / child {c}" for p in ("Section 4 (revised)", "Appendix") for c in "ab")
+
+    async with AsyncSessionLocal() as session:
+        doc = await session.get(Document, doc_id)
+        assert doc.status == "COMPLETED"
+        assert doc.embedding_model_version == "text-embedding-004"
+        parents_after = {c.content: str(c.id) for c in (await session.execute(select(DocumentChunk).where(DocumentChunk.document_id == doc_id))).scalars()}
+    assert set(parents_after) == set(edited)
+
+    points_after = await stored_points()
+    assert len(points_after) == 2 * len(edited)
+    for point in points_after:
+        assert point.payload["parent_chunk_id"] in parents_after.values()
+    # Unchanged parents keep their row IDs and point IDs
+    points_after_by_parent = {p.payload["parent_chunk_id"]: p.id for p in points_after}
+    for text in set(original) & set(edited):
+        assert parents_after[text] == parents_before[text]
+        assert points_after_by_parent[parents_after[text]] == points_before[parents_before[text]]
+
+@pytest.mark.asyncio
+async def test_cancelled_ingestion_resumes_from_checkpoint(tmp_path):
+    from services.chunking import iter_parent_child_chunks
+    from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+    pdf_path = tmp_path / "long.pdf"
+    _make_pdf(pdf_path, 12)
+    expected_parents = [item[0] for item in iter_parent_child_chunks(str(pdf_path)) if not isinstance(item, ResumePoint)]
+    expected_children = sum(len(item[1]) for item in iter_parent_child_chunks(str(pdf_path)) if not isinstance(item, ResumePoint))
+
+    job_id, doc_id = await setup_job("long.pdf", copy_dummy=False)
+    shutil.copy(pdf_path, get_secure_file_path(doc_id, "long.pdf"))
+
+    # First run: hang on the 4th batch, after three batches were upserted and checkpointed
+    embedded = []
+    stalled = asyncio.Event()
+    calls = 0
+    async def stalling_embed(texts):
+        nonlocal calls
+        calls += 1
+        if calls == 4:
+            stalled.set()
+            await asyncio.sleep(3600)
+        embedded.extend(texts)
+        return [[0.1] * 768 for _ in texts]
+
+    with patch("services.ingestion.settings.EMBEDDING_BATCH_SIZE", 10), \
+         patch("services.ingestion.settings.EMBEDDING_MAX_IN_FLIGHT", 1), \
+         patch("services.ingestion.settings.EMBEDDING_CACHE_ENABLED", False):
+        with patch("services.ingestion.generate_embeddings", side_effect=stalling_embed):
+            task = asyncio.create_task(process_document(job_id))
+            await asyncio.wait_for(stalled.wait(), timeout=10)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        async with AsyncSessionLocal() as session:
+            job = await session.get(ProcessingJob, job_id)
+            assert job.checkpoint_page is not None and job.checkpoint_chunk_index is not None
+            checkpoint_index = job.checkpoint_chunk_index
+            kept = {c.id: c.content for c in (await session.execute(
+                select(DocumentChunk).where(DocumentChunk.document_id == doc_id, DocumentChunk.chunk_index <= checkpoint_index)
+            )).scalars()}
+            job.status = "PENDING"
+            await session.commit()
+        assert len(kept) == checkpoint_index + 1
+        assert os.path.exists(get_secure_file_path(doc_id, "long.pdf")), "Cancelled runs must keep the file"
+
+        # Second run: only work after the checkpoint is redone
+        embedded.clear()
+        async def recording_embed(texts):
+            embedded.extend(texts)
+            return [[0.1] * 768 for _ in texts]
+        with patch("services.ingestion.generate_embeddings", side_effect=recording_embed):
+            await process_document(job_id)
+
+    assert 0 < len(embedded) < expected_children
+    async with AsyncSessionLocal() as session:
+        job = await session.get(ProcessingJob, job_id)
+        assert job.status == "COMPLETED"
+        assert job.checkpoint_page is None and job.checkpoint_carry is None
+        parents = (await session.execute(
+            select(DocumentChunk).where(DocumentChunk.document_id == doc_id).order_by(DocumentChunk.chunk_index)
+        )).scalars().all()
+    # Same chunks as an uninterrupted run, in order, and the pre-checkpoint rows were kept as-is
+    assert [p.content for p in parents] == expected_parents
+    assert [p.chunk_index for p in parents] == list(range(len(expected_parents)))
+    assert {p.id: p.content for p in parents[:checkpoint_index + 1]} == kept
+
+    points, _ = await qdrant_client.scroll(
+        COLLECTION_NAME,
+        scroll_filter=Filter(must=[FieldCondition(key="document_id", match=MatchValue(value=str(doc_id)))]),
+        limit=10000,
+    )
+    assert len(points) == expected_children
+    assert {p.payload["parent_chunk_id"] for p in points} == {str(p.id) for p in parents}
+
+@pytest.mark.asyncio
+async def test_replace_document_requeues_existing_job():
+    import io
+    from fastapi import UploadFile
+    from starlette.datastructures import Headers
+    from api.routers.documents import replace_document
+    job_id, doc_id = await setup_job("replaced.pdf")
+    async with scoped_transaction() as session:
+        doc = await session.get(Document, doc_id)
+        doc.status = "COMPLETED"
+        job = await session.get(ProcessingJob, job_id)
+        job.status = "COMPLETED"
+        job.checkpoint_page = 3
+        user = await session.get(User, doc.user_id)
+    
+    upload = UploadFile(file=io.BytesIO(b"%PDF-1.4 replaced"), filename="replaced.pdf", headers=Headers({"content-type": "application/pdf"}))
+    with patch("api.routers.documents.trigger_new_job"):
+        await replace_document(doc_id, upload, user)
+    
+    # The existing job is reset rather than joined by a second one the worker would also claim
+    async with AsyncSessionLocal() as session:
+        jobs = (await session.execute(select(ProcessingJob).where(ProcessingJob.document_id == doc_id))).scalars().all()
+        assert [job.id for job in jobs] == [job_id]
+        assert jobs[0].status == "PENDING"
+        assert jobs[0].checkpoint_page is None
+        assert (await session.get(Document, doc_id)).status == "PENDING"
+    os.remove(get_secure_file_path(doc_id, "replaced.pdf"))
+
+@pytest.mark.asyncio
+async def test_sharded_extraction_merges_in_page_order(tmp_path):
+    from services.chunking import extract_and_chunk_sync, extract_and_chunk_sharded
+    import fitz
+    pdf_path = tmp_path / "sharded.pdf"
+    doc = fitz.open()
+    for i in range(12):
+        page = doc.new_page()
+        # Every word is unique, so a word glued to its neighbour at a seam can't hide
+        words = " ".join(f"p{i}w{j}" for j in range(300))
+        page.insert_textbox(page.rect + (36, 36, -36, -36), f"Marker{i} {words}", fontsize=8)
+    doc.save(str(pdf_path))
+    doc.close()
+    thread_items, _ = await _drain_extractor(extract_and_chunk_sync, str(pdf_path))
+    
+    # A single shard covering the whole document is identical to the sequential stream
+    with patch("services.chunking.settings.EXTRACTION_SHARD_PAGES", 100):
+        single_items, eof = await _drain_extractor(extract_and_chunk_sharded, str(pdf_path))
+    assert eof is None
+    assert [(p, list(c)) for p, c in single_items] == [(p, list(c)) for p, c in thread_items]
+    
+    with patch("services.chunking.settings.EXTRACTION_SHARD_PAGES", 4):
+        sharded_items, eof = await _drain_extractor(extract_and_chunk_sharded, str(pdf_path))
+    assert eof is None
+    parents = [p for p, _ in sharded_items]
+    
+    # Every page shows up, in page order
+    first_seen = [next(i for i, p in enumerate(parents) if f"Marker{page}" in p) for page in range(12)]
+    assert first_seen == sorted(first_seen)
+    
+    # Every word the sequential stream keeps intact is intact in the sharded output, and the words
+    # either side of a shard seam are never glued together
+    page_words = {f"Marker{i}" for i in range(12)} | {f"p{i}w{j}" for i in range(12) for j in range(300)}
+    sequential_words = {word for p, _ in thread_items for word in p.split()}
+    sharded_words = {word for p in parents for word in p.split()}
+    assert sequential_words & page_words <= sharded_words
+    assert all({f"p{seam - 1}w299", f"Marker{seam}"} <= sharded_words for seam in (4, 8))
+    
+    _, missing = await _drain_extractor(extract_and_chunk_sharded, str(tmp_path / "missing.pdf"))
+    assert isinstance(missing, FileNotFoundError)
+
+def _langchain_chunk_pages(page_texts):
+    """The original langchain-backed streaming loop, kept as the reference for byte-identity."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from services.chunking import PARENT_CHUNK_SIZE, PARENT_CHUNK_OVERLAP, CHILD_CHUNK_SIZE, CHILD_CHUNK_OVERLAP, MAX_BUFFER_SIZE
+    separators = ["\n\n", "\n", " ", ""]
+    parent_splitter = RecursiveCharacterTextSplitter(chunk_size=PARENT_CHUNK_SIZE, chunk_overlap=PARENT_CHUNK_OVERLAP, separators=separators)
+    child_splitter = RecursiveCharacterTextSplitter(chunk_size=CHILD_CHUNK_SIZE, chunk_overlap=CHILD_CHUNK_OVERLAP, separators=separators)
+    buffer = ""
+    for page_text in page_texts:
+        buffer += page_text + "\n"
+        while len(buffer) >= PARENT_CHUNK_SIZE * 2:
+            chunks = parent_splitter.split_text(buffer)
+            if len(chunks) > 1:
+                for chunk in chunks[:-1]:
+                    yield chunk, child_splitter.split_text(chunk)
+                buffer = chunks[-1]
+            else:
+                if len(buffer) > MAX_BUFFER_SIZE:
+                    yield buffer, child_splitter.split_text(buffer)
+                    buffer = ""
+                break
+    if buffer.strip():
+        for chunk in parent_splitter.split_text(buffer):
+            yield chunk, child_splitter.split_text(chunk)
+
+def test_incremental_splitter_matches_langchain():
+    import random
+    from services.chunking import _chunk_pages
+    rng = random.Random(0)
+    
+    def random_page(length):
+        parts = []
+        while sum(map(len, parts)) < length:
+            roll = rng.random()
+            if roll < 0.7:
+                # Mostly short words, occasionally an unbreakable run longer than a parent
+                word_len = rng.choice([400, 1500]) if rng.random() < 0.02 else rng.randint(1, 10)
+                parts.append("".join(rng.choice("abcdefgh") for _ in range(word_len)))
+            elif roll < 0.85:
+                parts.append(" " * rng.randint(1, 3))
+            elif roll < 0.95:
+                parts.append("\n")
+            else:
+                parts.append("\n\n")
+        return "".join(parts)
+        
+    for _ in range(100):
+        pages = [random_page(rng.choice([0, 50, 500, 3000, 12000])) for _ in range(rng.randint(1, 6))]
+        assert list(_chunk_pages(pages)) == list(_langchain_chunk_pages(pages))
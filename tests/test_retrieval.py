@@ -1,15 +1,18 @@
 import pytest
 import pytest_asyncio
+import asyncio
 import uuid
 import time
+import json
+import shutil
 from sqlmodel import SQLModel
 from core.database import AsyncSessionLocal, engine
-from models.base import User, Document, ProcessingJob
+from models.base import User, Document, DocumentChunk, ProcessingJob, Conversation
 from core.transactions import scoped_transaction
 from core.qdrant import init_qdrant, qdrant_client, COLLECTION_NAME
-from services.ingestion import process_document
+from core.storage import get_secure_file_path
+from services.ingestion import process_document, execute_deletion_saga
 from services.retrieval import retrieve_context
-from services.generation import generate_answer
 from unittest.mock import patch
 
 class MockMessage:
@@ -44,12 +47,12 @@ def mock_groq():
     with patch("services.generation.groq_client", mock_client):
         yield
 
-async def mock_generate_embeddings(texts):
+async def mock_generate_embeddings(texts, priority=None):
     return [[0.1] * 768 for _ in texts]
 
 @pytest.fixture(autouse=True)
 def mock_embeds():
-    with patch("services.retrieval.generate_embeddings", side_effect=mock_generate_embeddings):
+    with patch("core.embeddings.generate_embeddings", side_effect=mock_generate_embeddings):
         with patch("services.ingestion.generate_embeddings", side_effect=mock_generate_embeddings):
             yield
 
@@ -83,6 +86,7 @@ async def setup_ingested_doc(filename: str):
 
 @pytest.mark.asyncio
 async def test_hallucination_cases():
+    from services.generation import generate_answer
     user_id, _ = await setup_ingested_doc("test.pdf")
     
     # Case A: Answer exists
@@ -111,6 +115,7 @@ async def test_security_isolation():
     
 @pytest.mark.asyncio
 async def test_performance_latency():
+    from services.generation import generate_answer
     user_id, _ = await setup_ingested_doc("perf_doc.pdf")
     
     start = time.time()
@@ -122,3 +127,200 @@ async def test_performance_latency():
     gen_time = time.time() - start_gen
     
     assert retrieval_time < 1.0 
+
+@pytest.mark.asyncio
+async def test_dense_retrieval_groups_by_parent():
+    from qdrant_client.http.models import PointStruct
+
+    _, doc_id = await setup_ingested_doc("grouped.pdf")
+    # 30 more parents with one child each, all a little further from the query than the
+    # 25 extra copies of the original children
+    async with scoped_transaction() as session:
+        extra = [DocumentChunk(document_id=doc_id, content=f"Extra parent {i}", chunk_index=100 + 2 * i) for i in range(30)]
+        session.add_all(extra)
+    points, _ = await qdrant_client.scroll(COLLECTION_NAME, limit=100, with_payload=True, with_vectors=True)
+    user_id = points[0].payload["user_id"]
+    await qdrant_client.upsert(COLLECTION_NAME, points=[
+        PointStruct(id=str(uuid.uuid4()), vector=p.vector, payload=p.payload) for p in points for _ in range(25)
+    ] + [
+        PointStruct(id=str(uuid.uuid4()), vector=[0.1] * 767 + [0.05], payload={
+            "user_id": user_id, "document_id": str(doc_id), "parent_chunk_id": str(chunk.id), "page_number": 1
+        }) for chunk in extra
+    ])
+
+    results = []
+    query_points_groups = qdrant_client.query_points_groups
+    async def recording_query(**kwargs):
+        results.append(await query_points_groups(**kwargs))
+        return results[-1]
+    with patch("services.retrieval.generate_query_embedding", return_value=[0.1] * 768), \
+         patch.object(qdrant_client, "query_points_groups", side_effect=recording_query):
+        context, sources = await retrieve_context("Mocked content", uuid.UUID(user_id), top_k=20, score_threshold=0.0)
+
+    group_ids = [group.id for group in results[0].groups]
+    assert len(set(group_ids)) == 20
+    assert "Extra parent" in context
+
+@pytest.mark.asyncio
+async def test_query_rewrite_skipped_or_cached():
+    from unittest.mock import MagicMock
+    from services import retrieval
+    for query in ["What is the refund policy?", "Who signed the 2023 supplier contract?", "List the termination clauses"]:
+        assert not retrieval.needs_rewrite(query)
+    for query in ["What does it cost?", "And in 2023?", "Tell me more about those", "What about the second one", "Summarize the above..."]:
+        assert retrieval.needs_rewrite(query)
+
+    groq = MagicMock()
+    groq.chat.completions.create = AsyncMock(return_value=MagicMock(choices=[MagicMock(message=MagicMock(content="Refund policy cost"))]))
+    history = [{"role": "user", "content": "What is the refund policy?"}, {"role": "model", "content": "30 days."}]
+    conversation_id = uuid.uuid4()
+    with patch.object(retrieval, "groq_client", groq):
+        assert await retrieval.rewrite_query_standalone("What is the refund policy?", history, conversation_id) == "What is the refund policy?"
+        assert await retrieval.rewrite_query_standalone("What does it cost?", history, conversation_id) == "Refund policy cost"
+        # A retry against the same answer reuses the rewrite; a new answer invalidates it
+        retry = history + [{"role": "user", "content": "What does it cost?"}]
+        assert await retrieval.rewrite_query_standalone("what does it cost? ", retry, conversation_id) == "Refund policy cost"
+        assert groq.chat.completions.create.call_count == 1
+        await retrieval.rewrite_query_standalone("What does it cost?", retry + [{"role": "model", "content": "Free."}], conversation_id)
+        assert groq.chat.completions.create.call_count == 2
+
+@pytest.mark.asyncio
+async def test_speculative_retrieval():
+    from services import retrieval
+    searched, cancelled = [], []
+    async def rank_parents(search_query, *args):
+        searched.append(search_query)
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.append(search_query)
+            raise
+        return {}
+    rewrites = iter(["What does it cost?", "What does the premium plan cost?"])
+    async def rewrite(query, history, conversation_id=None):
+        await asyncio.sleep(0.02)
+        return next(rewrites)
+
+    history = [{"role": "user", "content": "Tell me about the premium plan"}, {"role": "model", "content": "It has..."}]
+    with patch.object(retrieval.settings, "RETRIEVAL_SPECULATIVE", True), \
+         patch.object(retrieval, "groq_client", object()), \
+         patch.object(retrieval, "_rank_parents", side_effect=rank_parents), \
+         patch.object(retrieval, "rewrite_query_standalone", side_effect=rewrite):
+        # Rewrite unchanged: the search started with the raw query is used as is
+        assert await retrieval.retrieve_context("What does it cost?", uuid.uuid4(), chat_history=history) == ("", [])
+        assert searched == ["What does it cost?"] and not cancelled
+        # Rewrite differs: the speculative search is cancelled and the rewrite searched
+        searched.clear()
+        await retrieval.retrieve_context("What does it cost?", uuid.uuid4(), chat_history=history)
+        assert searched == ["What does it cost?", "What does the premium plan cost?"]
+        assert cancelled == ["What does it cost?"]
+
+@pytest.mark.asyncio
+async def test_retrieval_cache_invalidated_by_corpus_changes():
+    from services import retrieval
+    user_id, _ = await setup_ingested_doc("cached.pdf")
+    async with AsyncSessionLocal() as session:
+        assert (await session.get(User, user_id)).corpus_generation == 1
+
+    with patch("services.retrieval.generate_query_embedding", return_value=[0.1] * 768), \
+         patch.object(retrieval, "_rank_parents", wraps=retrieval._rank_parents) as rank_parents:
+        first = await retrieval.retrieve("Mocked content", user_id, score_threshold=0.0)
+        again = await retrieval.retrieve("mocked  CONTENT", user_id, score_threshold=0.0)
+        assert rank_parents.call_count == 1
+        assert again == first and first.context and first.parent_ids
+        # Another document of the same user invalidates the cached result
+        async with scoped_transaction() as session:
+            doc = Document(user_id=user_id, filename="second.pdf")
+            session.add(doc)
+            await session.flush()
+            job = ProcessingJob(document_id=doc.id)
+            session.add(job)
+            await session.flush()
+            second_doc, second_job = doc.id, job.id
+        shutil.copy("tests/fixtures/dummy.pdf", get_secure_file_path(second_doc, "second.pdf"))
+        await process_document(second_job)
+        assert "second.pdf" in (await retrieval.retrieve("Mocked content", user_id, score_threshold=0.0)).context
+        assert rank_parents.call_count == 2
+        await execute_deletion_saga(second_doc)
+        after_delete = await retrieval.retrieve("Mocked content", user_id, score_threshold=0.0)
+        assert rank_parents.call_count == 3
+        assert "second.pdf" not in after_delete.context
+    assert retrieval.retrieval_cache.stats()["hits"] >= 1
+
+@pytest.mark.asyncio
+async def test_semantic_answer_cache():
+    from services.answer_cache import SemanticAnswerCache, replay_answer
+    cache = SemanticAnswerCache(enabled=True, threshold=0.95, max_scopes=10, max_per_scope=2, max_bytes=1 << 20, ttl=60)
+    user_id, parents = uuid.uuid4(), [uuid.uuid4(), uuid.uuid4()]
+    question = [1.0, 0.0, 0.0]
+    cache.store(user_id, 3, None, question, parents, "Refunds take 30 days. [Source: a.pdf, Page: 1]", 1.5)
+
+    reworded = [0.99, 0.1, 0.0]
+    hit = cache.lookup(user_id, 3, None, reworded, list(reversed(parents)))
+    assert hit and hit.answer.startswith("Refunds")
+    assert cache.lookup(user_id, 3, None, [0.6, 0.8, 0.0], parents) is None  # Different question
+    assert cache.lookup(user_id, 3, None, reworded, parents[:1]) is None  # Different parents retrieved
+    assert cache.lookup(user_id, 4, None, reworded, parents) is None  # Corpus changed
+    assert cache.lookup(user_id, 3, [uuid.uuid4()], reworded, parents) is None  # Other document set
+    assert cache.lookup(uuid.uuid4(), 3, None, reworded, parents) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 5
+    assert stats["generation_seconds_saved"] == 1.5 and stats["answer_chars_saved"] == len(hit.answer)
+
+    tokens = [token async for token in replay_answer(hit.answer)]
+    assert len(tokens) > 1 and "".join(tokens) == hit.answer
+
+def test_answer_cache_scoped_by_embedding_model():
+    from services.answer_cache import SemanticAnswerCache
+    cache = SemanticAnswerCache(enabled=True, threshold=0.95, max_scopes=10, max_per_scope=2, max_bytes=1 << 20, ttl=60)
+    user_id, parents = uuid.uuid4(), [uuid.uuid4()]
+    with patch("services.answer_cache.embedding_model_version", return_value="model-a"):
+        cache.store(user_id, 1, None, [1.0, 0.0, 0.0], parents, "From model A.", 1.0)
+        # Same model, but a vector of another size is skipped rather than compared
+        assert cache.lookup(user_id, 1, None, [1.0, 0.0], parents) is None
+    with patch("services.answer_cache.embedding_model_version", return_value="model-b"):
+        # Answers found through another model's vectors are never replayed
+        assert cache.lookup(user_id, 1, None, [1.0, 0.0], parents) is None
+        assert cache.lookup(user_id, 1, None, [1.0, 0.0, 0.0], parents) is None
+    with patch("services.answer_cache.embedding_model_version", return_value="model-a"):
+        assert cache.lookup(user_id, 1, None, [1.0, 0.0, 0.0], parents).answer == "From model A."
+
+@pytest.mark.asyncio
+async def test_send_message_replays_cached_answers():
+    from api.routers import chat
+    from services.answer_cache import answer_cache
+    user_id, _ = await setup_ingested_doc("answers.pdf")
+    async with scoped_transaction() as session:
+        user = await session.get(User, user_id)
+        conversation = Conversation(user_id=user_id)
+        session.add(conversation)
+        await session.flush()
+        conversation_id = conversation.id
+
+    generated = []
+    async def stream_answer(query, context, chat_history=None):
+        generated.append(query)
+        for token in ["Refunds take ", "30 days."]:
+            yield token
+
+    async def rewrite(query, chat_history, conversation_id=None):
+        return query
+
+    async def ask(question):
+        response = await chat.send_message(conversation_id, chat.MessageRequest(content=question), user)
+        events = [event async for event in response.body_iterator]
+        return "".join(json.loads(e.split("data: ", 1)[1]) for e in events if e.startswith("event: token"))
+
+    hits = answer_cache.hits
+    with patch("services.generation.stream_answer", side_effect=stream_answer), \
+         patch("services.retrieval.rewrite_query_standalone", side_effect=rewrite), \
+         patch.object(answer_cache, "enabled", True):
+        assert await ask("What is the refund policy?") == "Refunds take 30 days."
+        # A rewording of a self-contained question is replayed without generating
+        assert await ask("what is the refund policy") == "Refunds take 30 days."
+        assert generated == ["What is the refund policy?"] and answer_cache.hits == hits + 1
+        # Follow-ups depend on the conversation, so they are always generated
+        await ask("What does it cost?")
+        await ask("What does it cost?")
+        assert generated[1:] == ["What does it cost?", "What does it cost?"]
+        assert answer_cache.hits == hits + 1